@@ -0,0 +1,159 @@
+"""
+Command to convert stored query vectors to the compact binary encoding.
+
+Usage:
+    python -m app.commands.migrate_query_vectors --course-id 12345
+    python -m app.commands.migrate_query_vectors --course-id 12345 --encoding int8 --dry-run
+
+Older chat events store query_vector as a Firestore array of doubles.
+This rewrites each of them as packed bytes (see
+analytics_logging_service.encode_query_vector). Events that are already
+encoded are skipped unless --reencode is given, which converts them to
+the requested encoding.
+"""
+import argparse
+import logging
+import sys
+import os
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from app.services.analytics_logging_service import VECTOR_ENCODING, decode_query_vector, encode_query_vector
+from app.services.firestore_service import get_analytics_events, log_analytics_events_batch
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH_SIZE = 500  # Firestore batch limit
+
+
+def migrate_query_vectors(course_id, encoding=VECTOR_ENCODING, reencode=False, dry_run=False):
+    """
+    Re-encodes the query vectors of a course's chat events.
+
+    Args:
+        course_id: Canvas course ID
+        encoding: Target encoding ('float32', 'float16' or 'int8')
+        reencode: Also convert events that are already binary-encoded
+        dry_run: If True, don't actually update the database
+
+    Returns:
+        dict: Summary of the migration
+    """
+    logger.info(f"Fetching query vectors for course {course_id}...")
+    events = get_analytics_events(course_id, event_type='chat', fields=['query_vector'])
+
+    summary = {
+        "course_id": course_id,
+        "total_queries": len(events),
+        "migrated": 0,
+        "already_encoded": 0,
+        "no_vector": 0,
+        "bytes_before": 0,
+        "bytes_after": 0
+    }
+
+    updates = []
+    for event in events:
+        value = event.get('query_vector')
+        if not value:
+            summary["no_vector"] += 1
+            continue
+        if isinstance(value, bytes) and not reencode:
+            summary["already_encoded"] += 1
+            continue
+
+        encoded = encode_query_vector(decode_query_vector(value), encoding=encoding)
+        # A Firestore double takes 8 bytes
+        summary["bytes_before"] += len(value) if isinstance(value, bytes) else 8 * len(value)
+        summary["bytes_after"] += len(encoded)
+        updates.append((event['doc_id'], {'query_vector': encoded}))
+
+    for start in range(0, len(updates), WRITE_BATCH_SIZE):
+        chunk = updates[start:start + WRITE_BATCH_SIZE]
+        if not dry_run:
+            log_analytics_events_batch(chunk)
+        summary["migrated"] += len(chunk)
+        logger.info(f"Migrated {summary['migrated']}/{len(updates)} query vectors...")
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert stored query vectors to the compact binary encoding',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+
+    parser.add_argument(
+        '--course-id',
+        required=True,
+        help='Canvas course ID'
+    )
+
+    parser.add_argument(
+        '--encoding',
+        choices=['float32', 'float16', 'int8'],
+        default=VECTOR_ENCODING,
+        help=f'Target encoding - default: {VECTOR_ENCODING}'
+    )
+
+    parser.add_argument(
+        '--reencode',
+        action='store_true',
+        help='Also convert vectors that are already binary-encoded'
+    )
+
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Report what would change without updating the database'
+    )
+
+    args = parser.parse_args()
+
+    try:
+        if args.dry_run:
+            logger.info("DRY RUN MODE - No database changes will be made")
+
+        results = migrate_query_vectors(
+            course_id=args.course_id,
+            encoding=args.encoding,
+            reencode=args.reencode,
+            dry_run=args.dry_run
+        )
+
+        # Print summary
+        print("\n" + "="*60)
+        print("MIGRATION SUMMARY")
+        print("="*60)
+        print(f"Course ID:        {results['course_id']}")
+        print(f"Total Queries:    {results['total_queries']}")
+        print(f"Migrated:         {results['migrated']} ({args.encoding})")
+        print(f"Already Encoded:  {results['already_encoded']}")
+        print(f"No Vector:        {results['no_vector']}")
+        if results['bytes_before']:
+            print(f"Vector Bytes:     {results['bytes_before']:,} -> {results['bytes_after']:,} "
+                  f"({results['bytes_before'] / results['bytes_after']:.1f}x smaller)")
+
+        if args.dry_run:
+            print("\nNOTE: This was a dry run. No changes were made to the database.")
+
+        print("="*60)
+
+        return 0
+
+    except Exception as e:
+        logger.error(f"Command failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -50,7 +50,7 @@ def rate_queries(course_id, helpful_percent=5, not_helpful_percent=15, none_perc
     
     # Get all chat events (queries) for this course using firestore_service
     logger.info(f"Fetching queries for course {course_id}...")
-    all_queries = get_analytics_events(course_id, event_type='chat')
+    all_queries = get_analytics_events(course_id, event_type='chat', fields=[])  # IDs only
     
     total_queries = len(all_queries)
     
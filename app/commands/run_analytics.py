@@ -0,0 +1,297 @@
+"""
+Command to run the analytics pipeline for every ACTIVE course (e.g. from cron).
+
+Usage:
+    python -m app.commands.run_analytics
+    python -m app.commands.run_analytics --workers 4 --timeout 600 --summary-file run.json
+    python -m app.commands.run_analytics --course-id 12345 --course-id 67890 --force
+
+Clustering is CPU-bound, so each course is analyzed in its own process
+(spawned, never forked, so no Firestore/gRPC state is shared), with up to
+--workers courses running at once. A course still running after --timeout
+seconds is killed and reported as a timeout; the other courses carry on.
+
+Courses with no chat events since their last report (the watermark of
+their saved cluster state) are skipped unless --force is given. Ratings
+added to already-reported queries don't count as new events.
+
+Example cron entry (daily at 03:00):
+    0 3 * * * cd /srv/app && python -m app.commands.run_analytics --summary-file /var/log/analytics-run.json
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import sys
+import os
+import time
+from datetime import datetime, timezone
+from multiprocessing.connection import wait
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from app.services.analytics_reporting_service import run_daily_analytics
+from app.services.firestore_service import get_cluster_state, has_analytics_events_since, list_course_ids
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+RUN_WORKERS = int(os.environ.get('ANALYTICS_RUN_WORKERS', '0')) or os.cpu_count() or 1  # Courses analyzed at once
+RUN_TIMEOUT = float(os.environ.get('ANALYTICS_RUN_TIMEOUT', '900'))  # Seconds before a course's process is killed
+START_METHOD = 'spawn'  # Workers never inherit the parent's Firestore/gRPC state
+
+
+def run_all_analytics(course_ids=None, workers=RUN_WORKERS, timeout=RUN_TIMEOUT, incremental=None,
+                      force=False, dry_run=False):
+    """
+    Runs run_daily_analytics for many courses across a pool of processes.
+
+    Args:
+        course_ids: Courses to analyze (defaults to every ACTIVE course)
+        workers: Maximum number of courses analyzed at once
+        timeout: Seconds a course may run before its process is killed
+        incremental: Passed to run_daily_analytics (defaults to ANALYTICS_INCREMENTAL)
+        force: Also analyze courses with no new events since their last report
+        dry_run: Only report which courses would be analyzed
+
+    Returns:
+        dict: Run summary with per-course status and timings
+    """
+    started_at = datetime.now(timezone.utc)
+    started = time.perf_counter()
+
+    if not course_ids:
+        logger.info("Discovering ACTIVE courses...")
+        course_ids = list_course_ids('ACTIVE')
+    # A repeated --course-id would otherwise be run twice at once
+    course_ids = list(dict.fromkeys(course_ids))
+
+    results = {}
+    due = []
+    for course_id in course_ids:
+        try:
+            if force or _has_new_events(course_id):
+                due.append(course_id)
+            else:
+                results[course_id] = {'status': 'skipped', 'seconds': 0.0}
+        except Exception as e:
+            logger.error(f"Failed to check course {course_id} for new events: {e}")
+            results[course_id] = {'status': 'error', 'error': str(e), 'seconds': 0.0}
+
+    logger.info(f"{len(due)} of {len(course_ids)} courses need analytics")
+    if dry_run:
+        results.update({course_id: {'status': 'due', 'seconds': 0.0} for course_id in due})
+    elif due:
+        results.update(_run_in_processes(due, workers, timeout, incremental))
+
+    courses = [{'course_id': course_id, **results[course_id]} for course_id in course_ids]
+    statuses = {}
+    for course in courses:
+        statuses[course['status']] = statuses.get(course['status'], 0) + 1
+
+    return {
+        'started_at': started_at.isoformat(),
+        'finished_at': datetime.now(timezone.utc).isoformat(),
+        'duration_seconds': round(time.perf_counter() - started, 2),
+        'workers': workers,
+        'timeout_seconds': timeout,
+        'total_courses': len(courses),
+        'statuses': statuses,
+        'courses': courses
+    }
+
+
+def _has_new_events(course_id):
+    """True if the course logged chat events after its last report (or was never clustered)."""
+    state = get_cluster_state(course_id)
+    watermark = state.get('watermark') if state else None
+    if watermark is None:
+        return True
+    return has_analytics_events_since(course_id, watermark)
+
+
+def _run_in_processes(course_ids, workers, timeout, incremental):
+    """
+    Analyzes each course in its own spawned process, at most `workers` at a
+    time, killing any that run longer than `timeout` seconds.
+
+    Returns:
+        dict: course_id -> result (status, seconds, and report counts or error)
+    """
+    context = multiprocessing.get_context(START_METHOD)
+    pending = list(dict.fromkeys(course_ids))
+    running = {}  # course_id -> (process, receiving end of its pipe, start time)
+    results = {}
+
+    try:
+        while pending or running:
+            while pending and len(running) < max(1, workers):
+                course_id = pending.pop(0)
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(
+                    target=_analyze_course, args=(course_id, incremental, sender), name=f'analytics-{course_id}'
+                )
+                process.start()
+                sender.close()  # The pipe reports EOF if the child dies without a result
+                running[course_id] = (process, receiver, time.monotonic())
+                logger.info(f"Started analytics for course {course_id} (pid {process.pid})")
+
+            # Sleep until a course finishes or the earliest deadline passes
+            deadline = min(start for _, _, start in running.values()) + timeout
+            wait([receiver for _, receiver, _ in running.values()], timeout=max(0.0, deadline - time.monotonic()))
+
+            now = time.monotonic()
+            for course_id, (process, receiver, start) in list(running.items()):
+                if receiver.poll():
+                    try:
+                        result = receiver.recv()
+                    except EOFError:
+                        process.join()
+                        result = {'status': 'error', 'error': f'worker exited with code {process.exitcode}'}
+                    process.join()
+                elif now - start >= timeout:
+                    process.kill()
+                    process.join()
+                    result = {'status': 'timeout', 'error': f'exceeded {timeout:g}s'}
+                else:
+                    continue
+
+                result['seconds'] = round(now - start, 2)
+                results[course_id] = result
+                receiver.close()
+                del running[course_id]
+                logger.info(f"Course {course_id}: {result['status']} in {result['seconds']}s")
+    finally:
+        # Interrupted (e.g. Ctrl+C): don't leave orphaned workers behind
+        for process, receiver, _ in running.values():
+            process.kill()
+            process.join()
+            receiver.close()
+
+    return results
+
+
+def _analyze_course(course_id, incremental, conn):
+    """Worker process entry point: runs the pipeline for one course and sends back a small result."""
+    try:
+        report = run_daily_analytics(course_id, incremental=incremental)
+        result = {
+            'status': report.get('status'),
+            'total_queries': report.get('total_queries'),
+            'num_clusters': report.get('num_clusters')
+        }
+    except Exception as e:
+        logger.error(f"Analytics failed for course {course_id}: {e}")
+        result = {'status': 'error', 'error': str(e)}
+    conn.send(result)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run analytics for every ACTIVE course across a process pool',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+
+    parser.add_argument(
+        '--course-id',
+        action='append',
+        dest='course_ids',
+        help='Only analyze this course (repeatable) - default: all ACTIVE courses'
+    )
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=RUN_WORKERS,
+        help=f'Courses analyzed at once - default: {RUN_WORKERS}'
+    )
+
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=RUN_TIMEOUT,
+        help=f'Seconds before a course is killed - default: {RUN_TIMEOUT:g}'
+    )
+
+    parser.add_argument(
+        '--incremental',
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help='Update saved clusters with new queries only - default: ANALYTICS_INCREMENTAL'
+    )
+
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Also analyze courses with no new queries since their last report'
+    )
+
+    parser.add_argument(
+        '--summary-file',
+        help='Also write the run summary to this JSON file'
+    )
+
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='List the courses that would be analyzed without running anything'
+    )
+
+    args = parser.parse_args()
+
+    try:
+        if args.dry_run:
+            logger.info("DRY RUN MODE - No analytics will be run")
+
+        summary = run_all_analytics(
+            course_ids=args.course_ids,
+            workers=args.workers,
+            timeout=args.timeout,
+            incremental=args.incremental,
+            force=args.force,
+            dry_run=args.dry_run
+        )
+
+        if args.summary_file:
+            with open(args.summary_file, 'w') as f:
+                json.dump(summary, f, indent=2)
+
+        # Print summary
+        print("\n" + "="*60)
+        print("ANALYTICS RUN SUMMARY")
+        print("="*60)
+        print(f"Courses:   {summary['total_courses']} "
+              f"({', '.join(f'{count} {status}' for status, count in sorted(summary['statuses'].items()))})")
+        print(f"Duration:  {summary['duration_seconds']}s ({summary['workers']} workers)")
+        for course in summary['courses']:
+            detail = course.get('error') or (
+                f"{course['total_queries']} queries, {course['num_clusters']} clusters"
+                if course.get('total_queries') is not None else ''
+            )
+            print(f"  {course['course_id']:<12} {course['status']:<18} {course['seconds']:>8.2f}s   {detail}")
+        if args.summary_file:
+            print(f"\nSummary written to {args.summary_file}")
+
+        if args.dry_run:
+            print("\nNOTE: This was a dry run. No analytics were run.")
+
+        print("="*60)
+
+        failed = summary['statuses'].get('error', 0) + summary['statuses'].get('timeout', 0)
+        return 1 if failed else 0
+
+    except Exception as e:
+        logger.error(f"Command failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -2,18 +2,21 @@
 Flask API Routes (ROLE 2: The "API Router")
 Handles all HTTP endpoints and connects frontend to core services.
 """
-from flask import request, render_template, jsonify, session, current_app as app
-from .services import firestore_service, rag_service, kg_service, canvas_service, gcs_service, gemini_service, analytics_logging_service, analytics_reporting_service
+from flask import request, render_template, jsonify, session, Response, stream_with_context, current_app as app
+from .services import firestore_service, rag_service, kg_service, canvas_service, gcs_service, gemini_service, analytics_logging_service, analytics_reporting_service, job_service, answer_cache_service
 import os
 import logging
-import shutil
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
 # Get Canvas API token from environment
 CANVAS_TOKEN = os.environ.get('CANVAS_API_TOKEN')
 
+# Embeds chat questions for the answer cache while the course document is read
+_query_embedder = ThreadPoolExecutor(max_workers=8, thread_name_prefix='chat-embed')
+
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -147,20 +150,24 @@ def student_view(course_id):
 @app.route('/api/initialize-course', methods=['POST'])
 def initialize_course():
     """
-    Kicks off the entire RAG + KG pipeline.
-    This is a long-running request triggered by the professor.
+    Kicks off the entire RAG + KG pipeline as a background job.
+    Returns immediately with a job ID; the professor's UI polls
+    /api/jobs/<job_id> until the job is COMPLETE.
+    
+    Pipeline stages (run by job_service, checkpointed in Firestore):
+    1. download - Download files from Canvas to local storage
+    2. upload - Upload files to Google Cloud Storage (GCS)
+    3. import - Create RAG corpus and import files from GCS
+    4. summarize - Summarize each file with Gemini
+    5. extract_topics - Use provided topics or auto-extract them
+    6. build_kg - Build knowledge graph using RAG context
+    7. finalize - Clean up local files, set Firestore status: ACTIVE
     
-    Pipeline:
-    1. Create Firestore doc with status: GENERATING
-    2. Download files from Canvas to local storage
-    3. Upload files to Google Cloud Storage (GCS)
-    4. Create RAG corpus and import files from GCS
-    5. Build knowledge graph using RAG context
-    6. Clean up local and GCS files
-    7. Finalize Firestore doc with status: ACTIVE
+    Calling this again for a course whose job crashed or timed out
+    resumes that job from its last completed stage.
     
     Returns:
-        JSON response with status and corpus info
+        202 JSON response with job_id
     """
     course_id = None
     try:
@@ -171,143 +178,100 @@ def initialize_course():
         if not course_id:
             return jsonify({"error": "course_id is required"}), 400
         
-        logger.info(f"Starting initialization for course {course_id}")
-        # Step 1: Create Firestore doc with status: GENERATING
-        logger.info("Step 1: Creating Firestore document...")
-        firestore_service.create_course_doc(course_id)
-        
-        # Step 2: Download course files from Canvas (downloads to local storage)
-        logger.info("Step 2: Fetching course files from Canvas...")
-        files, indexed_files_map = canvas_service.get_course_files(
-            course_id=course_id,
-            token=CANVAS_TOKEN,
-            download=True  # Downloads files locally and adds local_path
-        )
-        
-        if not files:
-            logger.warning(f"No files found for course {course_id}")
-            return jsonify({"error": "No course files found"}), 404
-        
-        logger.info(f"Retrieved {len(files)} files from Canvas")
+        logger.info(f"Queueing initialization for course {course_id}")
+        job_id = job_service.submit_initialize_job(course_id, topics=topics)
         
-        # Step 3: Upload files to Google Cloud Storage (GCS)
-        logger.info("Step 3: Uploading files to Google Cloud Storage...")
-        files = gcs_service.upload_course_files(files, course_id)
-        
-        # Update indexed_files_map with GCS URIs
-        for file in files:
-            file_id = str(file.get('id'))
-            if file_id in indexed_files_map and file.get('gcs_uri'):
-                indexed_files_map[file_id]['gcs_uri'] = file.get('gcs_uri')
-                indexed_files_map[file_id]['display_name'] = file.get('display_name')
-        
-        # Count successful uploads
-        successful_uploads = sum(1 for f in files if f.get('gcs_uri'))
-        logger.info(f"Uploaded {successful_uploads}/{len(files)} files to GCS")
+        return jsonify({
+            "status": "queued",
+            "job_id": job_id,
+            "course_id": course_id
+        }), 202
         
-        # Step 4: Create RAG corpus and import files from GCS
-        logger.info("Step 4: Creating RAG corpus and importing files...")
-        corpus_id = rag_service.create_and_provision_corpus(
-            files=files,
-            corpus_name_suffix=f"Course {course_id}"
-        )
-        logger.info(f"Created corpus: {corpus_id}")
+    except Exception as e:
+        logger.error(f"Error queueing initialization for course {course_id or 'unknown'}: {str(e)}", exc_info=True)
+        return jsonify({
+            "error": "Failed to initialize course",
+            "message": str(e)
+        }), 500
 
-        # Step 4.3: Summarize all files included:
-        file_to_summary = {}
-        files_processed = 0
 
-        for file in files:
-            local_path = file.get("local_path")
-            display_name = file.get("display_name") or f"file_{file.get('id')}"
+@app.route('/api/sync-course', methods=['POST'])
+def sync_course():
+    """
+    Re-syncs an ACTIVE course with Canvas as a background job.
+    Only files whose Canvas hash changed (or that were added/removed) are
+    downloaded, uploaded, re-imported and patched into the knowledge graph;
+    the course stays ACTIVE while the sync runs.
 
-            # Skip if no local path
-            if not local_path:
-                logger.info(f"Could not locate file path for {display_name}")
-                continue
+    Returns:
+        202 JSON response with job_id
+    """
+    course_id = None
+    try:
+        data = request.json
+        course_id = data.get('course_id')
 
-            summary = gemini_service.summarize_file(
-                file_path=local_path,
-            )
+        if not course_id:
+            return jsonify({"error": "course_id is required"}), 400
 
-            file_to_summary[display_name] = summary
-            files_processed += 1
-            logger.info(f"File Name: {display_name}\nSummary: {summary}")
+        state = firestore_service.get_course_state(course_id)
+        if state == 'NEEDS_INIT':
+            return jsonify({"error": f"Course {course_id} not found"}), 404
+        if state != 'ACTIVE':
+            return jsonify({"error": f"Course {course_id} is not active (status: {state})"}), 400
 
+        logger.info(f"Queueing sync for course {course_id}")
+        job_id = job_service.submit_sync_job(course_id)
 
-        # Step 4.5: Extract Topics from summaries, autogenerate topics if not provided:
-        summaries = file_to_summary.values()
-        logger.info(f"topics: {topics}")
-        if not topics or not any(t.strip() for t in topics.split(",")):
-            logger.info("No topics provided, auto-extracting generating topics from files")
-            topics = kg_service.extract_topics_from_summaries(summaries)
-            logger.info(f"Auto-extracted topics: {topics}")
-        else:
-            topics = topics.split(",")
-        
-        # Step 5: Build knowledge graph
-        logger.info("Step 5: Building knowledge graph...")
-        kg_nodes, kg_edges, kg_data = kg_service.build_knowledge_graph(
-            topic_list=topics,
-            corpus_id=corpus_id,
-            files=files
-        )
-        logger.info("Knowledge graph built successfully")
-        
-        # Step 6: Clean up local files
-        logger.info("Step 6: Cleaning up local files...")
-        local_dir = os.path.join('app', 'data', 'courses', course_id)
-        if os.path.exists(local_dir):
-            shutil.rmtree(local_dir)
-            logger.info(f"Deleted local directory: {local_dir}")
-        
-        # Step 7: Keep GCS files for future use (no cleanup)
-        logger.info("Step 7: GCS files retained for source downloads")
-        
-        # Step 8: Finalize Firestore document with all data
-        logger.info("Step 8: Finalizing Firestore document...")
-        update_payload = {
-            'corpus_id': corpus_id,
-            'indexed_files': indexed_files_map,
-            'kg_nodes': kg_nodes,
-            'kg_edges': kg_edges,
-            'kg_data': kg_data
-        }
-        firestore_service.finalize_course_doc(course_id, update_payload)
-        
-        logger.info(f"Course {course_id} initialization complete!")
-        
         return jsonify({
-            "status": "complete",
-            "corpus_id": corpus_id,
-            "files_count": len(files),
-            "uploaded_count": successful_uploads,
-            "kg_nodes": kg_nodes,
-            "kg_edges": kg_edges,
-            "kg_data": kg_data
-        })
+            "status": "queued",
+            "job_id": job_id,
+            "course_id": course_id
+        }), 202
 
-        
     except Exception as e:
-        logger.error(f"Error initializing course {course_id or 'unknown'}: {str(e)}", exc_info=True)
-        
+        logger.error(f"Error queueing sync for course {course_id or 'unknown'}: {str(e)}", exc_info=True)
+        return jsonify({
+            "error": "Failed to sync course",
+            "message": str(e)
+        }), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Returns the status of a background job (stage progress, errors, result).
+    """
+    try:
+        job = job_service.get_job_status(job_id)
         
-        # Try to update Firestore with error status
-        try:
-            firestore_service.db.collection(firestore_service.COURSES_COLLECTION).document(course_id).update({
-                'status': 'ERROR',
-                'error_message': str(e)
-            })
-        except:
-            pass
+        if not job:
+            return jsonify({"error": f"Job {job_id} not found"}), 404
         
+        return jsonify(job)
+    except Exception as e:
+        logger.error(f"Failed to get job status: {e}", exc_info=True)
         return jsonify({
-            "error": "Failed to initialize course",
+            "error": "Failed to get job status",
             "message": str(e)
         }), 500
 
 
 CITE_THRESHOLD = 0.3
+
+
+def _start_query_vector(query: str):
+    """
+    Starts embedding a chat question for the answer cache.
+    
+    Returns None when the cache is disabled; the question is then logged
+    without a vector and the analytics flusher embeds it in the background.
+    """
+    if not answer_cache_service.ANSWER_CACHE_ENABLED:
+        return None
+    return _query_embedder.submit(analytics_logging_service.get_query_vector, query)
+
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """
@@ -318,15 +282,26 @@ def chat():
         course_id = data.get('course_id')
         query = data.get('query')
 
+        pending_vector = _start_query_vector(query)
         course_data = firestore_service.get_course_data(course_id)
         
         # Convert DocumentSnapshot to dict
         data_dict = course_data.to_dict()
         corpus_id = data_dict.get('corpus_id')
-        answer, sources  = gemini_service.generate_answer_with_context(
-            query=query,
-            corpus_id=corpus_id,
-        )
+        
+        # Near-duplicates of earlier questions are served from the answer cache
+        query_vector = pending_vector.result() if pending_vector else None
+        version = answer_cache_service.corpus_version(data_dict)
+        cached = answer_cache_service.lookup(course_id, query_vector, version)
+        if cached:
+            answer, sources = cached['answer'], cached['sources']
+        else:
+            answer, sources  = gemini_service.generate_answer_with_context(
+                query=query,
+                corpus_id=corpus_id,
+                corpus_version=data_dict.get('corpus_version', 0),
+            )
+            answer_cache_service.store(course_id, query, query_vector, version, answer, sources)
     except Exception as e:
         print(f"[CHAT ERROR] {str(e)}")
         import traceback
@@ -341,7 +316,8 @@ def chat():
         course_id=course_id,
         query_text=query,
         answer_text=answer,
-        sources=sources
+        sources=sources,
+        query_vector=query_vector
     )
 
     return jsonify({
@@ -352,6 +328,94 @@ def chat():
     })
 
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streaming version of /api/chat using Server-Sent Events.
+    
+    Request body:
+        {
+            "course_id": "12345",
+            "query": "What is recursion?"
+        }
+    
+    Event stream (each event's data is JSON):
+        event: sources  -> list of cited sources (sent before generation starts)
+        event: token    -> {"text": "..."} answer text as Gemini produces it
+        event: done     -> {"log_doc_id": "..."} once the answer is complete
+        event: error    -> {"message": "..."} if generation fails mid-stream
+    """
+    data = request.json or {}
+    course_id = data.get('course_id')
+    query = data.get('query')
+    
+    if not course_id or not query:
+        return jsonify({"error": "Missing required fields: course_id and query"}), 400
+    
+    try:
+        pending_vector = _start_query_vector(query)
+        course_dict = firestore_service.get_course_data(course_id).to_dict()
+        query_vector = pending_vector.result() if pending_vector else None
+        version = answer_cache_service.corpus_version(course_dict)
+        cached = answer_cache_service.lookup(course_id, query_vector, version)
+        if cached:
+            sources, text_chunks = cached['sources'], iter([cached['answer']])
+        else:
+            sources, text_chunks = gemini_service.stream_answer_with_context(
+                query=query,
+                corpus_id=course_dict.get('corpus_id'),
+                corpus_version=course_dict.get('corpus_version', 0),
+            )
+    except Exception as e:
+        logger.error(f"Failed to start chat stream: {e}", exc_info=True)
+        return jsonify({
+            "error": str(e),
+            "response": f"Sorry, an error occurred: {str(e)}"
+        }), 500
+    
+    cited_sources = sorted(
+        [source for source in sources if source.get('distance', 1) <= CITE_THRESHOLD],
+        key=lambda x: x['distance']
+    )
+    
+    def sse(event: str, payload) -> str:
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    
+    def generate():
+        yield sse('sources', cited_sources)
+        
+        answer_parts = []
+        try:
+            for text in text_chunks:
+                answer_parts.append(text)
+                yield sse('token', {'text': text})
+        except Exception as e:
+            logger.error(f"Chat stream failed for course {course_id}: {e}", exc_info=True)
+            yield sse('error', {'message': str(e)})
+            return
+        
+        answer = "".join(answer_parts)
+        if not cached:
+            answer_cache_service.store(course_id, query, query_vector, version, answer, sources)
+        doc_id = analytics_logging_service.log_chat_query(
+            course_id=course_id,
+            query_text=query,
+            answer_text=answer,
+            sources=sources,
+            query_vector=query_vector
+        )
+        yield sse('done', {'log_doc_id': doc_id})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Don't let proxies buffer the stream
+        }
+    )
+
+
 @app.route('/api/get-graph', methods=['GET'])
 def get_graph():
     """
@@ -359,12 +423,13 @@ def get_graph():
     """
     course_id = request.args.get('course_id')
     course_data = firestore_service.get_course_data(course_id)
+    graph = firestore_service.get_course_graph(course_id, course_data) or {}
     
     return jsonify({
-        "nodes": course_data.get("kg_nodes"),
-        "edges": course_data.get("kg_edges"),
-        "data": course_data.get("kg_data"),
-        "indexed_files": course_data.get("indexed_files")  # Include file metadata with gcs_uri
+        "nodes": graph.get("kg_nodes"),
+        "edges": graph.get("kg_edges"),
+        "data": graph.get("kg_data"),
+        "indexed_files": (course_data.to_dict() or {}).get("indexed_files")  # Include file metadata with gcs_uri
     })
 
 
@@ -467,8 +532,8 @@ def remove_topic():
         
         logger.info(f"Removing topic '{topic_id}' from course {course_id}")
         
-        # Step 1: Get existing knowledge graph from Firestore
-        course_data = firestore_service.get_course_data(course_id)
+        # Step 1: Get existing knowledge graph from Firestore (bypassing the cache, since we write it back)
+        course_data = firestore_service.get_course_data(course_id, use_cache=False)
         
         if not course_data.exists:
             return jsonify({
@@ -483,9 +548,10 @@ def remove_topic():
                 "error": "Course must be in ACTIVE state to remove topics"
             }), 400
         
-        existing_nodes = json.loads(data_dict.get('kg_nodes', '[]'))
-        existing_edges = json.loads(data_dict.get('kg_edges', '[]'))
-        existing_data = json.loads(data_dict.get('kg_data', '{}'))
+        graph = firestore_service.get_course_graph(course_id, course_data)
+        existing_nodes = json.loads(graph.get('kg_nodes') or '[]')
+        existing_edges = json.loads(graph.get('kg_edges') or '[]')
+        existing_data = json.loads(graph.get('kg_data') or '{}')
         
         logger.info(f"Current graph has {len(existing_nodes)} nodes, {len(existing_edges)} edges")
         
@@ -499,11 +565,12 @@ def remove_topic():
         
         # Step 3: Update Firestore with new graph data
         logger.info("Updating Firestore with new graph data...")
-        firestore_service.db.collection(firestore_service.COURSES_COLLECTION).document(course_id).update({
-            'kg_nodes': updated_nodes_json,
-            'kg_edges': updated_edges_json,
-            'kg_data': updated_data_json
-        })
+        firestore_service.update_knowledge_graph(
+            course_id,
+            kg_nodes=updated_nodes_json,
+            kg_edges=updated_edges_json,
+            kg_data=updated_data_json
+        )
         
         logger.info(f"Successfully removed topic '{topic_id}' from course {course_id}")
         
@@ -607,12 +674,14 @@ def run_analytics():
     Request body:
         {
             "course_id": "12345",
-            "n_clusters": 5  // optional, uses elbow method if not specified
+            "n_clusters": 5,  // optional, uses elbow method if not specified
+            "incremental": true  // optional, only cluster queries logged since the last run
         }
     """
     data = request.json
     course_id = data.get('course_id')
     n_clusters = data.get('n_clusters')
+    incremental = data.get('incremental')
     
     if not course_id:
         return jsonify({
@@ -627,12 +696,14 @@ def run_analytics():
             report = analytics_reporting_service.run_daily_analytics(
                 course_id, 
                 n_clusters=n_clusters, 
-                auto_detect_clusters=False
+                auto_detect_clusters=False,
+                incremental=incremental
             )
         else:
             report = analytics_reporting_service.run_daily_analytics(
                 course_id, 
-                auto_detect_clusters=True
+                auto_detect_clusters=True,
+                incremental=incremental
             )
         
         return jsonify(report)
@@ -672,8 +743,8 @@ def add_topic():
         
         logger.info(f"Adding topic '{topic_name}' to course {course_id}")
         
-        # Step 1: Get existing knowledge graph from Firestore
-        course_data = firestore_service.get_course_data(course_id)
+        # Step 1: Get existing knowledge graph from Firestore (bypassing the cache, since we write it back)
+        course_data = firestore_service.get_course_data(course_id, use_cache=False)
         
         if not course_data.exists:
             return jsonify({
@@ -689,9 +760,10 @@ def add_topic():
             }), 400
         
         corpus_id = data_dict.get('corpus_id')
-        existing_nodes = json.loads(data_dict.get('kg_nodes', '[]'))
-        existing_edges = json.loads(data_dict.get('kg_edges', '[]'))
-        existing_data = json.loads(data_dict.get('kg_data', '{}'))
+        graph = firestore_service.get_course_graph(course_id, course_data)
+        existing_nodes = json.loads(graph.get('kg_nodes') or '[]')
+        existing_edges = json.loads(graph.get('kg_edges') or '[]')
+        existing_data = json.loads(graph.get('kg_data') or '{}')
         
         if not corpus_id:
             return jsonify({
@@ -712,11 +784,12 @@ def add_topic():
         
         # Step 3: Update Firestore with new graph data
         logger.info("Updating Firestore with new graph data...")
-        firestore_service.db.collection(firestore_service.COURSES_COLLECTION).document(course_id).update({
-            'kg_nodes': updated_nodes_json,
-            'kg_edges': updated_edges_json,
-            'kg_data': updated_data_json
-        })
+        firestore_service.update_knowledge_graph(
+            course_id,
+            kg_nodes=updated_nodes_json,
+            kg_edges=updated_edges_json,
+            kg_data=updated_data_json
+        )
         
         logger.info(f"Successfully added topic '{topic_name}' to course {course_id}")
         
@@ -10,11 +10,27 @@ This service is responsible for:
 This is a lightweight service focused only on data collection.
 Analysis and reporting is handled by analytics_reporting_service.
 
+Chat queries are logged asynchronously: log_chat_query() pre-allocates the
+event's document ID and puts the event on a bounded in-process queue. A
+background flusher thread embeds queued queries in batches and writes them
+with a single batched Firestore commit, keeping both calls off the
+/api/chat request path.
+
+Query vectors are stored as packed bytes (see encode_query_vector) rather
+than Firestore arrays of doubles; decode_query_vector reads both forms.
+
 Dependencies:
 - firestore_service: For database operations
 - gemini_service: For generating embeddings
+- numpy: For the query vector codec
 """
+import atexit
 import logging
+import queue
+import struct
+import threading
+import time
+import numpy as np
 from google.cloud import firestore
 import sys
 import os
@@ -30,6 +46,24 @@ else:
 
 logger = logging.getLogger(__name__)
 
+# Async chat logging settings
+LOG_QUEUE_SIZE = int(os.environ.get('ANALYTICS_QUEUE_SIZE', '1000'))
+LOG_BATCH_SIZE = int(os.environ.get('ANALYTICS_BATCH_SIZE', '25'))
+LOG_FLUSH_INTERVAL = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', '2.0'))  # Max seconds an event waits
+
+# Query vector storage: 'float32', 'float16' or 'int8' (symmetric, per-vector scale)
+VECTOR_ENCODING = os.environ.get('ANALYTICS_VECTOR_ENCODING', 'float32')
+
+# Encoded vectors start with an 8-byte header: codec ID, 3 pad bytes and a
+# float32 scale (int8 only), so the payload stays aligned for np.frombuffer
+_VECTOR_HEADER = struct.Struct('<B3xf')
+_VECTOR_CODECS = {'float32': (1, '<f4'), 'float16': (2, '<f2'), 'int8': (3, 'i1')}
+_VECTOR_DTYPES = {codec_id: dtype for codec_id, dtype in _VECTOR_CODECS.values()}
+
+_event_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_flusher_thread = None
+_flusher_lock = threading.Lock()
+
 
 # ============================================================================
 # HELPER FUNCTIONS
@@ -66,22 +100,88 @@ def get_query_vector(query_text: str) -> list:
         return None
 
 
+def encode_query_vector(vector, encoding: str = None) -> bytes:
+    """
+    Packs an embedding into the compact binary form stored on chat events.
+    A 768-dimension vector takes 3 KB as float32, 1.5 KB as float16 and
+    776 bytes as int8, versus ~7 KB as a Firestore array of doubles.
+    
+    Args:
+        vector: The embedding (list of floats or NumPy array)
+        encoding: 'float32', 'float16' or 'int8' (defaults to VECTOR_ENCODING)
+        
+    Returns:
+        The encoded bytes, or None if vector is empty
+        
+    Example:
+        blob = encode_query_vector([0.12, -0.45, 0.78], encoding='int8')
+    """
+    if vector is None or len(vector) == 0:
+        return None
+    codec_id, dtype = _VECTOR_CODECS[encoding or VECTOR_ENCODING]
+    values = np.asarray(vector, dtype=np.float32)
+    
+    scale = 1.0
+    if dtype == 'i1':
+        peak = float(np.max(np.abs(values)))
+        scale = peak / 127 if peak > 0 else 1.0
+        values = np.round(values / scale)
+    return _VECTOR_HEADER.pack(codec_id, scale) + values.astype(dtype).tobytes()
+
+
+def decode_query_vector(value):
+    """
+    Turns a stored query vector back into a float32 NumPy array.
+    float32 payloads are decoded with np.frombuffer without copying (the
+    result is read-only). Legacy events that stored a list of floats are
+    accepted too.
+    
+    Args:
+        value: Bytes written by encode_query_vector, or a list of floats
+        
+    Returns:
+        1-D float32 array, or None if there is no vector
+        
+    Example:
+        vector = decode_query_vector(event.get('query_vector'))
+    """
+    if value is None or len(value) == 0:
+        return None
+    if not isinstance(value, (bytes, bytearray, memoryview)):
+        return np.asarray(value, dtype=np.float32)
+    
+    codec_id, scale = _VECTOR_HEADER.unpack_from(value)
+    dtype = _VECTOR_DTYPES.get(codec_id)
+    if dtype is None:
+        raise ValueError(f"Unknown query vector codec {codec_id}")
+    vector = np.frombuffer(value, dtype=dtype, offset=_VECTOR_HEADER.size)
+    if dtype == '<f4':
+        return vector
+    vector = vector.astype(np.float32)
+    return vector * np.float32(scale) if dtype == 'i1' else vector
+
+
 # ============================================================================
 # LOGGING FUNCTIONS
 # ============================================================================
 
-def log_chat_query(course_id: str, query_text: str, answer_text: str = None, sources: list = None) -> str:
+def log_chat_query(course_id: str, query_text: str, answer_text: str = None, sources: list = None,
+                   query_vector: list = None) -> str:
     """
     Logs a chat query event with its embedding for later analysis.
     
-    This function is called every time a student asks a question.
-    It generates an embedding of the query and stores it for clustering analysis.
+    This function is called every time a student asks a question. It returns
+    immediately: the event's document ID is allocated up front and the
+    embedding plus Firestore write happen on the background flusher
+    (see flush_chat_logs). If the queue is full the event is written inline.
     
     Args:
         course_id: The Canvas course ID
         query_text: The student's question
         answer_text: Optional - the generated answer
         sources: Optional - list of source files used
+        query_vector: Optional - the query's embedding, if the caller already
+            computed it (the flusher then skips embedding this event)
         
     Returns:
         The Firestore document ID of the logged event (for rating feature)
@@ -95,12 +195,12 @@ def log_chat_query(course_id: str, query_text: str, answer_text: str = None, sou
         )
     """
     try:
-        logger.info(f"Logging chat query for course {course_id}: {query_text[:50]}...")
+        logger.info(f"Queueing chat query for course {course_id}: {query_text[:50]}...")
         
-        # Get embedding vector for the query
-        query_vector = get_query_vector(query_text)
+        doc_id = firestore_service.new_analytics_doc_id()
         
-        # Prepare the log data
+        # 'rating' is deliberately left out: the event is merged into its
+        # document, and a rating may already be there if the student was quick
         log_data = {
             'type': 'chat',
             'course_id': course_id,
@@ -108,14 +208,15 @@ def log_chat_query(course_id: str, query_text: str, answer_text: str = None, sou
             'answer_text': answer_text,
             'sources': sources or [],
             'query_vector': query_vector,
-            'timestamp': firestore.SERVER_TIMESTAMP,
-            'rating': None  # Will be updated if user rates this answer
         }
         
-        # Save to Firestore
-        doc_id = firestore_service.log_analytics_event(log_data)
+        _ensure_flusher()
+        try:
+            _event_queue.put_nowait((doc_id, log_data))
+        except queue.Full:
+            logger.warning("Chat log queue is full, writing event inline")
+            _write_chat_events([(doc_id, log_data)])
         
-        logger.info(f"Chat query logged successfully: {doc_id}")
         return doc_id
         
     except Exception as e:
@@ -124,6 +225,140 @@ def log_chat_query(course_id: str, query_text: str, answer_text: str = None, sou
         return None
 
 
+def flush_chat_logs(timeout: float = 10.0) -> bool:
+    """
+    Blocks until every queued chat event has been written (or timeout passes).
+    Used at shutdown and by scripts that must see their events in Firestore.
+    
+    Args:
+        timeout: Maximum seconds to wait
+        
+    Returns:
+        True if the queue drained in time
+    """
+    deadline = time.monotonic() + timeout
+    while _event_queue.unfinished_tasks:
+        if time.monotonic() >= deadline:
+            logger.warning(f"{_event_queue.unfinished_tasks} chat log event(s) still pending")
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def _ensure_flusher() -> None:
+    """Starts the background flusher thread on first use."""
+    global _flusher_thread
+    with _flusher_lock:
+        if _flusher_thread is None or not _flusher_thread.is_alive():
+            _flusher_thread = threading.Thread(target=_flush_loop, name='chat-log-flusher', daemon=True)
+            _flusher_thread.start()
+
+
+def _flush_loop() -> None:
+    """
+    Collects up to LOG_BATCH_SIZE events (waiting at most LOG_FLUSH_INTERVAL
+    after the first one arrives) and writes them as one batch.
+    """
+    while True:
+        batch = [_event_queue.get()]
+        deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+        while len(batch) < LOG_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_event_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        try:
+            _write_chat_events(batch)
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} chat log event(s): {e}", exc_info=True)
+        finally:
+            for _ in batch:
+                _event_queue.task_done()
+
+
+def _write_chat_events(events: list) -> None:
+    """Embeds a batch of chat events' queries and writes them in one commit."""
+    vectors = [data.get('query_vector') for _, data in events]
+    missing = [i for i, vector in enumerate(vectors) if not vector]
+    if missing:
+        embedded = gemini_service.get_embeddings_batch(
+            [events[i][1]['query_text'] for i in missing],
+            task_type="RETRIEVAL_QUERY",
+            model_name="text-embedding-004"
+        )
+        for i, vector in zip(missing, embedded):
+            vectors[i] = vector
+    
+    firestore_service.log_analytics_events_batch([
+        (doc_id, {**data, 'query_vector': encode_query_vector(vector), 'timestamp': firestore.SERVER_TIMESTAMP})
+        for (doc_id, data), vector in zip(events, vectors)
+    ])
+    logger.info(f"Chat query batch logged successfully: {len(events)} event(s)")
+
+
+atexit.register(flush_chat_logs)
+
+
+def backfill_query_vectors(course_id: str, events: list = None) -> int:
+    """
+    Embeds and stores query vectors for chat events that are missing one
+    (e.g. logged while embedding was failing, or before vectors existed).
+    
+    Args:
+        course_id: The Canvas course ID
+        events: Optional - chat events already fetched with
+            firestore_service.get_analytics_events; they are updated in place.
+            Events fetched without query_text have it read by ID.
+        
+    Returns:
+        Number of events that received a vector
+        
+    Example:
+        count = backfill_query_vectors("12345")
+    """
+    if events is None:
+        events = firestore_service.get_analytics_events(
+            course_id, event_type='chat', fields=['query_text', 'query_vector']
+        )
+    
+    missing = [e for e in events if not e.get('query_vector')]
+    without_text = [e['doc_id'] for e in missing if 'query_text' not in e]
+    if without_text:
+        texts = {
+            e['doc_id']: e.get('query_text')
+            for e in firestore_service.get_analytics_events_by_ids(without_text, fields=['query_text'])
+        }
+        for event in missing:
+            if 'query_text' not in event:
+                event['query_text'] = texts.get(event['doc_id'])
+    
+    pending = [e for e in missing if e.get('query_text')]
+    if not pending:
+        return 0
+    
+    logger.info(f"Backfilling query vectors for {len(pending)} chat event(s) in course {course_id}")
+    vectors = gemini_service.get_embeddings_batch(
+        [e['query_text'] for e in pending],
+        task_type="RETRIEVAL_QUERY",
+        model_name="text-embedding-004"
+    )
+    
+    updates = []
+    for event, vector in zip(pending, vectors):
+        if vector:
+            event['query_vector'] = vector
+            updates.append((event['doc_id'], {'query_vector': encode_query_vector(vector)}))
+    
+    if updates:
+        firestore_service.log_analytics_events_batch(updates)
+    logger.info(f"Backfilled {len(updates)}/{len(pending)} query vector(s) for course {course_id}")
+    return len(updates)
+
+
 def log_kg_node_click(course_id: str, node_id: str, node_label: str, node_type: str = None) -> str:
     """
     Logs a knowledge graph node click event.
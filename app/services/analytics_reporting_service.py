@@ -16,7 +16,10 @@ Dependencies:
 - firestore_service: For reading vectors and saving reports
 - gemini_service: For AI-powered cluster labeling
 """
+import hashlib
+import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing import List
 import sys
@@ -26,13 +29,45 @@ import os
 if __name__ == "__main__":
     # Running as standalone script
     sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
-    from app.services import firestore_service, gemini_service
+    from app.services import firestore_service, gemini_service, analytics_logging_service
 else:
     # Imported as a module
-    from . import firestore_service, gemini_service
+    from . import firestore_service, gemini_service, analytics_logging_service
 
 logger = logging.getLogger(__name__)
 
+# Incremental clustering (see _run_incremental_analytics)
+ANALYTICS_INCREMENTAL = os.environ.get('ANALYTICS_INCREMENTAL', '').lower() in ('1', 'true', 'yes')
+RELABEL_DRIFT = float(os.environ.get('ANALYTICS_RELABEL_DRIFT', '0.05'))  # Cosine distance before a cluster is re-labeled
+CLUSTER_BATCH_SIZE = 100  # MiniBatchKMeans batch size
+SAMPLE_SIZE = 10  # Representative queries kept per cluster for labeling
+
+# Fields read for each chat event; the report is computed from this single fetch
+EVENT_FIELDS = ['query_vector', 'query_text', 'rating', 'timestamp']
+RATING_KEYS = ('good', 'bad', 'none')
+
+# Elbow search (see _elbow_search)
+ELBOW_COMPONENTS = int(os.environ.get('ANALYTICS_ELBOW_COMPONENTS', '32'))  # PCA dimensions, 0 to disable
+ELBOW_SAMPLE_SIZE = int(os.environ.get('ANALYTICS_ELBOW_SAMPLE_SIZE', '5000'))  # Max vectors searched, 0 for all
+ELBOW_JOBS = int(os.environ.get('ANALYTICS_ELBOW_JOBS', '1'))  # joblib workers for the k candidates, -1 for all cores
+
+# Cluster labeling (see _label_clusters)
+LABEL_WORKERS = int(os.environ.get('ANALYTICS_LABEL_WORKERS', '4'))  # Label requests in flight
+LABEL_BATCH = os.environ.get('ANALYTICS_LABEL_BATCH', '').lower() in ('1', 'true', 'yes')  # One prompt for all clusters
+LABEL_QUERIES = 5  # Representative queries sent to the model (and fingerprinted) per cluster
+LABEL_PROMPT = (
+    "Given these student questions from a course:\n{samples}\n\n"
+    "Generate a short category label (2-4 words) that describes the common theme or topic. "
+    "Be specific and use technical terms when appropriate. "
+    "Only return the category label, nothing else."
+)
+LABEL_BATCH_PROMPT = (
+    "Below are {count} groups of student questions from a course.\n\n{groups}\n\n"
+    "For each group, generate a short category label (2-4 words) that describes the common theme or topic. "
+    "Be specific and use technical terms when appropriate. "
+    "Return only a JSON array of {count} strings, one label per group, in group order."
+)
+
 
 # ============================================================================
 # MAIN ANALYTICS PIPELINE
@@ -44,7 +79,8 @@ def determine_optimal_clusters(vectors, max_clusters: int = 10) -> int:
     
     The elbow method calculates inertia (sum of squared distances to cluster centers)
     for different values of k and finds the "elbow point" where adding more clusters
-    provides diminishing returns.
+    provides diminishing returns. The search runs on a PCA-reduced subsample
+    (see _elbow_search).
     
     Args:
         vectors: Numpy array of vectors
@@ -58,66 +94,148 @@ def determine_optimal_clusters(vectors, max_clusters: int = 10) -> int:
         # Returns: 5 (if that's the elbow point)
     """
     try:
-        from sklearn.cluster import MiniBatchKMeans
-        import numpy as np
-        
-        n_samples = len(vectors)
-        
-        # Can't have more clusters than samples
-        max_k = min(max_clusters, n_samples - 1)
-        
-        # Need at least 2 clusters for elbow method
-        if max_k < 2:
-            logger.warning(f"Not enough samples ({n_samples}) for elbow method, using k=1")
-            return 1
+        return _elbow_search(vectors, max_clusters)[0]
+    except Exception as e:
+        logger.error(f"Failed to determine optimal clusters: {e}", exc_info=True)
+        # Fallback to a reasonable default
+        return min(5, len(vectors) // 10)  # Use 5 or 10% of samples, whichever is smaller
+
+
+def cluster_with_elbow(vectors, max_clusters: int = 15) -> tuple:
+    """
+    Picks k with the elbow method and clusters the vectors, reusing the
+    model fitted for the chosen k during the search instead of fitting again.
+    
+    Every vector is assigned with the search model (in the reduced space);
+    centroids are the mean of each cluster's original vectors.
+    
+    Args:
+        vectors: Numpy array of vectors
+        max_clusters: Maximum number of clusters to test (default: 15)
         
-        logger.info(f"Running elbow method to determine optimal clusters (testing k=1 to k={max_k})")
+    Returns:
+        Tuple of (n_clusters, cluster_labels, cluster_centers)
         
-        inertias = []
-        k_values = range(1, max_k + 1)
+    Example:
+        k, labels, centers = cluster_with_elbow(vectors)
+    """
+    import numpy as np
+    
+    try:
+        n_clusters, model, pca = _elbow_search(vectors, max_clusters)
+    except Exception as e:
+        logger.error(f"Failed to determine optimal clusters: {e}", exc_info=True)
+        n_clusters, model, pca = min(5, len(vectors) // 10), None, None
+    
+    if model is None:
+        n_clusters = max(n_clusters, 1)
+        labels, centers = _perform_clustering(vectors, n_clusters)
+        return n_clusters, labels, centers
+    
+    reduced = pca.transform(vectors) if pca is not None else vectors
+    labels = model.predict(reduced)
+    
+    # Back-project the search centroids, then replace them with the true
+    # means in the original space for every cluster that has members
+    centers = pca.inverse_transform(model.cluster_centers_) if pca is not None else model.cluster_centers_.copy()
+    counts = np.bincount(labels, minlength=n_clusters)
+    membership = np.zeros((n_clusters, len(vectors)), dtype=vectors.dtype)
+    membership[labels, np.arange(len(vectors))] = 1
+    sums = membership @ vectors
+    filled = counts > 0
+    centers[filled] = sums[filled] / counts[filled, None]
+    
+    logger.info(f"Clustering complete. Cluster distribution: {dict(enumerate(counts.tolist()))}")
+    return n_clusters, labels, centers.astype(vectors.dtype, copy=False)
+
+
+def _elbow_search(vectors, max_clusters: int) -> tuple:
+    """
+    Fits MiniBatchKMeans for k = 1..max_k and returns the elbow k.
+    
+    To keep the search cheap on large courses it runs on at most
+    ELBOW_SAMPLE_SIZE vectors, projected once onto ELBOW_COMPONENTS
+    principal components, and the k values can be evaluated in parallel
+    with joblib (ELBOW_JOBS).
+    
+    Returns:
+        Tuple of (optimal_k, model fitted for optimal_k or None, fitted PCA or None)
+    """
+    from joblib import Parallel, delayed
+    import numpy as np
+    
+    n_samples = len(vectors)
+    
+    # Can't have more clusters than samples
+    max_k = min(max_clusters, n_samples - 1)
+    
+    # Need at least 2 clusters for elbow method
+    if max_k < 2:
+        logger.warning(f"Not enough samples ({n_samples}) for elbow method, using k=1")
+        return 1, None, None
+    
+    sample = vectors
+    if ELBOW_SAMPLE_SIZE and n_samples > ELBOW_SAMPLE_SIZE:
+        rng = np.random.default_rng(42)
+        sample = vectors[rng.choice(n_samples, ELBOW_SAMPLE_SIZE, replace=False)]
+    
+    pca = None
+    if ELBOW_COMPONENTS and vectors.shape[1] > ELBOW_COMPONENTS and len(sample) > ELBOW_COMPONENTS:
+        from sklearn.decomposition import PCA
+        pca = PCA(n_components=ELBOW_COMPONENTS, random_state=42)
+        sample = pca.fit_transform(sample)
+    
+    logger.info(
+        f"Running elbow method to determine optimal clusters (testing k=1 to k={max_k} "
+        f"on {len(sample)} x {sample.shape[1]} vectors)"
+    )
+    
+    k_values = range(1, max_k + 1)
+    
+    # Calculate inertia for each k
+    models = Parallel(n_jobs=ELBOW_JOBS)(delayed(_fit_kmeans)(sample, k) for k in k_values)
+    inertias = [model.inertia_ for model in models]
+    for k, inertia in zip(k_values, inertias):
+        logger.info(f"  k={k}: inertia={inertia:.2f}")
+    
+    # Find the elbow point using the "elbow" heuristic
+    # Calculate the rate of change in inertia
+    if len(inertias) < 3:
+        optimal_k = len(inertias)
+    else:
+        # Calculate second derivative (rate of change of rate of change)
+        # The elbow is where the second derivative is maximized
+        inertias_array = np.array(inertias)
         
-        # Calculate inertia for each k
-        for k in k_values:
-            kmeans = MiniBatchKMeans(n_clusters=k, random_state=42, batch_size=100)
-            kmeans.fit(vectors)
-            inertias.append(kmeans.inertia_)
-            logger.info(f"  k={k}: inertia={kmeans.inertia_:.2f}")
+        # Normalize inertias to 0-1 scale for better comparison
+        inertias_normalized = (inertias_array - inertias_array.min()) / (inertias_array.max() - inertias_array.min() + 1e-10)
         
-        # Find the elbow point using the "elbow" heuristic
-        # Calculate the rate of change in inertia
-        if len(inertias) < 3:
-            optimal_k = len(inertias)
-        else:
-            # Calculate second derivative (rate of change of rate of change)
-            # The elbow is where the second derivative is maximized
-            inertias_array = np.array(inertias)
-            
-            # Normalize inertias to 0-1 scale for better comparison
-            inertias_normalized = (inertias_array - inertias_array.min()) / (inertias_array.max() - inertias_array.min() + 1e-10)
-            
-            # Calculate rate of decrease
-            differences = np.diff(inertias_normalized)
-            
-            # Calculate second derivative (change in rate of decrease)
-            second_diff = np.diff(differences)
-            
-            # The elbow is where the second derivative is largest (most positive)
-            # This indicates the point where adding clusters stops being as beneficial
-            elbow_index = min(np.argmax(second_diff) + 2, len(k_values) - 1)  # +2 because we lost 2 elements in diff operations
-            
-            optimal_k = k_values[elbow_index]
+        # Calculate rate of decrease
+        differences = np.diff(inertias_normalized)
         
-        logger.info(f"Elbow method suggests optimal k={optimal_k}")
+        # Calculate second derivative (change in rate of decrease)
+        second_diff = np.diff(differences)
         
-        return optimal_k
+        # The elbow is where the second derivative is largest (most positive)
+        # This indicates the point where adding clusters stops being as beneficial
+        elbow_index = min(np.argmax(second_diff) + 2, len(k_values) - 1)  # +2 because we lost 2 elements in diff operations
         
-    except Exception as e:
-        logger.error(f"Failed to determine optimal clusters: {e}", exc_info=True)
-        # Fallback to a reasonable default
-        return min(5, len(vectors) // 10)  # Use 5 or 10% of samples, whichever is smaller
+        optimal_k = k_values[elbow_index]
+    
+    logger.info(f"Elbow method suggests optimal k={optimal_k}")
+    
+    return optimal_k, models[optimal_k - 1], pca
 
 
-def run_daily_analytics(course_id: str, n_clusters: int = None, auto_detect_clusters: bool = True) -> dict:
+def _fit_kmeans(vectors, n_clusters: int):
+    """Fits one MiniBatchKMeans candidate for the elbow search."""
+    from sklearn.cluster import MiniBatchKMeans
+    
+    return MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=CLUSTER_BATCH_SIZE).fit(vectors)
+
+
+def run_daily_analytics(course_id: str, n_clusters: int = None, auto_detect_clusters: bool = True,
+                        incremental: bool = None) -> dict:
     """
     Runs the complete analytics pipeline for a course.
     
@@ -127,7 +245,12 @@ def run_daily_analytics(course_id: str, n_clusters: int = None, auto_detect_clus
     3. Clusters them using MiniBatchKMeans
     4. Labels each cluster using AI
     5. Generates a comprehensive report
-    6. Saves the report to Firestore
+    6. Saves the report and the clustering state to Firestore
+    
+    In incremental mode the saved clustering state is updated with only the
+    events logged since the previous run (see _run_incremental_analytics).
+    Courses without a saved state, or runs that ask for a different number
+    of clusters, fall back to a full run.
     
     This should be run periodically (e.g., daily) or on-demand by professors.
     
@@ -135,6 +258,8 @@ def run_daily_analytics(course_id: str, n_clusters: int = None, auto_detect_clus
         course_id: The Canvas course ID
         n_clusters: Number of clusters to create (optional if auto_detect_clusters=True)
         auto_detect_clusters: Use elbow method to automatically determine optimal k (default: True)
+        incremental: Update the saved clustering instead of refitting from scratch
+            (defaults to ANALYTICS_INCREMENTAL)
         
     Returns:
         Dictionary containing the analytics report
@@ -146,6 +271,9 @@ def run_daily_analytics(course_id: str, n_clusters: int = None, auto_detect_clus
         # Or specify exact number
         report = run_daily_analytics("12345", n_clusters=5, auto_detect_clusters=False)
         
+        # Only process queries logged since the last run
+        report = run_daily_analytics("12345", incremental=True)
+        
         # Returns: {
         #     'clusters': {
         #         'Getting Started Questions': 15,
@@ -157,118 +285,230 @@ def run_daily_analytics(course_id: str, n_clusters: int = None, auto_detect_clus
         #     'generated_at': '2025-11-08T10:30:00Z'
         # }
     """
+    if incremental is None:
+        incremental = ANALYTICS_INCREMENTAL
+    
     try:
-        logger.info(f"Starting daily analytics for course {course_id}")
-        
-        # Step 1: Fetch all chat events
-        logger.info("Fetching analytics events...")
-        events = firestore_service.get_analytics_events(course_id, event_type='chat')
-        
-        if not events or len(events) < 5:
-            logger.warning(f"Not enough data for clustering (found {len(events)} queries)")
-            return {
-                'status': 'insufficient_data',
-                'total_queries': len(events) if events else 0,
-                'message': 'Need at least 5 queries to generate analytics'
-            }
+        if incremental:
+            state = firestore_service.get_cluster_state(course_id)
+            if state and state.get('watermark') and n_clusters in (None, state.get('n_clusters')):
+                return _run_incremental_analytics(course_id, state)
+            logger.info(f"No reusable cluster state for course {course_id}, running full analytics")
         
-        logger.info(f"Retrieved {len(events)} chat events for analysis")
+        return _run_full_analytics(course_id, n_clusters, auto_detect_clusters)
         
-        # Step 2: Extract vectors and doc IDs
-        logger.info("Extracting vectors for clustering...")
-        vectors, doc_ids = _extract_vectors(events)
-        
-        # Step 2.5: Determine optimal number of clusters if needed
-        if auto_detect_clusters:
-            logger.info("Auto-detecting optimal number of clusters using elbow method...")
-            n_clusters = determine_optimal_clusters(vectors, max_clusters=15)
-        elif n_clusters is None:
+    except Exception as e:
+        logger.error(f"Failed to run daily analytics: {e}", exc_info=True)
+        raise
+
+
+def _run_full_analytics(course_id: str, n_clusters: int = None, auto_detect_clusters: bool = True) -> dict:
+    """Clusters every chat event of the course from scratch (see run_daily_analytics)."""
+    import numpy as np
+    
+    logger.info(f"Starting daily analytics for course {course_id}")
+    
+    # Step 1: Fetch all chat events once (only the fields the report needs)
+    logger.info("Fetching analytics events...")
+    events = firestore_service.get_analytics_events(course_id, event_type='chat', fields=EVENT_FIELDS)
+    
+    if not events or len(events) < 5:
+        logger.warning(f"Not enough data for clustering (found {len(events)} queries)")
+        return {
+            'status': 'insufficient_data',
+            'total_queries': len(events) if events else 0,
+            'message': 'Need at least 5 queries to generate analytics'
+        }
+    
+    logger.info(f"Retrieved {len(events)} chat events for analysis")
+    
+    # Step 1.5: Embed queries that were logged without a vector (batched)
+    if any(not e.get('query_vector') for e in events):
+        analytics_logging_service.backfill_query_vectors(course_id, events)
+    
+    # Step 2: Build the columnar event frame (doc IDs, texts, ratings, vectors)
+    logger.info("Extracting vectors for clustering...")
+    frame = _build_event_frame(events)
+    vectors = frame['vectors']
+    
+    # Steps 2.5 + 3: Determine optimal number of clusters if needed, and cluster the vectors
+    if auto_detect_clusters:
+        logger.info("Auto-detecting optimal number of clusters using elbow method...")
+        n_clusters, cluster_labels, cluster_centers = cluster_with_elbow(vectors, max_clusters=15)
+    else:
+        if n_clusters is None:
             # Default to 5 if not specified and auto-detect is off
             n_clusters = 5
             logger.info(f"Using default n_clusters={n_clusters}")
-        
-        # Step 3: Cluster the vectors
         logger.info(f"Clustering into {n_clusters} groups...")
         cluster_labels, cluster_centers = _perform_clustering(vectors, n_clusters)
+    
+    # Step 4: Group the frame by cluster (counts, ratings, queries closest to each centroid)
+    logger.info("Labeling clusters...")
+    cluster_labels = np.asarray(cluster_labels)
+    counts = np.bincount(cluster_labels, minlength=n_clusters)
+    ratings = _rating_counts(cluster_labels, frame['ratings'], n_clusters)
+    samples = _representatives(vectors, cluster_labels, cluster_centers, n_clusters)
+    
+    # Label all clusters together, reusing labels of unchanged clusters from the previous run
+    populated = [cluster_id for cluster_id in range(n_clusters) if counts[cluster_id]]
+    labels = dict(zip(populated, _label_clusters(
+        [list(zip(frame['doc_ids'][samples[cluster_id]], frame['texts'][samples[cluster_id]])) for cluster_id in populated],
+        known=_known_labels(firestore_service.get_cluster_state(course_id))
+    )))
+    clusters = []
+    
+    for cluster_id in range(n_clusters):
+        if not counts[cluster_id]:
+            clusters.append(_empty_cluster())
+            continue
+        
+        # Query texts, most representative first
+        sample_indices = samples[cluster_id]
+        query_texts = [text for text in frame['texts'][sample_indices] if text]
+        cluster_label, fingerprint = labels[cluster_id]
+        good_count, bad_count, none_count = ratings[cluster_id].tolist()
+        
+        # Store cluster info with ratings
+        clusters.append({
+            'label': cluster_label,
+            'label_fingerprint': fingerprint,
+            'sample_doc_ids': frame['doc_ids'][sample_indices].tolist(),
+            'sample_queries': query_texts[:3],  # Include 3 most representative queries
+            'ratings': {
+                'good': good_count,
+                'bad': bad_count,
+                'none': none_count
+            }
+        })
         
-        # Step 4: Group doc IDs by cluster and label each cluster
-        logger.info("Labeling clusters...")
-        clusters = {}
-        
-        import numpy as np
+        logger.info(f"Cluster '{cluster_label}': {counts[cluster_id]} queries (👍 {good_count}, 👎 {bad_count}, ⚪ {none_count})")
+    
+    # Step 5: Save the clustering state so later runs can be incremental
+    state = _cluster_state(
+        n_clusters, auto_detect_clusters, cluster_centers, cluster_centers, counts, clusters,
+        watermark=max((e['timestamp'] for e in events if e.get('timestamp')), default=None),
+        total_queries=len(events)
+    )
+    firestore_service.save_cluster_state(course_id, state)
+    
+    # Step 6: Generate comprehensive report
+    report = _report_from_state(course_id, state)
+    
+    # Step 7: Save report to Firestore
+    logger.info("Saving analytics report...")
+    firestore_service.save_analytics_report(course_id, report)
+    
+    logger.info(f"Daily analytics completed for course {course_id}")
+    return report
+
+
+def _run_incremental_analytics(course_id: str, state: dict) -> dict:
+    """
+    Updates a saved clustering with the chat events logged after its watermark.
+    
+    The persisted centroids and counts are restored into a MiniBatchKMeans
+    that is advanced with partial_fit on the new vectors only. New events
+    add to their cluster's count and rating totals. Clusters are re-labeled
+    only when their centroid has drifted more than ANALYTICS_RELABEL_DRIFT
+    (cosine distance) from where it was last labeled; their representative
+    queries are re-ranked among the previous samples and the new members,
+    and the label is only regenerated if the leading samples changed.
+    
+    Ratings are counted when an event is first clustered, so a rating given
+    after that run is only picked up by the next full run.
+    """
+    import numpy as np
+    
+    n_clusters = state['n_clusters']
+    centroids = _unpack_matrix(state['centroids'], n_clusters)
+    label_centroids = _unpack_matrix(state['label_centroids'], n_clusters).copy()
+    counts = np.asarray(state['counts'], dtype=np.int64)
+    clusters = [dict(cluster) for cluster in state['clusters']]
+    
+    logger.info(f"Starting incremental analytics for course {course_id} (events after {state['watermark']})")
+    events = firestore_service.get_analytics_events(
+        course_id, event_type='chat', fields=EVENT_FIELDS, since=state['watermark']
+    )
+    if any(not e.get('query_vector') for e in events):
+        analytics_logging_service.backfill_query_vectors(course_id, events)
+    frame = _build_event_frame(events)
+    vectors = frame['vectors']
+    
+    if len(vectors) and vectors.shape[1] != centroids.shape[1]:
+        logger.warning("Query vector dimensions changed since the last run, running full analytics")
+        return _run_full_analytics(course_id, n_clusters, auto_detect_clusters=False)
+    
+    relabeled = 0
+    if len(vectors):
+        model = _restore_kmeans(centroids, counts)
+        for start in range(0, len(vectors), CLUSTER_BATCH_SIZE):
+            model.partial_fit(vectors[start:start + CLUSTER_BATCH_SIZE])
+        cluster_labels = model.predict(vectors)
+        centroids = model.cluster_centers_
+        counts = counts + np.bincount(cluster_labels, minlength=n_clusters)
+        
+        new_ratings = _rating_counts(cluster_labels, frame['ratings'], n_clusters)
+        for cluster_id, added in enumerate(new_ratings.tolist()):
+            previous = clusters[cluster_id].get('ratings') or {}
+            clusters[cluster_id]['ratings'] = {
+                key: previous.get(key, 0) + count for key, count in zip(RATING_KEYS, added)
+            }
         
+        drift = _cosine_distances(centroids, label_centroids)
+        drifted = {}
         for cluster_id in range(n_clusters):
-            # Get all indices for this cluster
-            cluster_indices = [i for i, label in enumerate(cluster_labels) if label == cluster_id]
-            
-            if not cluster_indices:
+            if counts[cluster_id] == 0:
+                continue
+            if clusters[cluster_id].get('label') and drift[cluster_id] <= RELABEL_DRIFT:
                 continue
             
-            # Get the centroid for this cluster
-            centroid = cluster_centers[cluster_id]
-            
-            # Calculate distances from centroid for all vectors in this cluster
-            cluster_vectors = vectors[cluster_indices]
-            distances = np.linalg.norm(cluster_vectors - centroid, axis=1)
-            
-            # Sort indices by distance (closest to centroid first)
-            sorted_cluster_indices = [cluster_indices[i] for i in np.argsort(distances)]
-            
-            # Get doc IDs in sorted order (closest to centroid first)
-            cluster_doc_ids = [doc_ids[i] for i in sorted_cluster_indices]
-            
-            # Get ALL events for this cluster (already sorted by distance to centroid)
-            all_cluster_events = firestore_service.get_analytics_events_by_ids(cluster_doc_ids)
-            
-            # Count ratings
-            good_count = sum(1 for event in all_cluster_events if event.get('rating') == 'helpful')
-            bad_count = sum(1 for event in all_cluster_events if event.get('rating') == 'not_helpful')
-            none_count = sum(1 for event in all_cluster_events if not event.get('rating'))
-            
-            # Get top 10 for labeling (already sorted by distance to centroid)
-            cluster_events = all_cluster_events[:10]
-            
-            # Extract query texts (most representative queries first)
-            query_texts = [event.get('query_text', '') for event in cluster_events if event.get('query_text')]
-            
-            # Generate AI label for this cluster
-            cluster_label = _label_cluster(query_texts)
-            
-            # Store cluster info with ratings
-            clusters[cluster_label] = {
-                'count': len(cluster_doc_ids),
-                'sample_queries': query_texts[:3],  # Include 3 most representative queries
-                'ratings': {
-                    'good': good_count,
-                    'bad': bad_count,
-                    'none': none_count
-                }
-            }
-            
-            logger.info(f"Cluster '{cluster_label}': {len(cluster_doc_ids)} queries (👍 {good_count}, 👎 {bad_count}, ⚪ {none_count})")
-        
-        # Step 5: Generate comprehensive report
-        report = {
-            'status': 'complete',
-            'course_id': course_id,
-            'total_queries': len(events),
-            'num_clusters': len(clusters),
-            'optimal_clusters': n_clusters,  # Include the k value used
-            'auto_detected': auto_detect_clusters,  # Flag whether it was auto-detected
-            'clusters': clusters,
-            'generated_at': datetime.now(timezone.utc).isoformat()
-        }
-        
-        # Step 6: Save report to Firestore
-        logger.info("Saving analytics report...")
-        firestore_service.save_analytics_report(course_id, report)
-        
-        logger.info(f"Daily analytics completed for course {course_id}")
-        return report
-        
-    except Exception as e:
-        logger.error(f"Failed to run daily analytics: {e}", exc_info=True)
-        raise
+            # Re-rank the previous samples and the new members around the moved centroid
+            previous = firestore_service.get_analytics_events_by_ids(
+                clusters[cluster_id].get('sample_doc_ids') or [], fields=['query_vector', 'query_text']
+            )
+            candidates = [
+                (e['doc_id'], analytics_logging_service.decode_query_vector(e.get('query_vector')), e.get('query_text'))
+                for e in previous
+            ]
+            members = np.flatnonzero(cluster_labels == cluster_id)
+            candidates += list(zip(frame['doc_ids'][members], vectors[members], frame['texts'][members]))
+            candidates = [c for c in candidates if c[1] is not None and len(c[1]) == centroids.shape[1]]
+            candidates.sort(key=lambda c: float(np.linalg.norm(c[1] - centroids[cluster_id])))
+            drifted[cluster_id] = candidates[:SAMPLE_SIZE]
+        
+        # Label the drifted clusters together; a cluster whose leading samples didn't change keeps its label
+        labels = _label_clusters(
+            [[(doc_id, text) for doc_id, _, text in samples] for samples in drifted.values()],
+            known=_known_labels(state)
+        )
+        for (cluster_id, samples), (label, fingerprint) in zip(drifted.items(), labels):
+            clusters[cluster_id]['label'] = label
+            clusters[cluster_id]['label_fingerprint'] = fingerprint
+            clusters[cluster_id]['sample_doc_ids'] = [str(doc_id) for doc_id, _, _ in samples]
+            clusters[cluster_id]['sample_queries'] = [text for _, _, text in samples if text][:3]
+            label_centroids[cluster_id] = centroids[cluster_id]
+            relabeled += 1
+            logger.info(f"Re-labeled cluster {cluster_id} (drift {drift[cluster_id]:.3f}): '{label}'")
+    
+    state = _cluster_state(
+        n_clusters, state.get('auto_detected', False), centroids, label_centroids, counts, clusters,
+        watermark=max((e['timestamp'] for e in events if e.get('timestamp')), default=state['watermark']),
+        total_queries=state.get('total_queries', 0) + len(events)
+    )
+    firestore_service.save_cluster_state(course_id, state)
+    
+    report = _report_from_state(course_id, state)
+    report['incremental'] = True
+    report['new_queries'] = len(events)
+    report['relabeled_clusters'] = relabeled
+    firestore_service.save_analytics_report(course_id, report)
+    
+    logger.info(
+        f"Incremental analytics completed for course {course_id}: "
+        f"{len(events)} new queries, {relabeled} cluster(s) re-labeled"
+    )
+    return report
 
 
 # ============================================================================
@@ -302,27 +542,83 @@ def _extract_vectors(events: List[dict]) -> tuple:
     This is where the analytics service parses what it needs from Firestore data.
     
     Args:
-        events: List of event dicts from Firestore (with 'doc_id' and 'query_vector' keys)
+        events: List of event dicts from Firestore (with 'doc_id' and 'query_vector' keys;
+                query_vector may be encoded bytes or a list of floats)
         
     Returns:
         Tuple of (vectors_array, doc_ids_list)
     """
     import numpy as np
     
-    # Filter events that have vectors
-    events_with_vectors = [e for e in events if e.get('query_vector')]
+    frame = _build_event_frame(events)
     
-    if not events_with_vectors:
+    if not len(frame['doc_ids']):
         logger.warning("No events with vectors found")
         return np.array([]), []
     
-    # Extract vectors and doc_ids
-    vectors = np.array([e['query_vector'] for e in events_with_vectors])
-    doc_ids = [e['doc_id'] for e in events_with_vectors]
+    return frame['vectors'], frame['doc_ids'].tolist()
+
+
+def _build_event_frame(events: List[dict]) -> dict:
+    """
+    Builds a columnar frame of chat events for vectorized grouping.
     
-    logger.info(f"Extracted {len(vectors)} vectors with {vectors.shape[1] if len(vectors) > 0 else 0} dimensions")
+    Events without a vector are dropped. Columns are parallel arrays:
+    'doc_ids' and 'texts' (object arrays), 'ratings' (int codes, see
+    _rating_code) and 'vectors' (one float32 matrix).
     
-    return vectors, doc_ids
+    Args:
+        events: Event dicts from get_analytics_events (query_vector may be
+                encoded bytes or a list of floats)
+        
+    Returns:
+        Dict of column name -> NumPy array
+    """
+    import numpy as np
+    
+    rows = [(e, analytics_logging_service.decode_query_vector(e.get('query_vector'))) for e in events]
+    rows = [(e, vector) for e, vector in rows if vector is not None]
+    
+    frame = {
+        'doc_ids': np.array([e['doc_id'] for e, _ in rows], dtype=object),
+        'texts': np.array([e.get('query_text') or '' for e, _ in rows], dtype=object),
+        'ratings': np.array([_rating_code(e.get('rating')) for e, _ in rows], dtype=np.int64),
+        'vectors': np.stack([vector for _, vector in rows]) if rows else np.empty((0, 0), dtype=np.float32)
+    }
+    
+    logger.info(f"Extracted {len(frame['vectors'])} vectors with {frame['vectors'].shape[1]} dimensions")
+    return frame
+
+
+def _rating_code(rating) -> int:
+    """Index of a rating in RATING_KEYS, or len(RATING_KEYS) for ratings the report doesn't count."""
+    if not rating:
+        return RATING_KEYS.index('none')
+    return {'helpful': RATING_KEYS.index('good'), 'not_helpful': RATING_KEYS.index('bad')}.get(rating, len(RATING_KEYS))
+
+
+def _rating_counts(cluster_labels, rating_codes, n_clusters: int):
+    """Counts ratings per cluster in one pass; returns an (n_clusters, len(RATING_KEYS)) array."""
+    import numpy as np
+    
+    width = len(RATING_KEYS) + 1  # Extra column for uncounted ratings
+    counts = np.bincount(np.asarray(cluster_labels) * width + rating_codes, minlength=n_clusters * width)
+    return counts.reshape(n_clusters, width)[:, :len(RATING_KEYS)]
+
+
+def _representatives(vectors, cluster_labels, cluster_centers, n_clusters: int, size: int = None) -> list:
+    """
+    Returns, per cluster, the row indices of its members closest to the
+    centroid (at most `size`, default SAMPLE_SIZE), closest first.
+    """
+    import numpy as np
+    
+    size = size or SAMPLE_SIZE
+    cluster_labels = np.asarray(cluster_labels)
+    distances = np.linalg.norm(vectors - np.asarray(cluster_centers)[cluster_labels], axis=1)
+    order = np.lexsort((distances, cluster_labels))
+    bounds = np.searchsorted(cluster_labels[order], np.arange(n_clusters + 1))
+    return [order[bounds[c]:bounds[c + 1]][:size] for c in range(n_clusters)]
 
 
 def _perform_clustering(vectors, n_clusters: int = 5):
@@ -354,45 +650,221 @@ def _perform_clustering(vectors, n_clusters: int = 5):
         raise
 
 
-def _label_cluster(query_texts: List[str]) -> str:
+def _restore_kmeans(centroids, counts):
+    """
+    Rebuilds a MiniBatchKMeans from persisted centroids and per-cluster counts.
+    
+    With init=centroids, a first partial_fit over the centroids themselves,
+    weighted by their counts, leaves every center in place and restores the
+    running counts that damp later updates. Random reassignment is disabled
+    so small clusters keep their identity (and label) across runs.
     """
-    Helper function to generate AI label for a cluster.
+    from sklearn.cluster import MiniBatchKMeans
+    
+    model = MiniBatchKMeans(
+        n_clusters=len(centroids), init=centroids, n_init=1, random_state=42,
+        batch_size=CLUSTER_BATCH_SIZE, reassignment_ratio=0.0
+    )
+    model.partial_fit(centroids, sample_weight=counts.astype(centroids.dtype))
+    return model
+
+
+def _cosine_distances(a, b):
+    """Row-wise cosine distance between two matrices of the same shape."""
+    import numpy as np
+    
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    similarity = np.einsum('ij,ij->i', a, b) / np.maximum(norms, 1e-12)
+    return 1.0 - similarity
+
+
+def _empty_cluster() -> dict:
+    """Cluster state entry for a cluster with no queries yet."""
+    return {
+        'label': None, 'label_fingerprint': None, 'sample_doc_ids': [], 'sample_queries': [],
+        'ratings': {'good': 0, 'bad': 0, 'none': 0}
+    }
+
+
+def _known_labels(state: dict) -> dict:
+    """Labels of a saved clustering state keyed by fingerprint (see _label_fingerprint)."""
+    clusters = (state or {}).get('clusters') or []
+    return {c['label_fingerprint']: c['label'] for c in clusters if c.get('label_fingerprint') and c.get('label')}
+
+
+def _cluster_state(n_clusters, auto_detected, centroids, label_centroids, counts, clusters,
+                   watermark, total_queries) -> dict:
+    """Builds the Firestore document persisted by firestore_service.save_cluster_state."""
+    return {
+        'n_clusters': int(n_clusters),
+        'auto_detected': bool(auto_detected),
+        'centroids': _pack_matrix(centroids),
+        'label_centroids': _pack_matrix(label_centroids),
+        'counts': [int(count) for count in counts],
+        'clusters': clusters,
+        'watermark': watermark,
+        'total_queries': int(total_queries),
+        'updated_at': datetime.now(timezone.utc).isoformat()
+    }
+
+
+def _report_from_state(course_id: str, state: dict) -> dict:
+    """Builds the analytics report from a clustering state."""
+    clusters = {}
+    for cluster, count in zip(state['clusters'], state['counts']):
+        if not count or not cluster.get('label'):
+            continue
+        clusters[cluster['label']] = {
+            'count': count,
+            'sample_queries': cluster['sample_queries'],
+            'ratings': cluster['ratings']
+        }
+    
+    return {
+        'status': 'complete',
+        'course_id': course_id,
+        'total_queries': state['total_queries'],
+        'num_clusters': len(clusters),
+        'optimal_clusters': state['n_clusters'],  # Include the k value used
+        'auto_detected': state['auto_detected'],  # Flag whether it was auto-detected
+        'clusters': clusters,
+        'generated_at': datetime.now(timezone.utc).isoformat()
+    }
+
+
+def _pack_matrix(matrix) -> bytes:
+    """Serializes a matrix as packed float32 bytes."""
+    import numpy as np
+    
+    return np.ascontiguousarray(matrix, dtype=np.float32).tobytes()
+
+
+def _unpack_matrix(blob: bytes, rows: int):
+    """Reads a matrix written by _pack_matrix (zero-copy, read-only)."""
+    import numpy as np
+    
+    return np.frombuffer(blob, dtype=np.float32).reshape(rows, -1)
+
+
+def _label_fingerprint(doc_ids: List[str]) -> str:
+    """
+    Fingerprint of the representative queries a label was generated from.
+    
+    Covers the top LABEL_QUERIES doc IDs (the ones sent to the model) and
+    the prompt version, so a cluster whose leading samples are unchanged
+    keeps its label, and editing the prompt relabels every cluster.
+    """
+    top = sorted(str(doc_id) for doc_id in doc_ids[:LABEL_QUERIES])
+    raw = "|".join([hashlib.sha256(LABEL_PROMPT.encode('utf-8')).hexdigest()[:12]] + top)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _label_clusters(samples: List[list], known: dict = None) -> List[tuple]:
+    """
+    Labels several clusters at once.
+    
+    Labels whose fingerprint is in `known` are reused without an LLM call;
+    the rest are generated concurrently (ANALYTICS_LABEL_WORKERS requests
+    in flight), or with a single prompt when ANALYTICS_LABEL_BATCH is set.
     
     Args:
-        query_texts: List of representative queries from this cluster
+        samples: One list per cluster of (doc_id, query_text) pairs, most
+            representative first (pairs without text are ignored)
+        known: Previously generated labels keyed by fingerprint
         
     Returns:
-        Human-readable label for the cluster
+        One (label, fingerprint) tuple per cluster, in order. Fallback
+        labels have no fingerprint, so they are retried on the next run.
+        
+    Example:
+        labels = _label_clusters([[('doc1', 'What is recursion?')], ...], known={'ab12...': 'Recursion'})
+        # Returns: [('Recursion', 'ab12...'), ...]
     """
-    if not query_texts:
-        return "Miscellaneous Questions"
+    known = known or {}
+    results = [None] * len(samples)
+    missing = []
+    
+    for index, pairs in enumerate(samples):
+        pairs = [(doc_id, text) for doc_id, text in pairs if text]
+        if not pairs:
+            results[index] = ("Miscellaneous Questions", None)
+            continue
+        fingerprint = _label_fingerprint([doc_id for doc_id, _ in pairs])
+        if fingerprint in known:
+            results[index] = (known[fingerprint], fingerprint)
+        else:
+            missing.append((index, fingerprint, [text for _, text in pairs]))
     
-    # TODO: Use Gemini to generate better labels
-    # For now, create a simple descriptive label
+    logger.info(f"Labeling {len(missing)} clusters ({len(samples) - len(missing)} reused)")
+    if not missing:
+        return results
+    
+    texts = [query_texts for _, _, query_texts in missing]
+    labels = _generate_labels_batch(texts) if LABEL_BATCH and len(missing) > 1 else None
+    if labels is None:
+        workers = max(1, min(LABEL_WORKERS, len(missing)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # map() yields labels in cluster order
+            labels = list(executor.map(_try_label, texts))
+    
+    for (index, fingerprint, query_texts), label in zip(missing, labels):
+        results[index] = (label, fingerprint) if label else (_fallback_label(query_texts), None)
+    return results
+
+
+def _try_label(query_texts: List[str]):
+    """Asks Gemini for a cluster label; returns None if the request fails."""
     try:
         # Combine sample queries
-        samples = "\n".join([f"- {q}" for q in query_texts[:5]])
-        
-        prompt = (
-            f"Given these student questions from a course:\n{samples}\n\n"
-            f"Generate a short category label (2-4 words) that describes the common theme or topic. "
-            f"Be specific and use technical terms when appropriate. "
-            f"Only return the category label, nothing else."
-        )
-        
-        label = gemini_service.generate_answer(prompt)
-        
-        # Clean up the label (remove quotes, extra whitespace)
-        label = label.strip().strip('"').strip("'").strip()
+        samples = "\n".join([f"- {q}" for q in query_texts[:LABEL_QUERIES]])
+        label = _clean_label(gemini_service.generate_answer(LABEL_PROMPT.format(samples=samples)))
         
         logger.info(f"Generated cluster label: {label}")
-        return label
+        return label or None
         
     except Exception as e:
         logger.error(f"Failed to generate AI label: {e}")
-        # Fallback: use first few words of first query
-        fallback = query_texts[0][:50]
-        return f"Questions about {fallback}..."
+        return None
+
+
+def _generate_labels_batch(query_text_lists: List[List[str]]):
+    """
+    Labels every cluster with a single prompt.
+    
+    Returns:
+        One label per cluster, or None if the response can't be parsed
+        (the caller then labels the clusters individually)
+    """
+    groups = "\n\n".join(
+        f"Group {number}:\n" + "\n".join(f"- {q}" for q in query_texts[:LABEL_QUERIES])
+        for number, query_texts in enumerate(query_text_lists, start=1)
+    )
+    try:
+        response = gemini_service.generate_answer(LABEL_BATCH_PROMPT.format(count=len(query_text_lists), groups=groups))
+        # Tolerate a Markdown code fence around the JSON
+        response = response.strip().removeprefix('```json').removeprefix('```').removesuffix('```')
+        labels = json.loads(response)
+        if not isinstance(labels, list) or len(labels) != len(query_text_lists):
+            raise ValueError(f"expected {len(query_text_lists)} labels, got {response[:100]!r}")
+        
+        labels = [_clean_label(str(label)) or None for label in labels]
+        logger.info(f"Generated {len(labels)} cluster labels in one request")
+        return labels
+        
+    except Exception as e:
+        logger.error(f"Failed to generate batched labels, labeling clusters individually: {e}")
+        return None
+
+
+def _clean_label(label: str) -> str:
+    """Removes quotes and extra whitespace from a generated label."""
+    return label.strip().strip('"').strip("'").strip()
+
+
+def _fallback_label(query_texts: List[str]) -> str:
+    """Label used when no AI label could be generated: the first few words of the first query."""
+    fallback = query_texts[0][:50]
+    return f"Questions about {fallback}..."
 
 
 # ============================================================================
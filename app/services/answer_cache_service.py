@@ -0,0 +1,166 @@
+"""
+Answer Cache Service
+Per-course semantic cache of chat answers.
+
+This service is responsible for:
+- Matching a question's embedding against previously answered questions
+  in the same course (cosine similarity >= ANSWER_CACHE_THRESHOLD)
+- Expiring entries after ANSWER_CACHE_TTL_SECONDS
+- Dropping entries produced against an older version of the course corpus
+
+Students in a course ask the same handful of questions over and over;
+a near-duplicate is served the cached answer and sources without paying
+for RAG retrieval or a Gemini generation.
+
+The cache lives in process memory, so each instance warms its own copy.
+
+Dependencies:
+- numpy: For the similarity scan
+"""
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from cachetools import LRUCache, TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+ANSWER_CACHE_ENABLED = os.environ.get('ANSWER_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ANSWER_CACHE_THRESHOLD = float(os.environ.get('ANSWER_CACHE_THRESHOLD', '0.95'))  # Min cosine similarity for a hit
+ANSWER_CACHE_TTL = int(os.environ.get('ANSWER_CACHE_TTL_SECONDS', '86400'))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', '500'))  # Per course
+ANSWER_CACHE_MAX_COURSES = int(os.environ.get('ANSWER_CACHE_MAX_COURSES', '256'))
+
+# course_id -> TTLCache(normalized question -> entry)
+_course_caches = LRUCache(maxsize=ANSWER_CACHE_MAX_COURSES)
+_lock = threading.Lock()
+
+
+def corpus_version(course_data: dict) -> str:
+    """
+    Returns the version tag of a course's corpus. It changes whenever the
+    course is re-initialized (new corpus_id) or re-synced (corpus_version
+    is incremented by firestore_service.update_course_files).
+
+    Args:
+        course_data: The course document as a dict
+
+    Returns:
+        Version string such as "projects/.../ragCorpora/123:4"
+    """
+    return f"{course_data.get('corpus_id')}:{course_data.get('corpus_version', 0)}"
+
+
+def lookup(course_id: str, query_vector: list, version: str) -> Optional[dict]:
+    """
+    Finds the cached answer whose question is most similar to this one.
+
+    Args:
+        course_id: The Canvas course ID
+        query_vector: Embedding of the new question
+        version: Current corpus version (see corpus_version)
+
+    Returns:
+        Dict with 'answer', 'sources', 'query_text' and 'similarity',
+        or None if nothing is similar enough
+
+    Example:
+        hit = lookup("12345", vector, corpus_version(course_dict))
+        if hit:
+            answer, sources = hit['answer'], hit['sources']
+    """
+    if not ANSWER_CACHE_ENABLED or not query_vector:
+        return None
+
+    with _lock:
+        cache = _course_caches.get(course_id)
+        if cache is None:
+            return None
+        cache.expire()
+        stale = [key for key, entry in cache.items() if entry['version'] != version]
+        for key in stale:
+            del cache[key]
+        entries = list(cache.values())
+
+    if not entries:
+        return None
+
+    query = _normalize(query_vector)
+    if query is None:
+        return None
+    matrix = np.stack([entry['vector'] for entry in entries])
+    similarities = matrix @ query
+    best = int(np.argmax(similarities))
+    if similarities[best] < ANSWER_CACHE_THRESHOLD:
+        return None
+
+    entry = entries[best]
+    logger.info(f"Answer cache hit for course {course_id} (similarity {similarities[best]:.3f})")
+    return {
+        'answer': entry['answer'],
+        'sources': entry['sources'],
+        'query_text': entry['query_text'],
+        'similarity': float(similarities[best])
+    }
+
+
+def store(course_id: str, query_text: str, query_vector: list, version: str, answer: str, sources: list) -> None:
+    """
+    Caches an answer for later near-duplicate questions.
+    Answers without sources (nothing was retrieved) are not cached.
+
+    Args:
+        course_id: The Canvas course ID
+        query_text: The student's question
+        query_vector: Embedding of the question
+        version: Corpus version the answer was generated against
+        answer: The generated answer
+        sources: Source dicts returned with the answer
+    """
+    if not ANSWER_CACHE_ENABLED or not query_vector or not sources:
+        return
+
+    vector = _normalize(query_vector)
+    if vector is None:
+        return
+
+    with _lock:
+        cache = _course_caches.get(course_id)
+        if cache is None:
+            cache = TTLCache(maxsize=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL)
+            _course_caches[course_id] = cache
+        cache[' '.join(query_text.lower().split())] = {
+            'query_text': query_text,
+            'vector': vector,
+            'version': version,
+            'answer': answer,
+            'sources': sources,
+            'created_at': time.time()
+        }
+
+
+def invalidate(course_id: str = None) -> None:
+    """
+    Drops every cached answer for a course (or for all courses if course_id is None).
+
+    Args:
+        course_id: The Canvas course ID, or None to clear everything
+    """
+    with _lock:
+        if course_id is None:
+            _course_caches.clear()
+        else:
+            _course_caches.pop(course_id, None)
+
+
+def _normalize(vector: list):
+    """Returns the vector as a unit-length float32 array (None for a zero vector)."""
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    if norm == 0:
+        return None
+    return array / norm
@@ -9,9 +9,13 @@ This service provides functions to:
 All functions use the Canvas REST API and handle authentication via API tokens.
 """
 import requests
-from typing import Tuple, Dict, List
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Tuple, Dict, List, Callable
 import logging
 import os
+import threading
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -21,8 +25,18 @@ logger = logging.getLogger(__name__)
 CANVAS_API_BASE = os.environ.get('CANVAS_BASE_URL', 'https://canvas.instructure.com/api/v1')
 ALLOWED_FILE_TYPES = ['.pdf', '.txt', '.md', '.doc', '.docx']
 
+# Download tuning
+DOWNLOAD_WORKERS = int(os.environ.get('CANVAS_DOWNLOAD_WORKERS', '8'))
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+DOWNLOAD_TIMEOUT = 60
+DOWNLOAD_MAX_RETRIES = 4
 
-def get_course_files(course_id: str, token: str, download: bool = True, output_dir: str = None) -> Tuple[List[Dict], Dict]:
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_course_files(course_id: str, token: str, download: bool = True, output_dir: str = None,
+                     progress_callback: Callable[[Dict, int, int], None] = None) -> Tuple[List[Dict], Dict]:
     """
     Fetches all files from a Canvas course with pagination support.
     Filters for allowed file types, optionally downloads them, and adds local paths to file objects.
@@ -32,6 +46,7 @@ def get_course_files(course_id: str, token: str, download: bool = True, output_d
         token: Canvas API access token
         download: Whether to download files to local storage (default: True)
         output_dir: Directory to save files (default: app/data/courses/{course_id}/)
+        progress_callback: Optional callable(file, completed_count, total_count) for download progress
         
     Returns:
         Tuple containing:
@@ -121,7 +136,7 @@ def get_course_files(course_id: str, token: str, download: bool = True, output_d
         
         # Download files if requested
         if download:
-            _download_files(files_list, token, course_id, output_dir)
+            download_files(files_list, token, course_id, output_dir, progress_callback)
         
         return files_list, indexed_files
         
@@ -130,17 +145,23 @@ def get_course_files(course_id: str, token: str, download: bool = True, output_d
         raise Exception(f"Failed to fetch course files: {str(e)}")
 
 
-def _download_files(files: list, token: str, course_id: str, output_dir: str = None) -> None:
+def download_files(files: list, token: str, course_id: str, output_dir: str = None,
+                   progress_callback: Callable[[Dict, int, int], None] = None) -> None:
     """
-    Internal function to download Canvas files to local storage.
+    Downloads Canvas files to local storage concurrently.
     Called by get_course_files() when download=True.
     Modifies the files list in-place to add 'local_path' to each file object.
     
+    Files are fetched by a bounded thread pool over one shared keep-alive
+    session, streamed to disk in chunks, and retried with backoff on 429/5xx.
+    
     Args:
         files: List of file objects from Canvas API (modified in-place)
         token: Canvas API access token
         course_id: The Canvas course ID (for default directory naming)
         output_dir: Directory to save files (default: app/data/courses/{course_id}/)
+        progress_callback: Optional callable(file, completed_count, total_count),
+                           invoked after each file finishes (successfully or not)
     """
     
     # Use provided directory or create course-specific directory
@@ -152,43 +173,120 @@ def _download_files(files: list, token: str, course_id: str, output_dir: str = N
     # Create directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
-    logger.info(f"Downloading {len(files)} files to {output_dir}...")
+    logger.info(f"Downloading {len(files)} files to {output_dir} ({DOWNLOAD_WORKERS} concurrent)...")
     
-    download_count = 0
+    session = _get_session()
     headers = {'Authorization': f'Bearer {token}'}
+    total = len(files)
+    download_count = 0
+    completed = 0
     
-    for file in files:
-        try:
-            file_id = file.get('id')
-            display_name = file.get('display_name', f"file_{file_id}")
-            download_url = file.get('url')
-            
-            logger.info(f"Downloading: {display_name} (ID: {file_id})")
-            
-            # Download file content
-            response = requests.get(download_url, headers=headers, timeout=60)
-            response.raise_for_status()
-            
-            # Save to local file
-            file_path = os.path.join(output_dir, display_name)
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
-            
-            # Add local_path to the file object
-            file['local_path'] = file_path
-            download_count += 1
-            
-            logger.info(f"Saved: {file_path}")
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        futures = {
+            executor.submit(_download_file, session, file, headers, output_dir): file
+            for file in files
+        }
+        
+        for future in as_completed(futures):
+            file = futures[future]
+            completed += 1
+            try:
+                file['local_path'] = future.result()
+                download_count += 1
+                logger.info(f"[{completed}/{total}] Saved: {file['local_path']}")
+            except Exception as e:
+                logger.error(f"[{completed}/{total}] Failed to download {file.get('display_name')}: {str(e)}")
+                # Add None for failed downloads
+                file['local_path'] = None
             
-        except Exception as e:
-            logger.error(f"Failed to download {file.get('display_name')}: {str(e)}")
-            # Add None for failed downloads
-            file['local_path'] = None
-            continue
+            if progress_callback:
+                progress_callback(file, completed, total)
     
     logger.info(f"Successfully downloaded {download_count}/{len(files)} files")
 
 
+def _download_file(session: requests.Session, file: Dict, headers: Dict, output_dir: str) -> str:
+    """
+    Streams a single Canvas file to disk.
+    Writes to a temporary '.part' file first so a failed download never
+    leaves a truncated file at the final path.
+    
+    Returns:
+        Local path of the saved file
+    """
+    file_id = file.get('id')
+    display_name = file.get('display_name', f"file_{file_id}")
+    file_path = os.path.join(output_dir, display_name)
+    part_path = f"{file_path}.{file_id}.part"
+    
+    logger.info(f"Downloading: {display_name} (ID: {file_id})")
+    
+    try:
+        with session.get(file.get('url'), headers=headers, timeout=DOWNLOAD_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            with open(part_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if chunk:
+                        f.write(chunk)
+        os.replace(part_path, file_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    
+    return file_path
+
+
+def _get_session() -> requests.Session:
+    """
+    Returns the shared Canvas download session (created on first use).
+    The connection pool is sized to the worker count so every download
+    thread reuses a keep-alive connection, and urllib3 retries 429/5xx
+    responses with exponential backoff (honoring Retry-After).
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=DOWNLOAD_MAX_RETRIES,
+                backoff_factor=1,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=['GET'],
+                respect_retry_after_header=True
+            )
+            adapter = HTTPAdapter(pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS, max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def diff_indexed_files(stored: Dict, current: Dict) -> Dict[str, List[str]]:
+    """
+    Compares a stored indexed files map against a fresh Canvas listing.
+    Both maps come from get_course_files() (file_id -> {'hash': ..., 'url': ...}).
+    
+    Args:
+        stored: Indexed files map saved on the course document
+        current: Indexed files map from the current Canvas listing
+        
+    Returns:
+        Dictionary of file ID lists: {'added': [...], 'changed': [...], 'removed': [...]}
+        
+    Example:
+        diff = diff_indexed_files({'1': {'hash': 'a'}}, {'1': {'hash': 'b'}, '2': {'hash': 'c'}})
+        # diff = {'added': ['2'], 'changed': ['1'], 'removed': []}
+    """
+    stored = stored or {}
+    added = [fid for fid in current if fid not in stored]
+    removed = [fid for fid in stored if fid not in current]
+    changed = [
+        fid for fid in current
+        if fid in stored and current[fid].get('hash') != stored[fid].get('hash')
+    ]
+    return {'added': added, 'changed': changed, 'removed': removed}
+
+
 def get_syllabus(course_id: str, token: str) -> str:
     """
     Fetches the syllabus content from a Canvas course.
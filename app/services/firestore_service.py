@@ -4,8 +4,10 @@ Handles all Cloud Firestore operations for course data persistence.
 """
 from google.cloud import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
+from cachetools import LRUCache, TTLCache
 import os
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +31,30 @@ except Exception as e:
 COURSES_COLLECTION = 'courses'
 ANALYTICS_COLLECTION = 'course_analytics'
 REPORTS_COLLECTION = 'analytics_reports'
+CLUSTER_STATE_COLLECTION = 'analytics_cluster_state'
+JOBS_COLLECTION = 'course_jobs'
+CHECKPOINTS_SUBCOLLECTION = 'checkpoints'
+SUMMARY_CACHE_COLLECTION = 'summary_cache'
+
+# Page size for streaming analytics events (see iter_analytics_events)
+ANALYTICS_PAGE_SIZE = int(os.environ.get('ANALYTICS_PAGE_SIZE', '500'))
+
+# Per-process read-through cache of ACTIVE course documents (see get_course_data)
+COURSE_CACHE_TTL = int(os.environ.get('COURSE_CACHE_TTL_SECONDS', '60'))
+COURSE_CACHE_SIZE = int(os.environ.get('COURSE_CACHE_SIZE', '128'))
+# Keep cached courses fresh across processes with Firestore on_snapshot listeners
+COURSE_CACHE_LISTENER = os.environ.get('COURSE_CACHE_LISTENER', '').lower() in ('1', 'true', 'yes')
+
+# Knowledge graphs live in a versioned subcollection of the course document (see get_course_graph)
+GRAPH_SUBCOLLECTION = 'graph'
+GRAPH_FIELDS = ('kg_nodes', 'kg_edges', 'kg_data')
+GRAPH_VERSIONS_KEPT = int(os.environ.get('GRAPH_VERSIONS_KEPT', '3'))
+
+_course_cache = TTLCache(maxsize=COURSE_CACHE_SIZE, ttl=COURSE_CACHE_TTL)
+_course_cache_lock = threading.Lock()
+_course_watches = {}
+# Graph version documents are immutable, so they only need LRU eviction
+_graph_cache = LRUCache(maxsize=COURSE_CACHE_SIZE)
 
 
 def _ensure_db():
@@ -52,7 +78,7 @@ def get_course_state(course_id: str) -> str:
     """
     _ensure_db()
     try:
-        doc = db.collection(COURSES_COLLECTION).document(course_id).get()
+        doc = get_course_data(course_id)
         
         if not doc.exists:
             return 'NEEDS_INIT'
@@ -72,6 +98,29 @@ def get_course_state(course_id: str) -> str:
 
 
 
+def list_course_ids(status: str = 'ACTIVE') -> list[str]:
+    """
+    Lists the IDs of all courses in a given state (document IDs only).
+    
+    Args:
+        status: Course status to match (default: 'ACTIVE')
+        
+    Returns:
+        List of Canvas course IDs
+        
+    Example:
+        course_ids = list_course_ids()
+        # Returns: ['12345', '67890']
+    """
+    _ensure_db()
+    
+    query = db.collection(COURSES_COLLECTION).where(filter=FieldFilter('status', '==', status))
+    course_ids = [doc.id for doc in _project(query, []).stream()]
+    
+    logger.info(f"Found {len(course_ids)} courses with status {status}")
+    return course_ids
+
+
 def create_course_doc(course_id: str) -> None:
     """
     Creates the initial course document with GENERATING status.
@@ -85,6 +134,7 @@ def create_course_doc(course_id: str) -> None:
         'status': 'GENERATING',
         'init_logs': []  # Initialize empty logs array
     })
+    invalidate_course_cache(course_id)
 
 
 def add_init_log(course_id: str, message: str, level: str = 'info') -> None:
@@ -107,6 +157,7 @@ def add_init_log(course_id: str, message: str, level: str = 'info') -> None:
     db.collection(COURSES_COLLECTION).document(course_id).update({
         'init_logs': ArrayUnion([log_entry])
     })
+    invalidate_course_cache(course_id)
 
 
 def get_init_logs(course_id: str) -> list:
@@ -127,18 +178,88 @@ def get_init_logs(course_id: str) -> list:
 
 
 # returns the google.cloud.firestore.document.DocumentSnapshot class
-def get_course_data(course_id: str):
+def get_course_data(course_id: str, use_cache: bool = True):
     """
     Fetches the complete course document.
     
+    ACTIVE course documents are kept in a per-process TTL + LRU cache
+    (COURSE_CACHE_TTL_SECONDS, COURSE_CACHE_SIZE), so hot courses are served
+    without a Firestore round trip. Every write helper in this module
+    invalidates the course's entry.
+    
     Args:
         course_id: The Canvas course ID
+        use_cache: Set to False to always read from Firestore
         
     Returns:
         DocumentSnapshot containing all course data
     """
     _ensure_db()
-    return db.collection(COURSES_COLLECTION).document(course_id).get()
+    if use_cache:
+        with _course_cache_lock:
+            doc = _course_cache.get(course_id)
+        if doc is not None:
+            return doc
+    
+    doc_ref = db.collection(COURSES_COLLECTION).document(course_id)
+    doc = doc_ref.get()
+    
+    # Only ACTIVE courses are stable enough to cache; GENERATING ones change constantly
+    if doc.exists and doc.get('status') == 'ACTIVE':
+        with _course_cache_lock:
+            _course_cache[course_id] = doc
+        if COURSE_CACHE_LISTENER:
+            _watch_course(course_id, doc_ref)
+    return doc
+
+
+def invalidate_course_cache(course_id: str = None) -> None:
+    """
+    Drops a course (or every course, if course_id is None) from the course cache.
+    
+    Args:
+        course_id: The Canvas course ID, or None to clear the whole cache
+    """
+    with _course_cache_lock:
+        if course_id is None:
+            _course_cache.clear()
+            _graph_cache.clear()
+        else:
+            _course_cache.pop(course_id, None)
+
+
+def _watch_course(course_id: str, doc_ref) -> None:
+    """
+    Attaches an on_snapshot listener that keeps the cached document current,
+    so writes made by other processes are picked up before the TTL expires.
+    Listeners for courses that have been evicted are detached.
+    """
+    def on_snapshot(doc_snapshots, changes, read_time):
+        for snapshot in doc_snapshots:
+            with _course_cache_lock:
+                if snapshot.exists and snapshot.get('status') == 'ACTIVE' and course_id in _course_cache:
+                    _course_cache[course_id] = snapshot
+                else:
+                    _course_cache.pop(course_id, None)
+    
+    with _course_cache_lock:
+        if course_id in _course_watches:
+            return
+        stale = [cid for cid in _course_watches if cid not in _course_cache]
+        watches_to_close = [_course_watches.pop(cid) for cid in stale]
+    
+    for watch in watches_to_close:
+        try:
+            watch.unsubscribe()
+        except Exception as e:
+            logger.warning(f"Failed to detach course listener: {e}")
+    
+    try:
+        watch = doc_ref.on_snapshot(on_snapshot)
+        with _course_cache_lock:
+            _course_watches[course_id] = watch
+    except Exception as e:
+        logger.warning(f"Failed to attach course listener for {course_id}: {e}")
 
 
 
@@ -147,44 +268,471 @@ def get_course_data(course_id: str):
 # corpus_id, indexed_files, kg_nodes, kg_edges, kg_data
 def finalize_course_doc(course_id: str, data: dict) -> None:
     """
-    Updates the course document with all RAG/KG data and sets status to ACTIVE.
+    Stores the RAG/KG data for a course and sets its status to ACTIVE.
+    
+    The knowledge graph is written to a new graph version document (see
+    get_course_graph); the course document itself only records the
+    corpus, the indexed files and which graph version is current.
     
     Args:
         course_id: The Canvas course ID
         data: Dictionary containing corpus_id, indexed_files, kg_nodes, kg_edges, kg_data
     """
     _ensure_db()
-    db.collection(COURSES_COLLECTION).document(course_id).update({
+    _write_graph_version(course_id, data.get('kg_nodes'), data.get('kg_edges'), data.get('kg_data'), {
         'status': 'ACTIVE',
         'corpus_id': data.get('corpus_id'),
-        'indexed_files': data.get('indexed_files'),
-        'kg_nodes': data.get('kg_nodes'),
-        'kg_edges': data.get('kg_edges'),
-        'kg_data': data.get('kg_data')
+        'indexed_files': data.get('indexed_files')
     })
+    invalidate_course_cache(course_id)
 
-def update_knowledge_graph(course_id: str, kg_nodes: list, kg_edges: list, kg_data: dict) -> None:
+def update_knowledge_graph(course_id: str, kg_nodes: str, kg_edges: str, kg_data: str) -> None:
     """
     Updates only the knowledge graph portion of a course document.
     Does NOT overwrite corpus_id, indexed_files, or status.
 
     Args:
         course_id: The Canvas course ID
-        kg_nodes: Updated list of node dicts
-        kg_edges: Updated list of edge dicts
-        kg_data:  Updated dict keyed by topic_id
+        kg_nodes: Updated nodes JSON string
+        kg_edges: Updated edges JSON string
+        kg_data:  Updated kg_data JSON string (keyed by topic_id)
+    """
+    _ensure_db()
+    _write_graph_version(course_id, kg_nodes, kg_edges, kg_data, {})
+    invalidate_course_cache(course_id)
+
+    logger.info(f"Updated knowledge graph for course {course_id}")
+
+
+def update_course_files(course_id: str, indexed_files: dict, kg_nodes: str, kg_edges: str, kg_data: str) -> None:
+    """
+    Updates the indexed files map and knowledge graph after a course re-sync.
+    Does NOT overwrite corpus_id or status. Bumps corpus_version, which
+    invalidates answers cached against the old corpus contents.
+    
+    Args:
+        course_id: The Canvas course ID
+        indexed_files: Updated indexed files map (file_id -> {hash, url, gcs_uri, ...})
+        kg_nodes: Updated nodes JSON string
+        kg_edges: Updated edges JSON string
+        kg_data: Updated kg_data JSON string
     """
     _ensure_db()
+    import time
+    _write_graph_version(course_id, kg_nodes, kg_edges, kg_data, {
+        'indexed_files': indexed_files,
+        'corpus_version': firestore.Increment(1),
+        'last_synced_at': time.time()
+    })
+    invalidate_course_cache(course_id)
+    logger.info(f"Updated indexed files and knowledge graph for course {course_id}")
 
-    update_payload = {
+
+
+def mark_course_synced(course_id: str) -> None:
+    """
+    Records a re-sync that found no added, changed or removed files.
+    Only last_synced_at is updated: the graph and corpus_version are left
+    alone, so cached answers and graphs stay valid.
+    
+    Args:
+        course_id: The Canvas course ID
+    """
+    _ensure_db()
+    import time
+    db.collection(COURSES_COLLECTION).document(course_id).update({'last_synced_at': time.time()})
+    invalidate_course_cache(course_id)
+    logger.info(f"Course {course_id} is already in sync")
+
+def get_course_graph(course_id: str, course_doc=None, use_cache: bool = True) -> dict:
+    """
+    Fetches the knowledge graph of a course.
+    
+    Graphs live in courses/{course_id}/graph/{graph_version}; version
+    documents are never modified after they are written, so they are
+    cached per process by version. Courses written before the graph was
+    split out still carry kg_nodes/kg_edges/kg_data on the course
+    document, and those fields are returned as-is.
+    
+    Args:
+        course_id: The Canvas course ID
+        course_doc: Course DocumentSnapshot the caller already fetched (optional)
+        use_cache: Set to False to read the course document from Firestore
+        
+    Returns:
+        Dict with 'kg_nodes', 'kg_edges', 'kg_data' (JSON strings or None)
+        and 'graph_version' (None for legacy courses), or None if the course
+        does not exist
+        
+    Example:
+        graph = get_course_graph("12345")
+        nodes = json.loads(graph['kg_nodes'] or '[]')
+    """
+    _ensure_db()
+    if course_doc is None:
+        course_doc = get_course_data(course_id, use_cache=use_cache)
+    if not course_doc.exists:
+        return None
+    
+    header = course_doc.to_dict() or {}
+    version = header.get('graph_version')
+    if not version:
+        return _graph_from(header, None)
+    
+    graph = _read_graph_version(course_id, version)
+    if graph is None:
+        # The version was pruned after this header was read; the fresh header points at a newer one
+        header = get_course_data(course_id, use_cache=False).to_dict() or {}
+        version = header.get('graph_version')
+        graph = _read_graph_version(course_id, version) if version else None
+    if graph is None:
+        logger.error(f"Graph version {version} for course {course_id} not found")
+        return _graph_from({}, version)
+    return graph
+
+
+def _read_graph_version(course_id: str, version: str):
+    """Returns the graph stored under a version (cached), or None if it does not exist."""
+    key = (course_id, version)
+    with _course_cache_lock:
+        graph = _graph_cache.get(key)
+    if graph is not None:
+        return graph
+    
+    doc = db.collection(COURSES_COLLECTION).document(course_id) \
+        .collection(GRAPH_SUBCOLLECTION).document(version).get()
+    if not doc.exists:
+        return None
+    graph = _graph_from(doc.to_dict() or {}, version)
+    with _course_cache_lock:
+        _graph_cache[key] = graph
+    return graph
+
+
+def _graph_from(data: dict, version) -> dict:
+    """Picks the graph fields out of a document dict."""
+    graph = {field: data.get(field) for field in GRAPH_FIELDS}
+    graph['graph_version'] = version
+    return graph
+
+
+def _write_graph_version(course_id: str, kg_nodes: str, kg_edges: str, kg_data: str, header_updates: dict) -> str:
+    """
+    Writes the graph as a new version document and points the course
+    document at it in the same batch, removing any legacy inline graph
+    fields. Older versions beyond GRAPH_VERSIONS_KEPT are then deleted.
+    
+    Returns:
+        The new graph version ID
+    """
+    import time
+    import uuid
+    # Sortable by creation time, unique across writers
+    version = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+    course_ref = db.collection(COURSES_COLLECTION).document(course_id)
+    graph_ref = course_ref.collection(GRAPH_SUBCOLLECTION).document(version)
+    
+    batch = db.batch()
+    batch.set(graph_ref, {
         'kg_nodes': kg_nodes,
         'kg_edges': kg_edges,
-        'kg_data':  kg_data
-    }
+        'kg_data': kg_data,
+        'created_at': time.time()
+    })
+    batch.update(course_ref, {
+        **header_updates,
+        'graph_version': version,
+        **{field: firestore.DELETE_FIELD for field in GRAPH_FIELDS}
+    })
+    batch.commit()
+    
+    try:
+        versions = sorted(ref.id for ref in course_ref.collection(GRAPH_SUBCOLLECTION).list_documents())
+        for old_version in versions[:-GRAPH_VERSIONS_KEPT]:
+            if old_version != version:
+                course_ref.collection(GRAPH_SUBCOLLECTION).document(old_version).delete()
+    except Exception as e:
+        logger.warning(f"Failed to prune old graph versions for course {course_id}: {e}")
+    return version
 
-    db.collection(COURSES_COLLECTION).document(course_id).update(update_payload)
 
-    logger.info(f"Updated knowledge graph for course {course_id}")
+def set_course_error(course_id: str, message: str) -> None:
+    """
+    Marks a course document as failed so the UI stops showing it as GENERATING.
+    
+    Args:
+        course_id: The Canvas course ID
+        message: Error message to store on the course document
+    """
+    _ensure_db()
+    db.collection(COURSES_COLLECTION).document(course_id).update({
+        'status': 'ERROR',
+        'error_message': message
+    })
+    invalidate_course_cache(course_id)
+
+
+# ============================================================================
+# BACKGROUND JOBS
+# ============================================================================
+
+def create_job(course_id: str, job_type: str, params: dict = None, owner: str = None) -> str:
+    """
+    Creates a new background job document in QUEUED state.
+    
+    Args:
+        course_id: The Canvas course ID the job operates on
+        job_type: Kind of job (e.g., 'initialize_course')
+        params: Optional job input parameters (e.g., {'topics': '...'})
+        owner: ID of the worker process that will run the job (see claim_job)
+        
+    Returns:
+        The auto-generated job ID
+    """
+    _ensure_db()
+    import time
+    now = time.time()
+    doc_ref = db.collection(JOBS_COLLECTION).document()
+    doc_ref.set({
+        'course_id': course_id,
+        'type': job_type,
+        'params': params or {},
+        'status': 'QUEUED',
+        'current_stage': None,
+        'completed_stages': [],
+        'result': None,
+        'error_message': None,
+        'attempts': 0,
+        'owner': owner,
+        'created_at': now,
+        'updated_at': now,
+        'heartbeat_at': now
+    })
+    logger.info(f"Created {job_type} job {doc_ref.id} for course {course_id}")
+    return doc_ref.id
+
+
+def get_job(job_id: str) -> dict:
+    """
+    Fetches a background job document.
+    
+    Args:
+        job_id: The job document ID
+        
+    Returns:
+        Dictionary with the job data plus 'job_id', or empty dict if not found
+    """
+    _ensure_db()
+    doc = db.collection(JOBS_COLLECTION).document(job_id).get()
+    if not doc.exists:
+        return {}
+    job = doc.to_dict()
+    job['job_id'] = doc.id
+    return job
+
+
+def get_latest_job(course_id: str, job_type: str) -> dict:
+    """
+    Fetches the most recently created job of a given type for a course.
+    
+    Args:
+        course_id: The Canvas course ID
+        job_type: Kind of job (e.g., 'initialize_course')
+        
+    Returns:
+        Dictionary with the job data plus 'job_id', or empty dict if none exist
+    """
+    _ensure_db()
+    query = db.collection(JOBS_COLLECTION) \
+        .where(filter=FieldFilter('course_id', '==', course_id)) \
+        .where(filter=FieldFilter('type', '==', job_type))
+    
+    latest = {}
+    for doc in query.stream():
+        job = doc.to_dict()
+        if not latest or job.get('created_at', 0) > latest.get('created_at', 0):
+            job['job_id'] = doc.id
+            latest = job
+    return latest
+
+
+def update_job(job_id: str, fields: dict) -> None:
+    """
+    Updates fields on a background job document and refreshes its heartbeat.
+    
+    Args:
+        job_id: The job document ID
+        fields: Fields to update (e.g., {'status': 'RUNNING'})
+    """
+    _ensure_db()
+    import time
+    now = time.time()
+    db.collection(JOBS_COLLECTION).document(job_id).update({
+        **fields,
+        'updated_at': now,
+        'heartbeat_at': now
+    })
+
+
+def claim_job(job_id: str, owner: str, lease_seconds: float) -> bool:
+    """
+    Atomically takes over an unfinished job so that it can be (re)run by `owner`.
+    
+    The job is claimed, and reset to QUEUED, unless another owner holds a
+    live lease on it (QUEUED/RUNNING with a heartbeat newer than
+    lease_seconds). The read and the write happen in one Firestore
+    transaction, so two workers racing to resume the same stale job can't
+    both win.
+    
+    Args:
+        job_id: The job document ID
+        owner: ID of the claiming worker process
+        lease_seconds: Age after which a heartbeat is considered dead
+        
+    Returns:
+        True if `owner` now holds the job, False if another worker does
+        (or the job is missing or already COMPLETE)
+    """
+    _ensure_db()
+    import time
+    doc_ref = db.collection(JOBS_COLLECTION).document(job_id)
+    
+    @firestore.transactional
+    def _claim(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return False
+        job = snapshot.to_dict()
+        now = time.time()
+        live = job.get('status') in ('QUEUED', 'RUNNING') and now - (job.get('heartbeat_at') or 0) <= lease_seconds
+        if job.get('status') == 'COMPLETE' or (live and job.get('owner') != owner):
+            return False
+        if not live:
+            transaction.update(doc_ref, {
+                'status': 'QUEUED',
+                'owner': owner,
+                'error_message': None,
+                'updated_at': now,
+                'heartbeat_at': now
+            })
+        return True
+    
+    claimed = _claim(db.transaction())
+    logger.info(f"Job {job_id} {'claimed' if claimed else 'is held by another worker'} (owner {owner})")
+    return claimed
+
+
+def heartbeat_job(job_id: str, owner: str) -> bool:
+    """
+    Refreshes a job's heartbeat if `owner` still holds it (see claim_job).
+    
+    Args:
+        job_id: The job document ID
+        owner: ID of the worker process running the job
+        
+    Returns:
+        False if the job was taken over by another owner (the caller should stop)
+    """
+    _ensure_db()
+    import time
+    doc_ref = db.collection(JOBS_COLLECTION).document(job_id)
+    
+    @firestore.transactional
+    def _beat(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        if not snapshot.exists or snapshot.to_dict().get('owner') != owner:
+            return False
+        transaction.update(doc_ref, {'heartbeat_at': time.time()})
+        return True
+    
+    return _beat(db.transaction())
+
+
+def save_job_checkpoint(job_id: str, stage: str, output: dict = None, gcs_uri: str = None) -> None:
+    """
+    Records a completed pipeline stage and its output.
+    
+    Each checkpoint is its own document (course_jobs/{job_id}/checkpoints/{stage})
+    so the job document stays small however large the course is. Outputs too
+    big for a Firestore document are stored in GCS and only referenced here.
+    A resumed job rebuilds its state from these checkpoints and skips every
+    stage listed in completed_stages.
+    
+    Args:
+        job_id: The job document ID
+        stage: Name of the completed stage (e.g., 'download')
+        output: JSON-serializable output of the stage (if stored inline)
+        gcs_uri: Location of the output in GCS (if stored there instead)
+    """
+    _ensure_db()
+    import time
+    from google.cloud.firestore_v1 import ArrayUnion
+    now = time.time()
+    job_ref = db.collection(JOBS_COLLECTION).document(job_id)
+    
+    batch = db.batch()
+    batch.set(job_ref.collection(CHECKPOINTS_SUBCOLLECTION).document(stage), {
+        'output': output if gcs_uri is None else None,
+        'gcs_uri': gcs_uri,
+        'saved_at': now
+    })
+    batch.update(job_ref, {
+        'completed_stages': ArrayUnion([stage]),
+        'updated_at': now,
+        'heartbeat_at': now
+    })
+    batch.commit()
+    logger.info(f"Saved checkpoint for job {job_id}: stage '{stage}'" + (f" ({gcs_uri})" if gcs_uri else ""))
+
+
+def get_job_checkpoints(job_id: str, stages: list[str]) -> dict:
+    """
+    Fetches the checkpoint documents of a job's completed stages.
+    
+    Args:
+        job_id: The job document ID
+        stages: Stage names to read
+        
+    Returns:
+        Dictionary of stage -> checkpoint ({'output': ..., 'gcs_uri': ...});
+        stages without a checkpoint document are omitted
+    """
+    _ensure_db()
+    if not stages:
+        return {}
+    checkpoints = db.collection(JOBS_COLLECTION).document(job_id).collection(CHECKPOINTS_SUBCOLLECTION)
+    return {doc.id: doc.to_dict() for doc in db.get_all([checkpoints.document(stage) for stage in stages]) if doc.exists}
+
+
+# ============================================================================
+# SUMMARY CACHE
+# ============================================================================
+
+def get_cached_summary(key: str) -> dict:
+    """
+    Fetches a cached file summary.
+    
+    Args:
+        key: Content-addressed cache key (see summary_cache_service.cache_key)
+        
+    Returns:
+        Dictionary with 'summary', 'content_hash', 'model_name', or empty dict on a miss
+    """
+    _ensure_db()
+    doc = db.collection(SUMMARY_CACHE_COLLECTION).document(key).get()
+    return doc.to_dict() if doc.exists else {}
+
+
+def save_cached_summary(key: str, entry: dict) -> None:
+    """
+    Stores a file summary in the shared cache.
+    
+    Args:
+        key: Content-addressed cache key
+        entry: Dictionary with 'summary', 'content_hash', 'model_name', 'created_at'
+    """
+    _ensure_db()
+    db.collection(SUMMARY_CACHE_COLLECTION).document(key).set(entry)
 
 
 
@@ -220,18 +768,58 @@ def log_analytics_event(data: dict) -> str:
     return doc_ref.id
 
 
-def get_analytics_events(course_id: str, event_type: str = None) -> list[dict]:
+def new_analytics_doc_id() -> str:
+    """
+    Allocates a document ID in the analytics collection without writing anything.
+    Lets callers hand out an event's ID (e.g., for rating) before the event is stored.
+    
+    Returns:
+        A fresh auto-generated document ID
+    """
+    _ensure_db()
+    return db.collection(ANALYTICS_COLLECTION).document().id
+
+
+def log_analytics_events_batch(events: list[tuple[str, dict]]) -> None:
+    """
+    Writes several analytics events in one batched commit.
+    
+    Each event is merged into its document, so fields written earlier
+    (e.g., a rating that arrived before the event was flushed) are kept.
+    
+    Args:
+        events: List of (doc_id, data) tuples; doc IDs come from new_analytics_doc_id()
+    """
+    _ensure_db()
+    
+    # Firestore batches are limited to 500 writes
+    for start in range(0, len(events), 500):
+        batch = db.batch()
+        for doc_id, data in events[start:start + 500]:
+            batch.set(db.collection(ANALYTICS_COLLECTION).document(doc_id), data, merge=True)
+        batch.commit()
+    
+    logger.info(f"Logged {len(events)} analytics events in a batch")
+
+
+def get_analytics_events(course_id: str, event_type: str = None, fields: list[str] = None,
+                         page_size: int = None, since=None) -> list[dict]:
     """
     Fetches analytics events for a course.
-    Generic query function - returns all event data for the analytics services to parse.
+    Generic query function - returns event data for the analytics services to parse.
     
     Args:
         course_id: The Canvas course ID
         event_type: Optional - filter by event type ('chat', 'kg_click', etc.)
                    If None, returns all events for the course
+        fields: Optional - only download these fields (a Firestore select()
+                projection). Pass [] to fetch document IDs only. If None,
+                returns the full documents.
+        page_size: Documents per page (defaults to ANALYTICS_PAGE_SIZE)
+        since: Optional - only events with a timestamp after this datetime
         
     Returns:
-        List of dictionaries containing full event data with doc_id
+        List of dictionaries containing event data with doc_id
         Example: [
             {
                 "doc_id": "xyz123",
@@ -244,37 +832,91 @@ def get_analytics_events(course_id: str, event_type: str = None) -> list[dict]:
             },
             ...
         ]
+        
+    Example:
+        vectors = get_analytics_events("12345", event_type='chat', fields=['query_vector'])
+        ids = [e['doc_id'] for e in get_analytics_events("12345", event_type='chat', fields=[])]
     """
-    _ensure_db()
+    results = list(iter_analytics_events(course_id, event_type, fields, page_size, since))
+    
+    logger.info(f"Retrieved {len(results)} analytics events for course {course_id}" + 
+                (f" (type: {event_type})" if event_type else "") +
+                (f" (since: {since})" if since is not None else "") +
+                (f" (fields: {fields})" if fields is not None else ""))
+    return results
 
+
+def iter_analytics_events(course_id: str, event_type: str = None, fields: list[str] = None,
+                          page_size: int = None, since=None):
+    """
+    Streams analytics events for a course one page at a time, resuming each
+    page from a cursor on the last document of the previous one. This keeps
+    individual Firestore queries short-lived on courses with many events.
     
-    query = db.collection(ANALYTICS_COLLECTION).where(filter=FieldFilter('course_id', '==', course_id))
+    Args:
+        course_id: The Canvas course ID
+        event_type: Optional - filter by event type
+        fields: Optional - select() projection (see get_analytics_events)
+        page_size: Documents per page (defaults to ANALYTICS_PAGE_SIZE)
+        since: Optional - only events with a timestamp after this datetime
+               (needs a composite index on course_id, type, timestamp)
+        
+    Yields:
+        Event dictionaries with doc_id
+    """
+    _ensure_db()
+    page_size = page_size or ANALYTICS_PAGE_SIZE
     
+    query = db.collection(ANALYTICS_COLLECTION).where(filter=FieldFilter('course_id', '==', course_id))
     if event_type:
         query = query.where(filter=FieldFilter('type', '==', event_type))
+    query = _project(query, fields)
+    if since is not None:
+        query = query.where(filter=FieldFilter('timestamp', '>', since)).order_by('timestamp')
+    query = query.order_by('__name__').limit(page_size)
     
-    # Fetch all matching documents
-    results = []
-    for doc in query.stream():
-        doc_data = doc.to_dict()
-        doc_data['doc_id'] = doc.id  # Include the document ID
-        results.append(doc_data)
+    last_doc = None
+    while True:
+        page = query.start_after(last_doc) if last_doc is not None else query
+        docs = list(page.stream())
+        for doc in docs:
+            doc_data = doc.to_dict() or {}
+            doc_data['doc_id'] = doc.id  # Include the document ID
+            yield doc_data
+        if len(docs) < page_size:
+            return
+        last_doc = docs[-1]
+
+
+def has_analytics_events_since(course_id: str, since, event_type: str = 'chat') -> bool:
+    """
+    Checks whether a course logged any analytics events after a timestamp,
+    reading at most one document ID.
     
-    logger.info(f"Retrieved {len(results)} analytics events for course {course_id}" + 
-                (f" (type: {event_type})" if event_type else ""))
-    return results
+    Args:
+        course_id: The Canvas course ID
+        since: Timestamp to compare against (e.g. a cluster state watermark)
+        event_type: Event type to look for (default: 'chat')
+        
+    Returns:
+        True if at least one matching event is newer than `since`
+    """
+    events = iter_analytics_events(course_id, event_type, fields=[], page_size=1, since=since)
+    return next(events, None) is not None
 
 
-def get_analytics_events_by_ids(doc_ids: list[str]) -> list[dict]:
+def get_analytics_events_by_ids(doc_ids: list[str], fields: list[str] = None) -> list[dict]:
     """
     Fetches analytics events by document IDs.
     Handles batching automatically (Firestore 'in' queries limited to 10 items).
     
     Args:
         doc_ids: List of Firestore document IDs
+        fields: Optional - only download these fields (see get_analytics_events)
         
     Returns:
-        List of dictionaries containing full event data with doc_id
+        List of dictionaries containing event data with doc_id, in the
+        same order as doc_ids
         
     Example:
         events = get_analytics_events_by_ids(['doc1', 'doc2', 'doc3'])
@@ -285,30 +927,39 @@ def get_analytics_events_by_ids(doc_ids: list[str]) -> list[dict]:
     if not doc_ids:
         return []
     # Firestore 'in' queries are limited to 10 items, so batch if needed
-    results = []
+    found = {}
     batch_size = 10
     
     for i in range(0, len(doc_ids), batch_size):
         batch = doc_ids[i:i + batch_size]
         
         # Query using document IDs with filter keyword argument
-        docs = db.collection(ANALYTICS_COLLECTION).where(
+        query = db.collection(ANALYTICS_COLLECTION).where(
             filter=FieldFilter(
                 '__name__', 
                 'in', 
                 [db.collection(ANALYTICS_COLLECTION).document(doc_id) for doc_id in batch]
             )
-        ).stream()
+        )
         
-        for doc in docs:
-            doc_data = doc.to_dict()
+        for doc in _project(query, fields).stream():
+            doc_data = doc.to_dict() or {}
             doc_data['doc_id'] = doc.id  # Include the document ID
-            results.append(doc_data)
+            found[doc.id] = doc_data
     
+    # 'in' queries return documents in key order; keep the caller's order
+    results = [found[doc_id] for doc_id in doc_ids if doc_id in found]
     logger.info(f"Retrieved {len(results)} analytics events from {len(doc_ids)} document IDs")
     return results
 
 
+def _project(query, fields: list[str] = None):
+    """Applies a select() projection; an empty field list keeps only document IDs."""
+    if fields is None:
+        return query
+    return query.select(list(fields) or ['__name__'])
+
+
 def save_analytics_report(course_id: str, report_data: dict) -> None:
     """
     Saves or updates the analytics report for a course.
@@ -348,6 +999,37 @@ def get_analytics_report(course_id: str) -> dict:
         return {}
 
 
+def get_cluster_state(course_id: str) -> dict:
+    """
+    Retrieves the persisted clustering state used by incremental analytics.
+    
+    Args:
+        course_id: The Canvas course ID
+        
+    Returns:
+        The state dictionary, or None if the course has never been clustered
+    """
+    _ensure_db()
+    
+    doc = db.collection(CLUSTER_STATE_COLLECTION).document(course_id).get()
+    return doc.to_dict() if doc.exists else None
+
+
+def save_cluster_state(course_id: str, state: dict) -> None:
+    """
+    Saves (overwrites) the clustering state of a course.
+    
+    Args:
+        course_id: The Canvas course ID
+        state: Centroids, counts, per-cluster labels and the event watermark
+    """
+    _ensure_db()
+    
+    db.collection(CLUSTER_STATE_COLLECTION).document(course_id).set(state)
+    
+    logger.info(f"Saved cluster state for course {course_id}")
+
+
 def rate_analytics_event(doc_id: str, rating: str = None) -> None:
     """
     Updates the rating field of an analytics event.
@@ -359,16 +1041,18 @@ def rate_analytics_event(doc_id: str, rating: str = None) -> None:
     """
     _ensure_db()
     
+    # set(merge=True) rather than update(): chat events are written by a
+    # background flusher, so the rating can arrive before the event exists
     if rating is None:
         # Remove the rating field
-        db.collection(ANALYTICS_COLLECTION).document(doc_id).update({
+        db.collection(ANALYTICS_COLLECTION).document(doc_id).set({
             'rating': firestore.DELETE_FIELD
-        })
+        }, merge=True)
         logger.info(f"Removed rating for analytics event {doc_id}")
     else:
-        db.collection(ANALYTICS_COLLECTION).document(doc_id).update({
+        db.collection(ANALYTICS_COLLECTION).document(doc_id).set({
             'rating': rating
-        })
+        }, merge=True)
         logger.info(f"Updated rating for analytics event {doc_id}: {rating}")
 
 if __name__ == "__main__":
@@ -409,6 +1093,7 @@ if __name__ == "__main__":
     course_data = get_course_data(test_course_id)
     print(f"\nFinal Course Document Data for {test_course_id}:")
     print(course_data.to_dict())
+    print(f"Knowledge graph: {get_course_graph(test_course_id, course_data)}")
     
     # ------------------------------------------------------------------
     # Cleanup: remove any analytics chat events with query_text == 'hello'
@@ -156,6 +156,79 @@ def upload_file(local_path: str, blob_path: str, bucket_name: str = BUCKET_NAME)
     return gcs_uri
 
 
+
+def upload_json(data, blob_path: str, bucket_name: str = BUCKET_NAME) -> str:
+    """
+    Uploads a JSON-serializable value to GCS.
+    
+    Args:
+        data: Value to serialize (dict, list, ...)
+        blob_path: Destination path in bucket (e.g., 'jobs/abc123/checkpoints/summarize.json')
+        bucket_name: GCS bucket name
+        
+    Returns:
+        GCS URI of the uploaded object
+    """
+    import json
+    
+    bucket = ensure_bucket_exists(bucket_name)
+    bucket.blob(blob_path).upload_from_string(json.dumps(data), content_type='application/json')
+    
+    gcs_uri = f"gs://{bucket_name}/{blob_path}"
+    logger.info(f"Uploaded JSON to {gcs_uri}")
+    return gcs_uri
+
+
+def download_json(gcs_uri: str):
+    """
+    Downloads and parses a JSON object written by upload_json.
+    
+    Args:
+        gcs_uri: GCS URI (e.g., 'gs://bucket/jobs/abc123/checkpoints/summarize.json')
+        
+    Returns:
+        The deserialized value
+        
+    Raises:
+        ValueError: If the GCS URI is invalid
+        Exception: If the object doesn't exist or the download fails
+    """
+    import json
+    
+    if not gcs_uri.startswith('gs://'):
+        raise ValueError(f"Invalid GCS URI: {gcs_uri}")
+    
+    bucket_name, blob_path = gcs_uri[5:].split('/', 1)
+    client = get_storage_client()
+    return json.loads(client.bucket(bucket_name).blob(blob_path).download_as_bytes())
+
+
+def download_file(gcs_uri: str, local_path: str) -> str:
+    """
+    Downloads a single GCS object to a local file.
+    
+    Args:
+        gcs_uri: GCS URI (e.g., 'gs://bucket/vector_index/3f2a/meta.json')
+        local_path: Destination file path (parent directories are created)
+        
+    Returns:
+        The local path
+        
+    Raises:
+        ValueError: If the GCS URI is invalid
+        Exception: If the object doesn't exist or the download fails
+    """
+    if not gcs_uri.startswith('gs://'):
+        raise ValueError(f"Invalid GCS URI: {gcs_uri}")
+    
+    bucket_name, blob_path = gcs_uri[5:].split('/', 1)
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    client = get_storage_client()
+    client.bucket(bucket_name).blob(blob_path).download_to_filename(local_path)
+    
+    logger.info(f"Downloaded {gcs_uri} to {local_path}")
+    return local_path
+
 def list_course_files(course_id: str, bucket_name: str = BUCKET_NAME) -> List[str]:
     """
     Lists all files for a specific course in GCS.
@@ -209,6 +282,33 @@ def delete_course_files(course_id: str, bucket_name: str = BUCKET_NAME) -> int:
     return delete_count
 
 
+def delete_file(gcs_uri: str) -> bool:
+    """
+    Deletes a single file from GCS.
+    
+    Args:
+        gcs_uri: GCS URI (e.g., 'gs://bucket/courses/12345/file.pdf')
+        
+    Returns:
+        True if the file was deleted, False if it didn't exist or deletion failed
+    """
+    if not gcs_uri.startswith('gs://'):
+        raise ValueError(f"Invalid GCS URI: {gcs_uri}")
+    
+    parts = gcs_uri[5:].split('/', 1)
+    bucket_name = parts[0]
+    blob_path = parts[1] if len(parts) > 1 else ''
+    
+    try:
+        client = get_storage_client()
+        client.bucket(bucket_name).blob(blob_path).delete()
+        logger.info(f"Deleted: {gcs_uri}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to delete {gcs_uri}: {str(e)}")
+        return False
+
+
 def get_file_info(gcs_uri: str) -> Optional[Dict]:
     """
     Gets metadata for a file in GCS.
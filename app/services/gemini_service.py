@@ -15,7 +15,10 @@ from google.generativeai import GenerativeModel
 import mimetypes
 import os
 import logging
-from typing import List, Tuple
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
 import vertexai
 import sys
 
@@ -24,7 +27,8 @@ root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__fil
 if root_dir not in sys.path:
     sys.path.insert(0, root_dir)
 
-from app.services.rag_service import retrieve_context
+from app.services.rag_service import retrieve_context, retrieve_chunks, sources_from_chunks
+from app.services import summary_cache_service
 
 logger = logging.getLogger(__name__)
 
@@ -33,12 +37,95 @@ project_id = os.environ.get('GOOGLE_CLOUD_PROJECT')
 location = os.environ.get('GOOGLE_CLOUD_LOCATION')
 DEFAULT_MODEL = os.environ.get('GEMINI_LLM_MODEL', 'gemini-2.5-flash-lite')
 
+# Batch summarization settings (see summarize_files)
+GEMINI_QPM = int(os.environ.get('GEMINI_QPM', '60'))  # Vertex requests-per-minute quota to stay under
+SUMMARIZE_WORKERS = int(os.environ.get('GEMINI_SUMMARIZE_WORKERS', '4'))  # Files in flight
+SUMMARIZE_MAX_RETRIES = 3
+
+# Batch embedding settings (see get_embeddings_batch)
+EMBED_BATCH_SIZE = int(os.environ.get('GEMINI_EMBED_BATCH_SIZE', '100'))  # Texts per request (API max is 250)
+EMBED_WORKERS = int(os.environ.get('GEMINI_EMBED_WORKERS', '4'))  # Requests in flight
+EMBED_MAX_RETRIES = 3
+
+# Context packing settings (see pack_context)
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '4000'))  # Max retrieved-context tokens per prompt
+CHARS_PER_TOKEN = 4  # Rough estimate for English text
+MIN_OVERLAP_WORDS = 8  # Shortest shared run of words treated as chunk overlap
+
+NO_CONTEXT_ANSWER = "I don't have enough information in the course materials to answer this question."
+
 if project_id:
     vertexai.init(project=project_id, location=location)
     logger.info(f"Vertex AI initialized for Gemini: project={project_id}, location={location}")
 else:
     logger.warning("GOOGLE_CLOUD_PROJECT not set - Gemini service not initialized")
 
+# Process-wide model instances, keyed by (kind, model name, config)
+_model_registry = {}
+_model_registry_lock = threading.Lock()
+
+
+# ============================================================================
+# MODEL REGISTRY
+# ============================================================================
+
+def get_generative_model(model_name: str = DEFAULT_MODEL, **config) -> GenerativeModel:
+    """
+    Returns the shared GenerativeModel for a model name and config, creating it on first use.
+    
+    Reusing one instance per (model, config) avoids rebuilding the client on
+    every request and keeps its connections warm. Instances are safe to share
+    between gunicorn threads.
+    
+    Args:
+        model_name: Gemini model to use (default: gemini-2.5-flash-lite)
+        **config: Extra GenerativeModel constructor arguments (e.g. generation_config)
+        
+    Returns:
+        The shared GenerativeModel instance
+        
+    Example:
+        model = get_generative_model("gemini-2.5-flash-lite")
+        response = model.generate_content("Hello")
+    """
+    return _get_or_create(
+        ('generative', model_name, repr(sorted(config.items()))),
+        lambda: GenerativeModel(model_name, **config)
+    )
+
+
+def get_embedding_model(model_name: str = "text-embedding-004"):
+    """
+    Returns the shared TextEmbeddingModel for a model name, loading it on first use.
+    
+    Args:
+        model_name: The embedding model to use (default: text-embedding-004)
+        
+    Returns:
+        The shared TextEmbeddingModel instance
+    """
+    from vertexai.language_models import TextEmbeddingModel
+    return _get_or_create(('embedding', model_name), lambda: TextEmbeddingModel.from_pretrained(model_name))
+
+
+def clear_model_registry() -> None:
+    """Drops every cached model instance (used by tests and after re-initializing Vertex AI)."""
+    with _model_registry_lock:
+        _model_registry.clear()
+
+
+def _get_or_create(key: tuple, factory: Callable):
+    model = _model_registry.get(key)
+    if model is not None:
+        return model
+    with _model_registry_lock:
+        model = _model_registry.get(key)
+        if model is None:
+            logger.info(f"Creating {key[0]} model instance: {key[1]}")
+            model = factory()
+            _model_registry[key] = model
+        return model
+
 
 def get_embedding(text: str, model_name: str = "text-embedding-004", task_type: str = "RETRIEVAL_QUERY") -> list:
     """
@@ -62,12 +149,12 @@ def get_embedding(text: str, model_name: str = "text-embedding-004", task_type:
         # Returns: [0.123, -0.456, 0.789, ...] (768 dimensions)
     """
     try:
-        from vertexai.language_models import TextEmbeddingModel, TextEmbeddingInput
+        from vertexai.language_models import TextEmbeddingInput
         
         logger.info(f"Generating embedding for text: {text[:50]}... (task_type: {task_type})")
         
-        # Initialize the embedding model
-        model = TextEmbeddingModel.from_pretrained(model_name)
+        # Shared embedding model (loaded once per process)
+        model = get_embedding_model(model_name)
         
         # Create embedding input with task type
         embedding_input = TextEmbeddingInput(
@@ -88,6 +175,91 @@ def get_embedding(text: str, model_name: str = "text-embedding-004", task_type:
         logger.error(f"Failed to generate embedding: {e}", exc_info=True)
         raise
 
+
+def get_embeddings(texts: List[str], model_name: str = "text-embedding-004", task_type: str = "RETRIEVAL_QUERY") -> List[list]:
+    """
+    Generates embedding vectors for several texts in a single model request.
+
+    Args:
+        texts: The texts to embed (keep batches small; the API caps inputs per request)
+        model_name: The embedding model to use (default: text-embedding-004)
+        task_type: The task type for the embeddings (see get_embedding)
+
+    Returns:
+        List of vectors, in the same order as texts
+
+    Example:
+        vectors = get_embeddings(["What is ML?", "What is a neural net?"])
+    """
+    if not texts:
+        return []
+
+    try:
+        from vertexai.language_models import TextEmbeddingInput
+
+        logger.info(f"Generating {len(texts)} embeddings (task_type: {task_type})")
+
+        model = get_embedding_model(model_name)
+        inputs = [TextEmbeddingInput(text=text, task_type=task_type) for text in texts]
+        embeddings = model.get_embeddings(inputs)
+
+        return [embedding.values for embedding in embeddings]
+
+    except Exception as e:
+        logger.error(f"Failed to generate embeddings: {e}", exc_info=True)
+        raise
+
+
+def get_embeddings_batch(texts: List[str], task_type: str = "RETRIEVAL_QUERY", model_name: str = "text-embedding-004",
+                         batch_size: int = None, max_workers: int = None) -> List[Optional[list]]:
+    """
+    Embeds any number of texts using as few requests as possible.
+    
+    The texts are split into chunks of batch_size (GEMINI_EMBED_BATCH_SIZE),
+    and up to max_workers chunks (GEMINI_EMBED_WORKERS) are embedded
+    concurrently with get_embeddings. A failed chunk is retried with
+    exponential backoff; if it still fails, its texts get None instead of
+    failing the whole call.
+    
+    Args:
+        texts: The texts to embed
+        task_type: The task type for the embeddings (see get_embedding)
+        model_name: The embedding model to use (default: text-embedding-004)
+        batch_size: Texts per request (default: GEMINI_EMBED_BATCH_SIZE)
+        max_workers: Concurrent requests (default: GEMINI_EMBED_WORKERS)
+        
+    Returns:
+        List of vectors (or None for texts that could not be embedded), in the same order as texts
+        
+    Example:
+        vectors = get_embeddings_batch([e['query_text'] for e in events])
+        # 10,000 texts -> 100 requests, 4 at a time
+    """
+    if not texts:
+        return []
+    
+    batch_size = batch_size or EMBED_BATCH_SIZE
+    chunks = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    
+    def embed_chunk(chunk: List[str]) -> List[Optional[list]]:
+        for attempt in range(EMBED_MAX_RETRIES):
+            try:
+                return get_embeddings(chunk, model_name=model_name, task_type=task_type)
+            except Exception as e:
+                if attempt == EMBED_MAX_RETRIES - 1:
+                    logger.error(f"Giving up on a chunk of {len(chunk)} embeddings after {EMBED_MAX_RETRIES} attempts: {e}")
+                    return [None] * len(chunk)
+                logger.warning(f"Embedding chunk failed (attempt {attempt + 1}), retrying: {e}")
+                time.sleep(2 ** attempt)
+    
+    logger.info(f"Embedding {len(texts)} texts in {len(chunks)} request(s)")
+    if len(chunks) == 1:
+        return embed_chunk(chunks[0])
+    
+    with ThreadPoolExecutor(max_workers=max_workers or EMBED_WORKERS) as executor:
+        results = list(executor.map(embed_chunk, chunks))
+    return [vector for chunk_vectors in results for vector in chunk_vectors]
+
 SUMMARIZE_PROMPT = """
     Summarize this file in one paragraph, specifically the topics that are covered, both broad and specific.
     Someone reading the summary should understand what subjects are discussed in the file and what the learning objectives likely are. Don't get too detailed.
@@ -125,7 +297,7 @@ def summarize_file(file_path: str, prompt: str = SUMMARIZE_PROMPT, model_name: s
     }
 
     try:
-        model = GenerativeModel(model_name)
+        model = get_generative_model(model_name)
 
         response = model.generate_content(
             [file_part, prompt]
@@ -138,6 +310,125 @@ def summarize_file(file_path: str, prompt: str = SUMMARIZE_PROMPT, model_name: s
         raise
 
 
+def summarize_files(file_paths: List[str], prompt: str = SUMMARIZE_PROMPT, model_name: str = DEFAULT_MODEL,
+                    max_workers: int = None,
+                    progress_callback: Callable[[str, int, int], None] = None) -> List[Optional[str]]:
+    """
+    Summarizes many local files concurrently while staying under the Gemini QPM quota.
+
+    Files whose content was already summarized with the same prompt and
+    model are served from summary_cache_service without calling Gemini.
+    The rest run up to max_workers at once, and every request first takes
+    a token from a shared token bucket refilled at GEMINI_QPM per minute.
+    A failed file is retried with exponential backoff; if it still fails its
+    summary is None and the rest of the batch carries on.
+
+    Args:
+        file_paths: Local file paths to summarize
+        prompt: Instruction to send
+        model_name: Gemini model to use
+        max_workers: Files in flight (default: GEMINI_SUMMARIZE_WORKERS env, 4)
+        progress_callback: Optional callable(file_path, completed_count, total_count)
+
+    Returns:
+        Summaries in the same order as file_paths (None for files that failed)
+
+    Example:
+        summaries = summarize_files(["/tmp/a.pdf", "/tmp/b.pdf"])
+        # ["This file discusses...", None]
+    """
+    if not file_paths:
+        return []
+
+    total = len(file_paths)
+    completed = 0
+    completed_lock = threading.Lock()
+    limiter = _get_rate_limiter()
+
+    def summarize_one(file_path: str) -> Optional[str]:
+        nonlocal completed
+        summary, key, file_hash = None, None, None
+        try:
+            file_hash = summary_cache_service.content_hash(file_path)
+            key = summary_cache_service.cache_key(file_hash, prompt, model_name)
+            summary = summary_cache_service.get_summary(key)
+        except OSError as e:
+            logger.warning(f"Could not hash {file_path} for the summary cache: {e}")
+
+        if summary is not None:
+            logger.info(f"Summary cache hit for {file_path}")
+        else:
+            for attempt in range(SUMMARIZE_MAX_RETRIES + 1):
+                limiter.acquire()
+                try:
+                    summary = summarize_file(file_path, prompt=prompt, model_name=model_name)
+                    break
+                except Exception as e:
+                    if attempt == SUMMARIZE_MAX_RETRIES:
+                        logger.error(f"Giving up on {file_path} after {attempt + 1} attempts: {e}")
+                    else:
+                        delay = 2 ** attempt
+                        logger.warning(f"Retrying {file_path} in {delay}s (attempt {attempt + 1}): {e}")
+                        time.sleep(delay)
+            if summary is not None and key:
+                summary_cache_service.put_summary(key, summary, file_hash, model_name)
+
+        with completed_lock:
+            completed += 1
+            done = completed
+        if progress_callback:
+            progress_callback(file_path, done, total)
+        return summary
+
+    workers = max(1, min(max_workers or SUMMARIZE_WORKERS, total))
+    logger.info(f"Summarizing {total} files with {workers} workers (limit {GEMINI_QPM} QPM)")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # map() yields results in input order regardless of completion order
+        summaries = list(executor.map(summarize_one, file_paths))
+
+    logger.info(f"Summarized {sum(s is not None for s in summaries)}/{total} files")
+    return summaries
+
+
+class _TokenBucket:
+    """
+    Thread-safe token bucket: holds up to `capacity` tokens and refills at
+    `rate_per_minute`. acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate_per_minute: int, capacity: int = None):
+        self.rate = max(rate_per_minute, 1) / 60.0
+        self.capacity = capacity or max(1, min(rate_per_minute, SUMMARIZE_WORKERS))
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def _get_rate_limiter() -> _TokenBucket:
+    """Returns the process-wide Gemini rate limiter (created on first use)."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = _TokenBucket(GEMINI_QPM)
+        return _rate_limiter
+
+
 def generate_answer(query: str, model_name: str = DEFAULT_MODEL) -> str:
     """
     Generates a direct answer to a query using Gemini (no RAG context).
@@ -161,7 +452,7 @@ def generate_answer(query: str, model_name: str = DEFAULT_MODEL) -> str:
     try:
         logger.info(f"Generating direct answer for: {query[:100]}...")
         
-        model = GenerativeModel(model_name)
+        model = get_generative_model(model_name)
         response = model.generate_content(query)
         
         answer_text = response.text
@@ -178,7 +469,8 @@ def generate_answer_with_context(
     corpus_id: str,
     top_k: int = 10,
     threshold: float = 0.4,
-    model_name: str = DEFAULT_MODEL
+    model_name: str = DEFAULT_MODEL,
+    corpus_version: int = None
 ) -> Tuple[str, List[str]]:
     """
     Generates an answer using context retrieved from RAG corpus.
@@ -195,6 +487,7 @@ def generate_answer_with_context(
         top_k: Number of context chunks to retrieve (default: 10)
         threshold: Similarity threshold for retrieval (default: 0.5)
         model_name: Gemini model to use (default: gemini-2.5-flash-lite)
+        corpus_version: The course's corpus_version; lets retrieval use its cache
         
     Returns:
         Tuple of (answer_text, list of source names)
@@ -217,18 +510,156 @@ def generate_answer_with_context(
         logger.info(f"Generating RAG-enhanced answer for: {query[:100]}...")
         
         # Step 1: Retrieve context from RAG corpus
-        context_texts, source_names = retrieve_context(corpus_id, query, top_k, threshold)
+        chunks = retrieve_chunks(corpus_id, query, top_k, threshold, corpus_version=corpus_version)
 
-        if not context_texts:
+        if not chunks:
             logger.warning("No context retrieved from RAG corpus")
-            return ("I don't have enough information in the course materials to answer this question.", [])
+            return (NO_CONTEXT_ANSWER, [])
+        
+        # Step 2: Pack the chunks into the token budget and construct the prompt
+        context_texts, source_names, _ = pack_context(chunks)
+        prompt = _build_answer_prompt(query, context_texts)
+        logger.info(f"Answer prompt is ~{estimate_tokens(prompt)} tokens")
+
+        # Step 3: Generate answer with Gemini
+        model = get_generative_model(model_name)
+        response = model.generate_content(prompt)
+        answer_text = response.text
         
-        logger.info(f"Retrieved {len(context_texts)} context chunks from {len(source_names)} sources")
+        logger.info(f"Generated answer with {len(source_names)} citations")
         
-        # Step 2: Construct prompt with context
-        combined_context = "\n\n".join(context_texts)
+        return (answer_text, source_names)
         
-        prompt = f"""You are a helpful teaching assistant for a course. Answer the student's in a helpful manner and use the sources provided when relevant.
+    except Exception as e:
+        logger.error(f"Failed to generate RAG-enhanced answer: {str(e)}")
+        raise
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for prompt sizing (about 4 characters per token; no API call)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def pack_context(chunks: List[dict], token_budget: int = None) -> Tuple[List[str], List[dict], dict]:
+    """
+    Turns retrieved chunks into the context passages for an answer prompt.
+    
+    Chunks from the same file that repeat or overlap each other (the corpus
+    is chunked with overlap) are merged into one passage, so no text is sent
+    twice. Passages are then added closest-first until token_budget is
+    reached, which bounds prompt size (and generation latency) no matter
+    how many chunks were retrieved.
+    
+    Args:
+        chunks: Chunks from rag_service.retrieve_chunks ('text', 'source_uri', 'distance')
+        token_budget: Max estimated tokens of context (default: CONTEXT_TOKEN_BUDGET)
+        
+    Returns:
+        Tuple of (context_texts, sources, stats):
+        - context_texts: Passage texts, closest first
+        - sources: One source dict per file that made it into the context
+        - stats: Counts for logging ('chunks', 'passages', 'merged', 'dropped', 'context_tokens')
+        
+    Example:
+        texts, sources, stats = pack_context(retrieve_chunks(corpus_id, query, top_k=20))
+        # stats = {'chunks': 20, 'passages': 7, 'merged': 9, 'dropped': 4, 'context_tokens': 3980}
+    """
+    budget = token_budget or CONTEXT_TOKEN_BUDGET
+    
+    passages = []
+    merged = 0
+    for chunk in sorted(chunks, key=lambda c: c['distance']):
+        words = chunk['text'].split()
+        if not words:
+            continue
+        passage = {'text': chunk['text'], 'words': words, 'source_uri': chunk['source_uri'], 'distance': chunk['distance']}
+        
+        # Fold the chunk (and anything it now bridges) into passages from the same file
+        for other in list(passages):
+            if other['source_uri'] != passage['source_uri']:
+                continue
+            combined = _merge_overlapping(other['words'], passage['words'])
+            if combined is None:
+                continue
+            if combined is not other['words']:
+                other['text'] = ' '.join(combined)
+                other['words'] = combined
+            passages.remove(other)
+            other['distance'] = min(other['distance'], passage['distance'])
+            passage = other
+            merged += 1
+        passages.append(passage)
+    
+    passages.sort(key=lambda p: p['distance'])
+    packed = []
+    used = 0
+    for passage in passages:
+        tokens = estimate_tokens(passage['text'])
+        if used + tokens <= budget:
+            packed.append(passage)
+            used += tokens
+        elif not packed:
+            # Always send something: truncate the closest passage to the budget
+            packed.append({**passage, 'text': passage['text'][:budget * CHARS_PER_TOKEN]})
+            used = budget
+    
+    stats = {
+        'chunks': len(chunks),
+        'passages': len(packed),
+        'merged': merged,
+        'dropped': len(passages) - len(packed),
+        'context_tokens': used
+    }
+    logger.info(
+        f"Packed {stats['chunks']} chunks into {stats['passages']} passages "
+        f"(~{used}/{budget} tokens, {merged} merged, {stats['dropped']} over budget)"
+    )
+    return [p['text'] for p in packed], sources_from_chunks(packed), stats
+
+
+def _merge_overlapping(a: List[str], b: List[str]) -> Optional[List[str]]:
+    """
+    Merges two word lists from the same file if one contains the other or
+    they overlap end-to-start by at least MIN_OVERLAP_WORDS words.
+    
+    Returns:
+        The merged word list (`a` itself if it already covers `b`), or None if they don't overlap
+    """
+    if len(b) <= len(a) and _contains(a, b):
+        return a
+    if len(a) < len(b) and _contains(b, a):
+        return b
+    overlap = _overlap(a, b)
+    if overlap:
+        return a + b[overlap:]
+    overlap = _overlap(b, a)
+    if overlap:
+        return b + a[overlap:]
+    return None
+
+
+def _contains(haystack: List[str], needle: List[str]) -> bool:
+    first = needle[0]
+    for i in range(len(haystack) - len(needle) + 1):
+        if haystack[i] == first and haystack[i:i + len(needle)] == needle:
+            return True
+    return False
+
+
+def _overlap(a: List[str], b: List[str]) -> int:
+    """Length of the longest suffix of a that is a prefix of b (0 if shorter than MIN_OVERLAP_WORDS)."""
+    first = b[0]
+    for i in range(max(0, len(a) - len(b)), len(a) - MIN_OVERLAP_WORDS + 1):
+        if a[i] == first and a[i:] == b[:len(a) - i]:
+            return len(a) - i
+    return 0
+
+
+def _build_answer_prompt(query: str, context_texts: List[str]) -> str:
+    """Builds the teaching-assistant prompt around retrieved context chunks."""
+    combined_context = "\n\n".join(context_texts)
+    
+    prompt = f"""You are a helpful teaching assistant for a course. Answer the student's in a helpful manner and use the sources provided when relevant.
 
 Course Materials Context:
 {combined_context}
@@ -243,19 +674,68 @@ Instructions:
 5. Use a friendly, professional teaching tone
 
 Answer:"""
+    return prompt
 
-        # Step 3: Generate answer with Gemini
-        model = GenerativeModel(model_name)
-        response = model.generate_content(prompt)
-        answer_text = response.text
-        
-        logger.info(f"Generated answer with {len(source_names)} citations")
+
+def stream_answer_with_context(
+    query: str,
+    corpus_id: str,
+    top_k: int = 10,
+    threshold: float = 0.4,
+    model_name: str = DEFAULT_MODEL,
+    corpus_version: int = None
+) -> Tuple[List[dict], Iterator[str]]:
+    """
+    Streaming variant of generate_answer_with_context.
+    
+    Retrieval runs immediately so sources are known before generation starts;
+    the answer is then produced lazily with generate_content(stream=True), so
+    callers can forward text to the client as soon as Gemini emits it.
+    
+    Args:
+        query: The user's question
+        corpus_id: RAG corpus resource name to retrieve context from
+        top_k: Number of context chunks to retrieve (default: 10)
+        threshold: Similarity threshold for retrieval (default: 0.4)
+        model_name: Gemini model to use (default: gemini-2.5-flash-lite)
+        corpus_version: The course's corpus_version; lets retrieval use its cache
         
-        return (answer_text, source_names)
+    Returns:
+        Tuple of (sources, text_chunks):
+        - sources: Source dicts from retrieval (filename, source_uri, distance)
+        - text_chunks: Iterator yielding answer text pieces in order
         
-    except Exception as e:
-        logger.error(f"Failed to generate RAG-enhanced answer: {str(e)}")
-        raise
+    Example:
+        sources, chunks = stream_answer_with_context("What is recursion?", corpus_id)
+        for text in chunks:
+            print(text, end="")
+    """
+    if not project_id:
+        raise ValueError("GOOGLE_CLOUD_PROJECT environment variable not set")
+    
+    logger.info(f"Streaming RAG-enhanced answer for: {query[:100]}...")
+    chunks = retrieve_chunks(corpus_id, query, top_k, threshold, corpus_version=corpus_version)
+    
+    if not chunks:
+        logger.warning("No context retrieved from RAG corpus")
+        return [], iter([NO_CONTEXT_ANSWER])
+    
+    context_texts, source_names, _ = pack_context(chunks)
+    prompt = _build_answer_prompt(query, context_texts)
+    logger.info(f"Answer prompt is ~{estimate_tokens(prompt)} tokens")
+    
+    def text_chunks() -> Iterator[str]:
+        model = get_generative_model(model_name)
+        for chunk in model.generate_content(prompt, stream=True):
+            # Chunks without text (e.g., safety or finish metadata) are skipped
+            try:
+                text = chunk.text
+            except ValueError:
+                continue
+            if text:
+                yield text
+    
+    return source_names, text_chunks()
 
 
 def generate_suggested_questions(topic: str, count: int = 3, model_name: str = DEFAULT_MODEL) -> List[str]:
@@ -283,7 +763,7 @@ def generate_suggested_questions(topic: str, count: int = 3, model_name: str = D
     try:
         logger.info(f"Generating {count} suggested questions for topic: {topic}")
         
-        model = GenerativeModel(model_name)
+        model = get_generative_model(model_name)
         
         prompt = f"""Generate {count} thoughtful follow-up questions that a student might have about the topic: "{topic}"
 
@@ -348,7 +828,7 @@ if __name__ == "__main__":
     
     try:
         # Import firestore service to get course data
-        from app.services.firestore_service import get_course_data
+        from app.services.firestore_service import get_course_data, get_course_graph
         
         # Get course data for 13299557
         course_id = "13299557"
@@ -363,8 +843,9 @@ if __name__ == "__main__":
         
         course_data = course_doc.to_dict()
         corpus_id = course_data.get('corpus_id')
-        kg_nodes = json.loads(course_data.get('kg_nodes', '[]'))
-        kg_data = json.loads(course_data.get('kg_data', '{}'))
+        graph = get_course_graph(course_id, course_doc=course_doc)
+        kg_nodes = json.loads(graph.get('kg_nodes') or '[]')
+        kg_data = json.loads(graph.get('kg_data') or '{}')
         
         print(f"\n📚 Course Info:")
         print(f"   Corpus ID: {corpus_id}")
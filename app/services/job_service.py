@@ -0,0 +1,732 @@
+"""
+Job Service
+Runs course pipelines as resumable background jobs.
+
+This service is responsible for:
+- Enqueuing jobs and returning a job ID immediately
+- Running each pipeline stage on a background worker pool
+- Checkpointing every completed stage to Firestore (large outputs in GCS)
+- Resuming crashed or timed-out jobs from the last completed stage
+- Holding a lease on each running job so only one worker runs it
+
+Job types and their stages (in order):
+    initialize_course: download -> upload -> import -> summarize -> extract_topics -> build_kg -> finalize
+    sync_course:       diff -> download -> upload -> remove -> import -> update_kg -> finalize
+
+Dependencies:
+- firestore_service: For job documents, checkpoints and course finalization
+- canvas_service, gcs_service, rag_service, local_index_service, gemini_service, kg_service: Stage work
+"""
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from . import firestore_service, canvas_service, gcs_service, rag_service, gemini_service, kg_service, local_index_service
+
+logger = logging.getLogger(__name__)
+
+CANVAS_TOKEN = os.environ.get('CANVAS_API_TOKEN')
+
+INITIALIZE_JOB = 'initialize_course'
+SYNC_JOB = 'sync_course'
+STAGES = ['download', 'upload', 'import', 'summarize', 'extract_topics', 'build_kg', 'finalize']
+SYNC_STAGES = ['diff', 'download', 'upload', 'remove', 'import', 'update_kg', 'finalize']
+
+# Number of jobs that can run concurrently in this process
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+# A RUNNING job whose heartbeat is older than this is considered dead and may be resumed
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '900'))
+# How often a running job refreshes its heartbeat (well inside the lease)
+JOB_HEARTBEAT_SECONDS = int(os.environ.get('JOB_HEARTBEAT_SECONDS', '60'))
+# Stage outputs larger than this (JSON bytes) are checkpointed to GCS instead of Firestore
+CHECKPOINT_INLINE_BYTES = int(os.environ.get('JOB_CHECKPOINT_INLINE_BYTES', str(256 * 1024)))
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='course-job')
+_active_jobs = set()
+_active_lock = threading.Lock()
+_owner = None
+
+
+class JobError(Exception):
+    """Raised by a stage when the job cannot continue (e.g., no course files)."""
+
+
+class LeaseLostError(JobError):
+    """Raised when another worker has taken over the job this worker was running."""
+
+
+# ============================================================================
+# PUBLIC API
+# ============================================================================
+
+def submit_initialize_job(course_id: str, topics: str = None) -> str:
+    """
+    Enqueues the initialization pipeline for a course and returns immediately.
+
+    If the course already has an unfinished job, that job is reused:
+    - QUEUED/RUNNING with a fresh heartbeat: its ID is returned as-is
+    - ERROR, or RUNNING with a stale heartbeat: it is resumed from its last checkpoint
+      (claimed in a Firestore transaction, so only one worker resumes it)
+
+    Args:
+        course_id: The Canvas course ID
+        topics: Optional comma-separated topic list (auto-extracted if empty)
+
+    Returns:
+        The job ID
+
+    Example:
+        job_id = submit_initialize_job("12345")
+        # Poll get_job_status(job_id) until status == 'COMPLETE'
+    """
+    return _submit_job(course_id, INITIALIZE_JOB, {'topics': topics})
+
+
+def submit_sync_job(course_id: str) -> str:
+    """
+    Enqueues an incremental re-sync of an ACTIVE course and returns immediately.
+
+    The current Canvas listing is diffed against the course's stored
+    indexed_files hashes; only added or changed files are downloaded,
+    uploaded and imported, removed files are deleted from GCS and the RAG
+    corpus, and the knowledge graph's file nodes are patched in place.
+    The course stays ACTIVE while the sync runs.
+
+    Args:
+        course_id: The Canvas course ID
+
+    Returns:
+        The job ID
+    """
+    return _submit_job(course_id, SYNC_JOB, {})
+
+
+def get_job_status(job_id: str) -> dict:
+    """
+    Returns a lightweight view of a job for status polling.
+    Stage checkpoints are omitted except for the final result.
+
+    Args:
+        job_id: The job ID
+
+    Returns:
+        Dictionary with job status, or empty dict if the job doesn't exist
+        Example: {
+            "job_id": "abc123",
+            "course_id": "12345",
+            "status": "RUNNING",
+            "current_stage": "summarize",
+            "completed_stages": ["download", "upload", "import"],
+            "stages": [...],
+            "error_message": None,
+            "result": None
+        }
+    """
+    job = firestore_service.get_job(job_id)
+    if not job:
+        return {}
+
+    job_type = job.get('type', INITIALIZE_JOB)
+    result = None
+    if job.get('status') == 'COMPLETE':
+        # Older jobs kept every checkpoint on the job document
+        result = job.get('result') or job.get('checkpoints', {}).get('finalize')
+
+    return {
+        'job_id': job_id,
+        'course_id': job.get('course_id'),
+        'type': job_type,
+        'status': job.get('status'),
+        'current_stage': job.get('current_stage'),
+        'completed_stages': job.get('completed_stages', []),
+        'stages': _PIPELINES[job_type]['stages'],
+        'error_message': job.get('error_message'),
+        'result': result
+    }
+
+
+def run_job(job_id: str) -> None:
+    """
+    Runs (or resumes) a job synchronously in the calling thread.
+    Stages already listed in the job's completed_stages are skipped and
+    their checkpointed output is used as input for the remaining stages.
+
+    While the job runs, a background thread refreshes its heartbeat every
+    JOB_HEARTBEAT_SECONDS, so long stages don't let the lease expire. If
+    another worker has taken the job over, it stops at the next stage.
+
+    Args:
+        job_id: The job ID
+    """
+    job = firestore_service.get_job(job_id)
+    if not job:
+        logger.error(f"Job {job_id} not found")
+        return
+
+    course_id = job['course_id']
+    job_type = job.get('type', INITIALIZE_JOB)
+    stages = _PIPELINES[job_type]['stages']
+    stage_functions = _PIPELINES[job_type]['functions']
+    completed = set(job.get('completed_stages', []))
+
+    firestore_service.update_job(job_id, {
+        'status': 'RUNNING',
+        'attempts': job.get('attempts', 0) + 1
+    })
+    stop_heartbeat, lease_lost = _start_heartbeat(job_id)
+
+    try:
+        # Rebuild pipeline state from checkpoints (in stage order)
+        ctx = {'course_id': course_id, 'params': job.get('params', {})}
+        checkpoints, offloaded = _load_checkpoints(job_id, job, [s for s in stages if s in completed])
+        for stage in stages:
+            if stage in checkpoints:
+                _merge_output(ctx, checkpoints[stage])
+
+        output = {}
+        for stage in stages:
+            if stage in completed:
+                logger.info(f"Job {job_id}: skipping completed stage '{stage}'")
+                continue
+            if lease_lost.is_set():
+                raise LeaseLostError(f"Job {job_id} was taken over by another worker")
+
+            logger.info(f"Job {job_id}: running stage '{stage}' for course {course_id}")
+            firestore_service.update_job(job_id, {'current_stage': stage})
+            _log_progress(course_id, f"Running stage: {stage}")
+
+            started = time.time()
+            output = stage_functions[stage](ctx)
+            _merge_output(ctx, output)
+
+            gcs_uri = _save_checkpoint(job_id, stage, output)
+            if gcs_uri:
+                offloaded.append(gcs_uri)
+            logger.info(f"Job {job_id}: stage '{stage}' finished in {time.time() - started:.1f}s")
+
+        firestore_service.update_job(job_id, {'status': 'COMPLETE', 'current_stage': None, 'result': output})
+        logger.info(f"Job {job_id}: {job_type} complete for course {course_id}")
+
+        # Large checkpoints are only needed to resume an unfinished job
+        for gcs_uri in offloaded:
+            gcs_service.delete_file(gcs_uri)
+
+    except LeaseLostError as e:
+        # The new owner records the job's outcome
+        logger.warning(str(e))
+
+    except Exception as e:
+        logger.error(f"Job {job_id} failed for course {course_id}: {e}", exc_info=True)
+        try:
+            firestore_service.update_job(job_id, {'status': 'ERROR', 'error_message': str(e)})
+            # A failed sync leaves the previously ACTIVE course untouched
+            if job_type == INITIALIZE_JOB:
+                firestore_service.set_course_error(course_id, str(e))
+        except Exception as update_error:
+            logger.error(f"Failed to record error for job {job_id}: {update_error}")
+
+    finally:
+        stop_heartbeat.set()
+
+
+# ============================================================================
+# PIPELINE STAGES
+# Each stage takes the pipeline context and returns a JSON-serializable dict
+# of the context values it adds (not the whole context), which is also
+# stored as the stage's checkpoint (see _merge_output).
+# ============================================================================
+
+def _stage_download(ctx: dict) -> dict:
+    """Fetches the Canvas file listing and downloads every file locally."""
+    course_id = ctx['course_id']
+
+    def _report(file, completed, total):
+        if completed % 10 == 0 or completed == total:
+            _log_progress(course_id, f"Downloaded {completed}/{total} files")
+
+    files, indexed_files = canvas_service.get_course_files(
+        course_id=course_id,
+        token=CANVAS_TOKEN,
+        download=True,
+        progress_callback=_report
+    )
+
+    if not files:
+        raise JobError("No course files found")
+    if not any(f.get('local_path') for f in files):
+        raise JobError(f"None of the {len(files)} course files could be downloaded")
+
+    logger.info(f"Retrieved {len(files)} files from Canvas")
+    return {'files': files, 'indexed_files': indexed_files}
+
+
+def _stage_upload(ctx: dict) -> dict:
+    """Uploads downloaded files to GCS and records their URIs."""
+    _ensure_local_files(ctx)
+    files = gcs_service.upload_course_files(ctx['files'], ctx['course_id'])
+
+    # Only the new locations are checkpointed; _merge_output applies them to files/indexed_files
+    uploaded = {
+        str(file.get('id')): {'gcs_uri': file.get('gcs_uri'), 'display_name': file.get('display_name')}
+        for file in files if file.get('gcs_uri')
+    }
+    logger.info(f"Uploaded {len(uploaded)}/{len(files)} files to GCS")
+    if files and not uploaded:
+        raise JobError(f"None of the {len(files)} files could be uploaded to GCS")
+    return {'uploaded': uploaded, 'uploaded_count': len(uploaded)}
+
+
+def _stage_import(ctx: dict) -> dict:
+    """Creates the RAG corpus and imports the uploaded files."""
+    if rag_service.RETRIEVAL_BACKEND == 'local':
+        # The local index reads file contents from disk, not from GCS
+        _ensure_local_files(ctx)
+    corpus_id = rag_service.create_and_provision_corpus(
+        files=ctx['files'],
+        corpus_name_suffix=f"Course {ctx['course_id']}"
+    )
+    logger.info(f"Created corpus: {corpus_id}")
+    imported = rag_service.count_imported_files(corpus_id, ctx['files'])
+    _check_imported(ctx['files'], imported)
+    return {'corpus_id': corpus_id, 'imported_count': imported}
+
+
+def _stage_summarize(ctx: dict) -> dict:
+    """Summarizes every downloaded file with Gemini (several files in flight, rate limited)."""
+    _ensure_local_files(ctx)
+    course_id = ctx['course_id']
+
+    files = []
+    for file in ctx['files']:
+        display_name = file.get("display_name") or f"file_{file.get('id')}"
+        if not file.get("local_path"):
+            logger.info(f"Could not locate file path for {display_name}")
+            continue
+        files.append((display_name, file["local_path"]))
+
+    def on_progress(file_path, completed, total):
+        if completed % 10 == 0 or completed == total:
+            _log_progress(course_id, f"Summarized {completed}/{total} files")
+
+    summaries = gemini_service.summarize_files(
+        [local_path for _, local_path in files],
+        progress_callback=on_progress
+    )
+
+    file_to_summary = {}
+    for (display_name, _), summary in zip(files, summaries):
+        if summary is None:
+            logger.warning(f"No summary for {display_name}, skipping")
+            continue
+        file_to_summary[display_name] = summary
+        logger.info(f"File Name: {display_name}\nSummary: {summary}")
+
+    if files and not file_to_summary:
+        raise JobError(f"None of the {len(files)} files could be summarized")
+    return {'summaries': file_to_summary}
+
+
+def _stage_extract_topics(ctx: dict) -> dict:
+    """Uses the professor's topics, or auto-extracts them from the file summaries."""
+    topics = ctx.get('params', {}).get('topics')
+    logger.info(f"topics: {topics}")
+
+    if not topics or not any(t.strip() for t in topics.split(",")):
+        logger.info("No topics provided, auto-extracting generating topics from files")
+        topic_list = kg_service.extract_topics_from_summaries(list(ctx['summaries'].values()))
+        logger.info(f"Auto-extracted topics: {topic_list}")
+    else:
+        topic_list = topics.split(",")
+
+    if not topic_list:
+        raise JobError("No topics could be extracted from the file summaries")
+    return {'topic_list': topic_list}
+
+
+def _stage_build_kg(ctx: dict) -> dict:
+    """Builds the knowledge graph from the topics and RAG corpus."""
+    kg_nodes, kg_edges, kg_data = kg_service.build_knowledge_graph(
+        topic_list=ctx['topic_list'],
+        corpus_id=ctx['corpus_id'],
+        files=ctx['files']
+    )
+    logger.info("Knowledge graph built successfully")
+    return {'kg_nodes': kg_nodes, 'kg_edges': kg_edges, 'kg_data': kg_data}
+
+
+def _stage_finalize(ctx: dict) -> dict:
+    """Cleans up local files and marks the course ACTIVE."""
+    local_dir = _local_course_dir(ctx['course_id'])
+    if os.path.exists(local_dir):
+        shutil.rmtree(local_dir)
+        logger.info(f"Deleted local directory: {local_dir}")
+
+    # GCS files are kept for source downloads
+    firestore_service.finalize_course_doc(ctx['course_id'], {
+        'corpus_id': ctx['corpus_id'],
+        'indexed_files': ctx['indexed_files'],
+        'kg_nodes': ctx['kg_nodes'],
+        'kg_edges': ctx['kg_edges'],
+        'kg_data': ctx['kg_data']
+    })
+
+    return {
+        'corpus_id': ctx['corpus_id'],
+        'files_count': len(ctx['files']),
+        'uploaded_count': ctx.get('uploaded_count', 0)
+    }
+
+
+# ============================================================================
+# SYNC STAGES
+# ============================================================================
+
+def _stage_sync_diff(ctx: dict) -> dict:
+    """Diffs the current Canvas listing against the stored indexed_files hashes."""
+    course_id = ctx['course_id']
+    course_data = firestore_service.get_course_data(course_id, use_cache=False).to_dict() or {}
+    stored = course_data.get('indexed_files') or {}
+
+    current_files, current_indexed = canvas_service.get_course_files(
+        course_id=course_id,
+        token=CANVAS_TOKEN,
+        download=False
+    )
+    diff = canvas_service.diff_indexed_files(stored, current_indexed)
+    logger.info(
+        f"Sync diff for course {course_id}: {len(diff['added'])} added, "
+        f"{len(diff['changed'])} changed, {len(diff['removed'])} removed"
+    )
+    _log_progress(
+        course_id,
+        f"Sync: {len(diff['added'])} added, {len(diff['changed'])} changed, {len(diff['removed'])} removed"
+    )
+
+    # Unchanged files keep their GCS location and display name
+    for fid, entry in current_indexed.items():
+        if fid in stored and fid not in diff['changed']:
+            for key in ('gcs_uri', 'display_name'):
+                if stored[fid].get(key):
+                    entry[key] = stored[fid][key]
+
+    upserted_ids = set(diff['added']) | set(diff['changed'])
+    return {
+        'corpus_id': course_data.get('corpus_id'),
+        'files': [f for f in current_files if f['id'] in upserted_ids],
+        'indexed_files': current_indexed,
+        'changed_ids': diff['changed'],
+        'removed_ids': diff['removed'],
+        # Stored GCS URIs whose RAG files must be dropped (changed files are re-imported)
+        'stale_uris': [stored[fid]['gcs_uri'] for fid in diff['changed'] + diff['removed'] if stored[fid].get('gcs_uri')],
+        'removed_uris': [stored[fid]['gcs_uri'] for fid in diff['removed'] if stored[fid].get('gcs_uri')]
+    }
+
+
+def _stage_sync_download(ctx: dict) -> dict:
+    """Downloads only the added or changed files."""
+    if not ctx['files']:
+        return {'downloaded_count': 0}
+    canvas_service.download_files(ctx['files'], CANVAS_TOKEN, ctx['course_id'])
+    downloaded = sum(1 for f in ctx['files'] if f.get('local_path'))
+    if not downloaded:
+        raise JobError(f"None of the {len(ctx['files'])} added or changed files could be downloaded")
+    # Local paths aren't checkpointed; a resumed upload re-downloads missing files
+    return {'downloaded_count': downloaded}
+
+
+def _stage_sync_upload(ctx: dict) -> dict:
+    """Uploads the added or changed files to GCS."""
+    if not ctx['files']:
+        return {'uploaded': {}, 'uploaded_count': 0}
+    return _stage_upload(ctx)
+
+
+def _stage_sync_remove(ctx: dict) -> dict:
+    """Deletes stale RAG files, and removed files from GCS."""
+    deleted = rag_service.delete_files_from_corpus(ctx['corpus_id'], ctx['stale_uris'])
+
+    # Never delete an object that a new or changed file was just uploaded to
+    uploaded_uris = {f.get('gcs_uri') for f in ctx['files']}
+    for gcs_uri in ctx['removed_uris']:
+        if gcs_uri not in uploaded_uris:
+            gcs_service.delete_file(gcs_uri)
+
+    return {'rag_files_deleted': deleted}
+
+
+def _stage_sync_import(ctx: dict) -> dict:
+    """Imports the added or changed files into the existing corpus."""
+    if not ctx['files']:
+        return {'imported_count': 0}
+    if local_index_service.is_local_index(ctx['corpus_id']):
+        _ensure_local_files(ctx)
+    imported = rag_service.import_files_to_corpus(ctx['corpus_id'], ctx['files'])
+    _check_imported(ctx['files'], imported)
+    return {'imported_count': imported}
+
+
+def _stage_sync_update_kg(ctx: dict) -> dict:
+    """Patches file nodes in the stored knowledge graph."""
+    if not _sync_has_changes(ctx):
+        logger.info(f"No file changes for course {ctx['course_id']}, keeping the knowledge graph")
+        return {}
+
+    graph = firestore_service.get_course_graph(ctx['course_id'], use_cache=False) or {}
+    kg_nodes, kg_edges, kg_data = kg_service.sync_files_in_graph(
+        corpus_id=ctx['corpus_id'],
+        existing_nodes=json.loads(graph.get('kg_nodes') or '[]'),
+        existing_edges=json.loads(graph.get('kg_edges') or '[]'),
+        existing_data=json.loads(graph.get('kg_data') or '{}'),
+        upserted_files=ctx['files'],
+        removed_file_ids=ctx['removed_ids']
+    )
+    return {'kg_nodes': kg_nodes, 'kg_edges': kg_edges, 'kg_data': kg_data}
+
+
+def _stage_sync_finalize(ctx: dict) -> dict:
+    """Cleans up local files and stores the new hashes and graph."""
+    local_dir = _local_course_dir(ctx['course_id'])
+    if os.path.exists(local_dir):
+        shutil.rmtree(local_dir)
+
+    if not _sync_has_changes(ctx):
+        # Nothing changed: don't write a graph version or bump corpus_version (which flushes caches)
+        firestore_service.mark_course_synced(ctx['course_id'])
+        return {'corpus_id': ctx['corpus_id'], 'added_count': 0, 'changed_count': 0, 'removed_count': 0}
+
+    firestore_service.update_course_files(
+        ctx['course_id'],
+        indexed_files=ctx['indexed_files'],
+        kg_nodes=ctx['kg_nodes'],
+        kg_edges=ctx['kg_edges'],
+        kg_data=ctx['kg_data']
+    )
+
+    return {
+        'corpus_id': ctx['corpus_id'],
+        'added_count': len(ctx['files']) - len(ctx['changed_ids']),
+        'changed_count': len(ctx['changed_ids']),
+        'removed_count': len(ctx['removed_ids'])
+    }
+
+
+def _sync_has_changes(ctx: dict) -> bool:
+    """True if the sync diff found any added, changed or removed files."""
+    return bool(ctx['files'] or ctx['removed_ids'])
+
+
+_PIPELINES = {
+    INITIALIZE_JOB: {
+        'stages': STAGES,
+        'functions': {
+            'download': _stage_download,
+            'upload': _stage_upload,
+            'import': _stage_import,
+            'summarize': _stage_summarize,
+            'extract_topics': _stage_extract_topics,
+            'build_kg': _stage_build_kg,
+            'finalize': _stage_finalize,
+        }
+    },
+    SYNC_JOB: {
+        'stages': SYNC_STAGES,
+        'functions': {
+            'diff': _stage_sync_diff,
+            'download': _stage_sync_download,
+            'upload': _stage_sync_upload,
+            'remove': _stage_sync_remove,
+            'import': _stage_sync_import,
+            'update_kg': _stage_sync_update_kg,
+            'finalize': _stage_sync_finalize,
+        }
+    },
+}
+
+
+# ============================================================================
+# HELPER FUNCTIONS
+# ============================================================================
+
+def _submit_job(course_id: str, job_type: str, params: dict) -> str:
+    """
+    Creates, reuses or resumes a job of the given type for a course.
+
+    If the course already has an unfinished job of this type, that job is reused:
+    - QUEUED/RUNNING with a fresh heartbeat: its ID is returned as-is
+    - ERROR, or RUNNING with a stale heartbeat: it is resumed from its last checkpoint
+
+    Resuming goes through firestore_service.claim_job, which compares the
+    heartbeat and owner in a transaction, so when several workers or
+    replicas receive the same request only one of them runs the job.
+    """
+    job = firestore_service.get_latest_job(course_id, job_type)
+    status = job.get('status')
+
+    if status in ('QUEUED', 'RUNNING', 'ERROR'):
+        job_id = job['job_id']
+        if not firestore_service.claim_job(job_id, _owner_id(), JOB_LEASE_SECONDS):
+            logger.info(f"Course {course_id} already has an active {job_type} job {job_id} ({status})")
+            return job_id
+        logger.info(f"Resuming job {job_id} for course {course_id} after stage(s) {job.get('completed_stages', [])}")
+    else:
+        job_id = firestore_service.create_job(course_id, job_type, params, owner=_owner_id())
+        if job_type == INITIALIZE_JOB:
+            firestore_service.create_course_doc(course_id)
+
+    _submit(job_id)
+    return job_id
+
+
+def _submit(job_id: str) -> None:
+    """Schedules a job on the worker pool unless this process is already running it."""
+    with _active_lock:
+        if job_id in _active_jobs:
+            return
+        _active_jobs.add(job_id)
+
+    def _worker():
+        try:
+            run_job(job_id)
+        finally:
+            with _active_lock:
+                _active_jobs.discard(job_id)
+
+    _executor.submit(_worker)
+
+
+def _owner_id() -> str:
+    """ID of this worker process, recorded as the owner of the jobs it runs."""
+    global _owner
+    # Recomputed after a fork (e.g. gunicorn --preload), so workers never share an ID
+    if _owner is None or not _owner.endswith(f"-{os.getpid()}"):
+        _owner = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}-{os.getpid()}"
+    return _owner
+
+
+def _start_heartbeat(job_id: str) -> tuple:
+    """
+    Refreshes the job's heartbeat every JOB_HEARTBEAT_SECONDS on a daemon thread.
+
+    Returns:
+        (stop, lost) events: set `stop` to end the thread; `lost` is set if
+        another worker has taken over the job
+    """
+    stop = threading.Event()
+    lost = threading.Event()
+    owner = _owner_id()
+
+    def _beat():
+        while not stop.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                if not firestore_service.heartbeat_job(job_id, owner):
+                    lost.set()
+                    return
+            except Exception as e:
+                logger.warning(f"Failed to refresh heartbeat for job {job_id}: {e}")
+
+    threading.Thread(target=_beat, name=f'job-heartbeat-{job_id}', daemon=True).start()
+    return stop, lost
+
+
+def _merge_output(ctx: dict, output: dict) -> None:
+    """Adds a stage's output (or restored checkpoint) to the pipeline context."""
+    ctx.update(output)
+    # Upload checkpoints only hold the new GCS locations of the files
+    for file in ctx.get('files', []) if output.get('uploaded') else []:
+        file_id = str(file.get('id'))
+        location = output['uploaded'].get(file_id)
+        if location:
+            file.update(location)
+            if file_id in ctx.get('indexed_files', {}):
+                ctx['indexed_files'][file_id].update(location)
+
+
+def _save_checkpoint(job_id: str, stage: str, output: dict):
+    """
+    Checkpoints a stage's output in Firestore, or in GCS when it's larger
+    than CHECKPOINT_INLINE_BYTES (e.g. summaries or graph JSON of a big course).
+
+    Returns:
+        The GCS URI of an offloaded checkpoint, else None
+    """
+    if len(json.dumps(output).encode('utf-8')) <= CHECKPOINT_INLINE_BYTES:
+        firestore_service.save_job_checkpoint(job_id, stage, output)
+        return None
+
+    gcs_uri = gcs_service.upload_json(output, f"jobs/{job_id}/checkpoints/{stage}.json")
+    firestore_service.save_job_checkpoint(job_id, stage, gcs_uri=gcs_uri)
+    return gcs_uri
+
+
+def _load_checkpoints(job_id: str, job: dict, stages: list) -> tuple:
+    """
+    Reads the outputs of completed stages (see _save_checkpoint).
+
+    Returns:
+        ({stage: output}, GCS URIs of the offloaded checkpoints)
+    """
+    stored = firestore_service.get_job_checkpoints(job_id, stages)
+    legacy = job.get('checkpoints') or {}  # Jobs created before checkpoints got their own documents
+    outputs, offloaded = {}, []
+    for stage in stages:
+        checkpoint = stored.get(stage)
+        if checkpoint is None:
+            outputs[stage] = legacy.get(stage) or {}
+        elif checkpoint.get('gcs_uri'):
+            outputs[stage] = gcs_service.download_json(checkpoint['gcs_uri'])
+            offloaded.append(checkpoint['gcs_uri'])
+        else:
+            outputs[stage] = checkpoint.get('output') or {}
+    return outputs, offloaded
+
+
+def _local_course_dir(course_id: str) -> str:
+    """Local download directory used by canvas_service for a course."""
+    root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return os.path.join(root_dir, 'app', 'data', 'courses', course_id)
+
+
+def _ensure_local_files(ctx: dict) -> None:
+    """
+    Re-downloads files whose local copies are gone.
+    This happens when a job resumes on a different container or after the
+    local directory was cleaned up by a previous attempt. Every stage that
+    reads file contents calls this first, since a resumed job may run any
+    stage on a host that never ran the download.
+
+    Raises:
+        JobError: If a file that was downloaded earlier cannot be restored
+    """
+    missing = [f for f in ctx['files'] if not f.get('local_path') or not os.path.exists(f['local_path'])]
+    if not missing:
+        return
+
+    # Files without a local_path never downloaded in the first place; they are retried but not required
+    required = [f for f in missing if f.get('local_path')]
+    logger.info(f"Re-downloading {len(missing)} file(s) missing from local storage")
+    canvas_service.download_files(missing, CANVAS_TOKEN, ctx['course_id'])
+
+    lost = [f for f in required if not f.get('local_path') or not os.path.exists(f['local_path'])]
+    if lost:
+        raise JobError(f"{len(lost)} downloaded file(s) could not be restored on this host")
+
+
+def _check_imported(files: list, imported: int) -> None:
+    """Fails the import stage if any uploaded file did not make it into the corpus."""
+    requested = sum(1 for f in files if f.get('gcs_uri'))
+    if imported < requested:
+        raise JobError(f"Only {imported}/{requested} files were imported into the corpus")
+
+
+def _log_progress(course_id: str, message: str) -> None:
+    """Appends a message to the course init logs without failing the job."""
+    try:
+        firestore_service.add_init_log(course_id, message)
+    except Exception as e:
+        logger.warning(f"Failed to write init log for course {course_id}: {e}")
@@ -7,12 +7,13 @@ import networkx as nx
 import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 if root_dir not in sys.path:
     sys.path.insert(0, root_dir)
-from app.services import gemini_service
+from app.services import gemini_service, rag_service
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +22,9 @@ SUMMARY_QUERY_TEMPLATE = (
     "Write a 1-paragraph summary for the topic. Make clear what likely are the learning objectives and what student should focus on during the course: {topic}. Go straight to the summary, no intro or outro."
 )
 
+# Topics summarized concurrently while building the graph
+TOPIC_WORKERS = int(os.environ.get('KG_TOPIC_WORKERS', '4'))
+
 NUM_TOPICS = 9
 def extract_topics_from_summaries(summaries: List[str], num_topics=NUM_TOPICS) -> List[str]:
     """
@@ -217,6 +221,143 @@ def remove_topic_from_graph(topic_id: str, existing_nodes: list, existing_edges:
     return (nodes_json, edges_json, data_json)
 
 
+def sync_files_in_graph(corpus_id: str, existing_nodes: list, existing_edges: list, existing_data: dict,
+                        upserted_files: list, removed_file_ids: list) -> tuple[str, str, str]:
+    """
+    Patches file nodes of an existing knowledge graph after a course re-sync.
+    Topics and their summaries are kept as-is.
+    
+    - Removed files: node, connected edges, and topic source entries are dropped
+    - Changed files: node label is refreshed
+    - New files: a node is added and linked to every topic whose RAG
+      retrieval (no generation) returns the file as a source
+    
+    Args:
+        corpus_id: The RAG corpus ID (already containing the new files)
+        existing_nodes: Current list of graph nodes
+        existing_edges: Current list of graph edges
+        existing_data: Current kg_data dictionary
+        upserted_files: File objects that were added or changed
+        removed_file_ids: IDs of files deleted from the course
+        
+    Returns:
+        Tuple of (updated_nodes_json, updated_edges_json, updated_data_json)
+    """
+    removed_ids = {str(fid) for fid in removed_file_ids}
+    removed_names = {node.get('label') for node in existing_nodes if node.get('id') in removed_ids}
+    
+    # Step 1: Drop removed files
+    nodes = [node for node in existing_nodes if node.get('id') not in removed_ids]
+    edges = [
+        edge for edge in existing_edges
+        if edge.get('from') not in removed_ids and edge.get('to') not in removed_ids
+    ]
+    data = {}
+    for topic_id, topic_data in existing_data.items():
+        sources = [
+            source for source in topic_data.get('sources', [])
+            if not (isinstance(source, dict) and source.get('filename') in removed_names)
+        ]
+        data[topic_id] = {**topic_data, 'sources': sources}
+    
+    # Step 2: Upsert file nodes
+    nodes_by_id = {node.get('id'): node for node in nodes}
+    new_file_name_to_id = {}
+    for file_obj in upserted_files:
+        file_id = str(file_obj.get('id', ''))
+        file_name = file_obj.get('name') or file_obj.get('display_name', 'Unknown File')
+        if not file_id:
+            continue
+        
+        if file_id in nodes_by_id:
+            nodes_by_id[file_id]['label'] = file_name
+        else:
+            file_node = {'id': file_id, 'label': file_name, 'group': 'file_pdf'}
+            nodes.append(file_node)
+            nodes_by_id[file_id] = file_node
+            new_file_name_to_id[file_name] = file_id
+    
+    # Step 3: Link new files to the topics that retrieve them
+    if new_file_name_to_id:
+        topic_nodes = [node for node in nodes if node.get('group') == 'topic']
+        for topic_node in topic_nodes:
+            topic_id = topic_node['id']
+            try:
+                _, sources = rag_service.retrieve_context(
+                    corpus_id,
+                    SUMMARY_QUERY_TEMPLATE.format(topic=topic_node.get('label')),
+                )
+            except Exception as e:
+                logger.error(f"Error retrieving sources for topic {topic_node.get('label')}: {e}")
+                continue
+            
+            for source in sources:
+                source_name = source.get('filename', '')
+                for file_name, fid in new_file_name_to_id.items():
+                    if file_name in source_name or source_name in file_name:
+                        edges.append({'from': topic_id, 'to': fid})
+                        data.setdefault(topic_id, {'summary': '', 'sources': []})['sources'].append(source)
+                        break
+    
+    logger.info(
+        f"Synced graph files: {len(removed_ids)} removed, {len(new_file_name_to_id)} added, "
+        f"{len(upserted_files) - len(new_file_name_to_id)} updated"
+    )
+    
+    return (json.dumps(nodes), json.dumps(edges), json.dumps(data))
+
+
+def _summarize_topic(topic: str, corpus_id: str, file_name_to_id: dict) -> tuple[dict, list]:
+    """
+    Queries the RAG corpus for one topic's summary and sources.
+    
+    Args:
+        topic: The topic name
+        corpus_id: The RAG corpus ID
+        file_name_to_id: Mapping of file display names to file node IDs
+        
+    Returns:
+        Tuple of (topic_data, source_file_ids); on failure the topic data holds
+        an error summary and no sources, so the topic node is still created
+    """
+    try:
+        # Use rag_service to retrieve context
+        summary, source_names = gemini_service.generate_answer_with_context(
+            query=SUMMARY_QUERY_TEMPLATE.format(topic=topic),
+            corpus_id=corpus_id,
+        )
+        
+        # Extract unique source file IDs
+        source_files = []
+        for source in source_names:
+            # Handle both old string format and new dict format
+            if isinstance(source, dict):
+                source_name = source.get('filename', '')
+            else:
+                source_name = source
+            
+            # Match source name to file IDs
+            for file_name, fid in file_name_to_id.items():
+                if file_name in source_name or source_name in file_name:
+                    if fid not in source_files:
+                        source_files.append(fid)
+                    break
+        
+        topic_data = {
+            'summary': summary,
+            'sources': source_names  # Keep the full source objects (with filename and source_uri)
+        }
+        return topic_data, source_files
+        
+    except Exception as e:
+        logger.error(f"Error processing topic {topic}: {e}")
+        # If RAG query fails, still create the topic node but with empty data
+        return {
+            'summary': f"Error retrieving information for {topic}.",
+            'sources': []
+        }, []
+
+
 def build_knowledge_graph(topic_list: list, corpus_id: str, files: list) -> tuple[str, str, str]:
     """
     Builds the complete knowledge graph with topics, files, and connections.
@@ -277,13 +418,20 @@ def build_knowledge_graph(topic_list: list, corpus_id: str, files: list) -> tupl
         file_name_to_id[file_name] = file_id
     
     # Step 2: Create Topic Nodes and Query RAG
-    # Use RAG service to retrieve context for each topic
+    # Topic IDs come from list position, so they don't depend on which
+    # topic finishes first; topics are queried concurrently.
+    topic_ids = [f"topic_{i+1}" for i in range(len(topics))]
     
-    for i, topic in enumerate(topics):
-        topic_id = f"topic_{i+1}"
-        
-        logger.info(f"Processing topic {i+1}/{len(topics)}: {topic}")
-        
+    def process_topic(index: int):
+        logger.info(f"Processing topic {index+1}/{len(topics)}: {topics[index]}")
+        return _summarize_topic(topics[index], corpus_id, file_name_to_id)
+    
+    workers = max(1, min(TOPIC_WORKERS, len(topics)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # map() yields results in topic order
+        results = list(executor.map(process_topic, range(len(topics))))
+    
+    for topic_id, topic, (topic_data, source_files) in zip(topic_ids, topics, results):
         # Create topic node
         topic_node = {
             'id': topic_id,
@@ -295,53 +443,18 @@ def build_knowledge_graph(topic_list: list, corpus_id: str, files: list) -> tupl
         G.add_node(topic_id, **topic_node)
         nodes.append(topic_node)
         
-        # Query RAG corpus for this topic using rag_service
-        try:
-            # Use rag_service to retrieve context
-            summary, source_names = gemini_service.generate_answer_with_context(
-                query=SUMMARY_QUERY_TEMPLATE.format(topic=topic),
-                corpus_id=corpus_id,
-            )
-            
-            # Extract unique source file IDs
-            source_files = []
-            for source in source_names:
-                # Handle both old string format and new dict format
-                if isinstance(source, dict):
-                    source_name = source.get('filename', '')
-                else:
-                    source_name = source
-                
-                # Match source name to file IDs
-                for file_name, fid in file_name_to_id.items():
-                    if file_name in source_name or source_name in file_name:
-                        if fid not in source_files:
-                            source_files.append(fid)
-                        break
-            
-            # Store topic data
-            kg_data[topic_id] = {
-                'summary': summary,
-                'sources': source_names  # Keep the full source objects (with filename and source_uri)
-            }
-            
-            # Create edges from topic to relevant files
-            for file_id in source_files:
-                edge = {
-                    'from': topic_id,
-                    'to': file_id
-                }
-                # Add to networkx graph
-                G.add_edge(topic_id, file_id)
-                edges.append(edge)
-                
-        except Exception as e:
-            logger.error(f"Error processing topic {topic}: {e}")
-            # If RAG query fails, still create the topic node but with empty data
-            kg_data[topic_id] = {
-                'summary': f"Error retrieving information for {topic}.",
-                'sources': []
+        # Store topic data
+        kg_data[topic_id] = topic_data
+        
+        # Create edges from topic to relevant files
+        for file_id in source_files:
+            edge = {
+                'from': topic_id,
+                'to': file_id
             }
+            # Add to networkx graph
+            G.add_edge(topic_id, file_id)
+            edges.append(edge)
     
     # Step 3: Serialize to JSON strings
     nodes_json = json.dumps(nodes)
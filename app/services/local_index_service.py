@@ -0,0 +1,595 @@
+"""
+Local Index Service
+In-process vector retrieval, used by rag_service when RETRIEVAL_BACKEND=local.
+
+This service is responsible for:
+- Extracting text from course files and chunking it with the same
+  size/overlap settings as the Vertex RAG corpus (rag_service.CHUNK_SIZE/CHUNK_OVERLAP)
+- Embedding chunks with the RETRIEVAL_DOCUMENT task type
+- Storing unit-length float32 vectors in a memory-mapped matrix per index
+- Answering top-k queries with a single NumPy matrix-vector product,
+  fused with BM25 keyword scores (reciprocal-rank fusion) so exact terms
+  such as theorem names, assignment numbers and identifiers are found
+  even when their embeddings are not close to the query's
+
+It implements the same operations as the Vertex backend (create, import,
+delete, retrieve) and returns results in the same shape, so callers of
+rag_service do not need to know which backend a course uses.
+
+Index layout (app/data/vector_index/<index>/):
+- meta.json                  current generation, dimension, chunk count
+- vectors.<generation>.f32   float32 matrix, one row per chunk
+- chunks.<generation>.json   text and source of each row
+
+Every write produces a new generation and then swaps meta.json, so readers
+never see a half-written index.
+
+The local directory is a cache. Each generation is also uploaded to GCS
+(gs://<bucket>/vector_index/<index>/, meta.json last), and a host that has
+no copy of an index, or an outdated one, downloads it on first use (see
+_ensure_local). Pod restarts, redeploys and requests routed to another
+replica therefore keep working.
+
+Dependencies:
+- gemini_service: For embeddings
+- gcs_service: For the shared copy of each index
+- pypdf (optional): For PDF text extraction
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # Optional: PDFs are skipped without it
+    PdfReader = None
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+INDEX_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'vector_index'
+)
+INDEX_PREFIX = 'local:'
+EMBEDDING_MODEL = "text-embedding-004"
+DOCUMENT_EMBED_BATCH_SIZE = 16  # ~16 x 512-word chunks stays under the per-request token limit
+
+# Shared copy in GCS (see _ensure_local)
+INDEX_GCS_SYNC = os.environ.get('LOCAL_INDEX_GCS_SYNC', 'true').lower() in ('1', 'true', 'yes')
+INDEX_GCS_PREFIX = 'vector_index'
+INDEX_SYNC_SECONDS = int(os.environ.get('LOCAL_INDEX_SYNC_SECONDS', '300'))  # How often a local copy is checked against GCS
+
+# Hybrid (vector + BM25) search settings
+HYBRID_SEARCH = os.environ.get('RETRIEVAL_HYBRID', 'true').lower() in ('1', 'true', 'yes')
+HYBRID_CANDIDATES = int(os.environ.get('RETRIEVAL_HYBRID_CANDIDATES', '50'))  # Ranked results taken from each retriever
+RRF_K = 60  # Reciprocal-rank fusion constant (score = sum of 1 / (RRF_K + rank))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TEXT_EXTENSIONS = {'.txt', '.md', '.csv', '.tex', '.py', '.java', '.c', '.cpp', '.json'}
+HTML_EXTENSIONS = {'.html', '.htm'}
+
+# index_id -> {'generation', 'vectors', 'chunks'}
+_loaded = {}
+_loaded_lock = threading.Lock()
+_write_locks = {}
+_synced_at = {}  # index_id -> time.monotonic() of the last check against GCS
+
+
+class IndexUnavailableError(RuntimeError):
+    """Raised when an index exists neither on this host nor in GCS."""
+
+
+def is_local_index(corpus_id: str) -> bool:
+    """True if a corpus ID refers to a local index rather than a Vertex RAG corpus."""
+    return bool(corpus_id) and corpus_id.startswith(INDEX_PREFIX)
+
+
+def create_index(files: List[Dict], chunk_size: int, chunk_overlap: int) -> str:
+    """
+    Creates a new local index and indexes the given files.
+
+    Args:
+        files: File objects with 'local_path' and 'gcs_uri' (as produced by the
+               download and upload stages)
+        chunk_size: Words per chunk
+        chunk_overlap: Words shared between consecutive chunks
+
+    Returns:
+        The index ID, e.g. "local:3f2a..."; stored as the course's corpus_id
+
+    Example:
+        corpus_id = create_index(files, CHUNK_SIZE, CHUNK_OVERLAP)
+    """
+    index_id = f"{INDEX_PREFIX}{uuid.uuid4().hex}"
+    os.makedirs(_index_path(index_id), exist_ok=True)
+    _write_index(index_id, np.zeros((0, 0), dtype=np.float32), [])
+    import_files(index_id, files, chunk_size, chunk_overlap)
+    return index_id
+
+
+def import_files(index_id: str, files: List[Dict], chunk_size: int, chunk_overlap: int) -> int:
+    """
+    Adds files to an index. A file that is already indexed (same gcs_uri)
+    has its old chunks replaced.
+
+    Args:
+        index_id: The local index ID
+        files: File objects with 'local_path' and 'gcs_uri'
+        chunk_size: Words per chunk
+        chunk_overlap: Words shared between consecutive chunks
+
+    Returns:
+        Number of files indexed
+    """
+    from . import gemini_service
+
+    new_chunks = []
+    indexed_uris = set()
+    for file in files:
+        gcs_uri = file.get('gcs_uri')
+        local_path = file.get('local_path')
+        display_name = file.get('display_name', 'unknown')
+        if not gcs_uri or not local_path or not os.path.exists(local_path):
+            logger.warning(f"No local copy of {display_name}, skipping")
+            continue
+
+        text = extract_text(local_path)
+        if not text.strip():
+            logger.warning(f"No extractable text in {display_name}, skipping")
+            continue
+
+        for chunk in chunk_text(text, chunk_size, chunk_overlap):
+            new_chunks.append({'text': chunk, 'source_uri': gcs_uri})
+        indexed_uris.add(gcs_uri)
+
+    if not new_chunks:
+        return 0
+
+    logger.info(f"Embedding {len(new_chunks)} chunks from {len(indexed_uris)} file(s) for {index_id}")
+    vectors = gemini_service.get_embeddings_batch(
+        [chunk['text'] for chunk in new_chunks],
+        task_type="RETRIEVAL_DOCUMENT",
+        model_name=EMBEDDING_MODEL,
+        batch_size=DOCUMENT_EMBED_BATCH_SIZE
+    )
+    embedded = [(chunk, vector) for chunk, vector in zip(new_chunks, vectors) if vector]
+    failed_uris = {chunk['source_uri'] for chunk, vector in zip(new_chunks, vectors) if not vector}
+    if failed_uris:
+        logger.error(f"Failed to embed some chunks of {len(failed_uris)} file(s); those files are partially indexed")
+    if not embedded:
+        return 0
+
+    with _write_lock(index_id):
+        current = _load(index_id)
+        keep = [i for i, chunk in enumerate(current['chunks']) if chunk['source_uri'] not in indexed_uris]
+        chunks = [current['chunks'][i] for i in keep] + [chunk for chunk, _ in embedded]
+        added = _normalize_rows(np.asarray([vector for _, vector in embedded], dtype=np.float32))
+        old = np.asarray(current['vectors'][keep]) if keep else np.zeros((0, added.shape[1]), dtype=np.float32)
+        _write_index(index_id, np.vstack([old, added]), chunks)
+
+    logger.info(f"Indexed {len(indexed_uris)} file(s) into {index_id}")
+    return len(indexed_uris)
+
+
+def delete_files(index_id: str, gcs_uris: List[str]) -> int:
+    """
+    Removes every chunk that came from the given GCS URIs.
+
+    Args:
+        index_id: The local index ID
+        gcs_uris: GCS URIs of the files to remove
+
+    Returns:
+        Number of files that had chunks removed
+    """
+    targets = set(gcs_uris)
+    with _write_lock(index_id):
+        current = _load(index_id)
+        keep = [i for i, chunk in enumerate(current['chunks']) if chunk['source_uri'] not in targets]
+        removed = {chunk['source_uri'] for chunk in current['chunks'] if chunk['source_uri'] in targets}
+        if removed:
+            vectors = np.asarray(current['vectors'][keep]) if keep else np.zeros((0, 0), dtype=np.float32)
+            _write_index(index_id, vectors, [current['chunks'][i] for i in keep])
+
+    logger.info(f"Removed {len(removed)} file(s) from {index_id}")
+    return len(removed)
+
+
+def indexed_uris(index_id: str) -> set:
+    """
+    Returns the GCS URIs of every file that has chunks in the index.
+
+    Args:
+        index_id: The local index ID
+
+    Returns:
+        Set of source GCS URIs
+    """
+    return {chunk['source_uri'] for chunk in _load(index_id)['chunks']}
+
+
+def retrieve_chunks(index_id: str, query: str, top_k: int = 10, threshold: float = 0.5) -> List[Dict]:
+    """
+    Finds the chunks closest to a query.
+
+    Distances are cosine distances (1 - cosine similarity), matching what
+    Vertex RAG reports. Vector matches must be within threshold; with
+    hybrid search on, BM25 keyword matches are fused in as well (see search_chunks).
+
+    Args:
+        index_id: The local index ID
+        query: The search query text
+        top_k: Number of most relevant chunks to return
+        threshold: Maximum cosine distance
+
+    Returns:
+        List of {'text', 'source_uri', 'distance'} dicts, in the same shape
+        as rag_service.retrieve_chunks
+
+    Example:
+        chunks = retrieve_chunks("local:3f2a...", "What is recursion?")
+    """
+    from . import gemini_service
+
+    query_vector = gemini_service.get_embedding(query, model_name=EMBEDDING_MODEL, task_type="RETRIEVAL_QUERY")
+    return search_chunks(index_id, query_vector, top_k, threshold, query_text=query)
+
+
+def search_chunks(index_id: str, query_vector: list, top_k: int = 10, threshold: float = 0.5,
+                  query_text: str = None) -> List[Dict]:
+    """
+    Like retrieve_chunks(), but for an already-embedded query.
+
+    When query_text is given (and RETRIEVAL_HYBRID is on), the vector
+    ranking (chunks within threshold) and the BM25 ranking of query_text
+    are merged with reciprocal-rank fusion and the top_k fused chunks are
+    returned. Keyword-only hits can therefore exceed the distance
+    threshold; their reported distance is still the true cosine distance.
+    """
+    index = _load(index_id)
+    vectors, chunks = index['vectors'], index['chunks']
+    if not chunks:
+        return []
+
+    query = np.asarray(query_vector, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    if norm == 0:
+        return []
+
+    distances = 1.0 - vectors @ (query / norm)
+    pool = max(top_k, HYBRID_CANDIDATES) if query_text and HYBRID_SEARCH else top_k
+    vector_ranked = _top_indices(np.flatnonzero(distances <= threshold), -distances, pool)
+
+    if query_text and HYBRID_SEARCH:
+        scores = bm25_scores(index, query_text)
+        keyword_ranked = _top_indices(np.flatnonzero(scores > 0), scores, pool)
+        ranked = reciprocal_rank_fusion([vector_ranked, keyword_ranked])[:top_k]
+    else:
+        ranked = vector_ranked[:top_k]
+
+    logger.info(f"Retrieved {len(ranked)} context chunks from {index_id}")
+    return [
+        {'text': chunks[i]['text'], 'source_uri': chunks[i]['source_uri'], 'distance': float(distances[i])}
+        for i in ranked
+    ]
+
+
+def _top_indices(candidates: np.ndarray, scores: np.ndarray, limit: int) -> List[int]:
+    """Returns up to `limit` of the candidate row indices, highest score first."""
+    if len(candidates) > limit:
+        candidates = candidates[np.argpartition(-scores[candidates], limit)[:limit]]
+    return [int(i) for i in candidates[np.argsort(-scores[candidates], kind='stable')]]
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = RRF_K) -> List[int]:
+    """
+    Merges several rankings of the same items: each item scores
+    sum(1 / (k + rank)) over the rankings it appears in (rank starts at 1).
+
+    Example:
+        reciprocal_rank_fusion([[3, 1, 2], [2, 3]])  # -> [3, 2, 1]
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(fused, key=lambda item: -fused[item])
+
+
+# ============================================================================
+# KEYWORD SEARCH (BM25)
+# ============================================================================
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercases and splits text into search terms. Dotted and hyphenated
+    tokens are kept whole so "Theorem 4.2", "hw-3" and "merge_sort" match exactly.
+    """
+    return re.findall(r"[a-z0-9_]+(?:[.\-][a-z0-9_]+)*", text.lower())
+
+
+def bm25_scores(index: dict, query_text: str) -> np.ndarray:
+    """
+    Scores every chunk of a loaded index against a query with Okapi BM25.
+    The inverted index is built on first use and kept with the loaded generation.
+
+    Returns:
+        Array with one score per chunk (0 for chunks sharing no term with the query)
+    """
+    if 'bm25' not in index:
+        index['bm25'] = _build_bm25(index['chunks'])
+    bm25 = index['bm25']
+
+    scores = np.zeros(len(index['chunks']), dtype=np.float32)
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * bm25['doc_len'] / bm25['avgdl'])
+    for term in set(tokenize(query_text)):
+        postings = bm25['postings'].get(term)
+        if postings is None:
+            continue
+        doc_ids, tf = postings
+        idf = np.log(1 + (len(scores) - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+        scores[doc_ids] += idf * tf * (BM25_K1 + 1) / (tf + length_norm[doc_ids])
+    return scores
+
+
+def _build_bm25(chunks: List[Dict]) -> dict:
+    """Builds the term -> (chunk ids, term frequencies) inverted index for a chunk list."""
+    postings = {}
+    doc_len = np.zeros(len(chunks), dtype=np.float32)
+    for doc_id, chunk in enumerate(chunks):
+        terms = tokenize(chunk['text'])
+        doc_len[doc_id] = len(terms)
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            postings.setdefault(term, ([], []))
+            postings[term][0].append(doc_id)
+            postings[term][1].append(count)
+
+    return {
+        'postings': {
+            term: (np.asarray(ids, dtype=np.int64), np.asarray(tf, dtype=np.float32))
+            for term, (ids, tf) in postings.items()
+        },
+        'doc_len': doc_len,
+        'avgdl': float(doc_len.mean()) if len(chunks) and doc_len.mean() > 0 else 1.0
+    }
+
+
+# ============================================================================
+# TEXT EXTRACTION AND CHUNKING
+# ============================================================================
+
+def extract_text(file_path: str) -> str:
+    """
+    Extracts plain text from a course file.
+    Supports PDFs (when pypdf is installed), HTML and plain-text formats;
+    anything else returns an empty string.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    try:
+        if extension == '.pdf':
+            if PdfReader is None:
+                logger.warning(f"pypdf is not installed, cannot index {os.path.basename(file_path)}")
+                return ''
+            reader = PdfReader(file_path)
+            return '\n'.join(page.extract_text() or '' for page in reader.pages)
+        if extension in TEXT_EXTENSIONS or extension in HTML_EXTENSIONS:
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                text = f.read()
+            return re.sub(r'<[^>]+>', ' ', text) if extension in HTML_EXTENSIONS else text
+    except Exception as e:
+        logger.error(f"Failed to extract text from {file_path}: {e}")
+        return ''
+
+    logger.warning(f"Unsupported file type for local indexing: {os.path.basename(file_path)}")
+    return ''
+
+
+def chunk_text(text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    """
+    Splits text into overlapping chunks of chunk_size words.
+    Words stand in for tokens, which keeps chunking dependency-free.
+
+    Example:
+        chunk_text(text, 512, 100)  # chunk n starts 412 words after chunk n-1
+    """
+    words = text.split()
+    if not words:
+        return []
+    step = max(1, chunk_size - chunk_overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(' '.join(words[start:start + chunk_size]))
+        if start + chunk_size >= len(words):
+            break
+    return chunks
+
+
+# ============================================================================
+# STORAGE
+# ============================================================================
+
+def _index_path(index_id: str) -> str:
+    return os.path.join(INDEX_DIR, index_id[len(INDEX_PREFIX):])
+
+
+def _write_lock(index_id: str) -> threading.RLock:
+    # Re-entrant: writers hold it while _load() may sync the index down from GCS
+    with _loaded_lock:
+        return _write_locks.setdefault(index_id, threading.RLock())
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _read_meta(index_id: str) -> dict:
+    with open(os.path.join(_index_path(index_id), 'meta.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _load(index_id: str) -> dict:
+    """Returns the index's current generation, memory-mapping it on first use."""
+    _ensure_local(index_id)
+    try:
+        meta = _read_meta(index_id)
+    except FileNotFoundError:
+        raise IndexUnavailableError(
+            f"Search index {index_id} is not available on this server; re-sync the course to rebuild it"
+        )
+    with _loaded_lock:
+        cached = _loaded.get(index_id)
+        if cached and cached['generation'] == meta['generation']:
+            return cached
+
+    path = _index_path(index_id)
+    generation = meta['generation']
+    if meta['count']:
+        vectors = np.memmap(
+            os.path.join(path, f"vectors.{generation}.f32"), dtype=np.float32, mode='r',
+            shape=(meta['count'], meta['dim'])
+        )
+    else:
+        vectors = np.zeros((0, meta['dim']), dtype=np.float32)
+    with open(os.path.join(path, f"chunks.{generation}.json"), 'r', encoding='utf-8') as f:
+        chunks = json.load(f)
+
+    index = {'generation': generation, 'vectors': vectors, 'chunks': chunks}
+    with _loaded_lock:
+        _loaded[index_id] = index
+    return index
+
+
+def _write_index(index_id: str, vectors: np.ndarray, chunks: List[Dict]) -> None:
+    """Writes a new generation of the index and points meta.json at it."""
+    path = _index_path(index_id)
+    try:
+        old_generation = _read_meta(index_id)['generation']
+    except (OSError, ValueError):
+        old_generation = None
+    generation = uuid.uuid4().hex[:12]
+
+    if len(chunks):
+        matrix = np.memmap(
+            os.path.join(path, f"vectors.{generation}.f32"), dtype=np.float32, mode='w+', shape=vectors.shape
+        )
+        matrix[:] = vectors
+        matrix.flush()
+        del matrix
+    with open(os.path.join(path, f"chunks.{generation}.json"), 'w', encoding='utf-8') as f:
+        json.dump(chunks, f)
+
+    meta = {
+        'generation': generation,
+        'count': len(chunks),
+        'dim': int(vectors.shape[1]) if len(chunks) else 0,
+        'model': EMBEDDING_MODEL
+    }
+    _write_meta(index_id, meta)
+    if INDEX_GCS_SYNC:
+        _upload_generation(index_id, meta, old_generation)
+
+    # Readers holding the old memmap keep working; the file is gone once they drop it
+    if old_generation:
+        for name in _generation_files(old_generation):
+            try:
+                os.remove(os.path.join(path, name))
+            except OSError:
+                pass
+
+
+def _write_meta(index_id: str, meta: dict) -> None:
+    """Atomically points the local index at a generation."""
+    tmp_path = os.path.join(_index_path(index_id), f"meta.json.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(_index_path(index_id), 'meta.json'))
+
+
+def _generation_files(generation: str) -> Tuple[str, str]:
+    return f"vectors.{generation}.f32", f"chunks.{generation}.json"
+
+
+def _remote_path(index_id: str, name: str) -> str:
+    """Blob path of an index file in the GCS bucket."""
+    return f"{INDEX_GCS_PREFIX}/{index_id[len(INDEX_PREFIX):]}/{name}"
+
+
+def _upload_generation(index_id: str, meta: dict, old_generation: str = None) -> None:
+    """Copies a generation to GCS, swapping the remote meta.json last."""
+    from . import gcs_service
+
+    path = _index_path(index_id)
+    vectors_name, chunks_name = _generation_files(meta['generation'])
+    if meta['count']:
+        gcs_service.upload_file(os.path.join(path, vectors_name), _remote_path(index_id, vectors_name))
+    gcs_service.upload_file(os.path.join(path, chunks_name), _remote_path(index_id, chunks_name))
+    gcs_service.upload_json(meta, _remote_path(index_id, 'meta.json'))
+    _synced_at[index_id] = time.monotonic()
+
+    if old_generation:
+        for name in _generation_files(old_generation):
+            gcs_service.delete_file(f"gs://{gcs_service.BUCKET_NAME}/{_remote_path(index_id, name)}")
+
+
+def _ensure_local(index_id: str) -> None:
+    """
+    Makes sure this host has the index's current generation, downloading it
+    from GCS when the local copy is missing (new pod, other replica) or was
+    superseded by a write on another host. A local copy is compared with
+    GCS at most every INDEX_SYNC_SECONDS.
+    """
+    if not INDEX_GCS_SYNC:
+        return
+    local_meta = os.path.join(_index_path(index_id), 'meta.json')
+    last_sync = _synced_at.get(index_id)
+    if os.path.exists(local_meta) and last_sync is not None and time.monotonic() - last_sync < INDEX_SYNC_SECONDS:
+        return
+
+    from . import gcs_service
+
+    with _write_lock(index_id):
+        has_local = os.path.exists(local_meta)
+        try:
+            meta = gcs_service.download_json(f"gs://{gcs_service.BUCKET_NAME}/{_remote_path(index_id, 'meta.json')}")
+        except Exception as e:
+            if has_local:
+                logger.warning(f"Could not check {index_id} against GCS, using the local copy: {e}")
+                _synced_at[index_id] = time.monotonic()
+                return
+            raise IndexUnavailableError(
+                f"Search index {index_id} is not on this server and could not be restored from GCS ({e}); "
+                f"re-sync the course to rebuild it"
+            )
+
+        local_generation = _read_meta(index_id)['generation'] if has_local else None
+        if local_generation != meta['generation']:
+            logger.info(f"Downloading generation {meta['generation']} of {index_id} from GCS")
+            path = _index_path(index_id)
+            vectors_name, chunks_name = _generation_files(meta['generation'])
+            if meta['count']:
+                gcs_service.download_file(
+                    f"gs://{gcs_service.BUCKET_NAME}/{_remote_path(index_id, vectors_name)}", os.path.join(path, vectors_name)
+                )
+            gcs_service.download_file(
+                f"gs://{gcs_service.BUCKET_NAME}/{_remote_path(index_id, chunks_name)}", os.path.join(path, chunks_name)
+            )
+            _write_meta(index_id, meta)
+            for name in _generation_files(local_generation) if local_generation else ():
+                try:
+                    os.remove(os.path.join(path, name))
+                except OSError:
+                    pass
+        _synced_at[index_id] = time.monotonic()
@@ -7,6 +7,13 @@ This service provides functions to:
 2. Retrieve relevant context chunks using vector similarity search
 3. Extract source citations from retrieved context
 
+Retrieval backends:
+- vertex (default): Vertex AI RAG Engine corpora
+- local: in-process NumPy index (see local_index_service)
+RETRIEVAL_BACKEND picks the backend for newly created corpora. Existing
+corpora keep the backend they were created with (local corpus IDs start
+with "local:"), so switching the setting never breaks a live course.
+
 Note: This service does NOT generate answers. It only retrieves context.
 Answer generation should be handled by a separate LLM service.
 """
@@ -16,7 +23,16 @@ from vertexai.generative_models import GenerativeModel
 import os
 import logging
 import re
+import glob
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Tuple, Dict
+from cachetools import TTLCache
+
+from . import local_index_service
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +46,27 @@ if project_id:
 else:
     logger.warning("GOOGLE_CLOUD_PROJECT not set - Vertex AI not initialized")
 
+# Chunking settings used for every corpus import
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 100
+
+# Batched import settings (Vertex accepts at most 25 paths per ImportRagFiles call)
+IMPORT_BATCH_SIZE = 25
+IMPORT_WORKERS = int(os.environ.get('RAG_IMPORT_WORKERS', '4'))  # Import operations polled concurrently
+
+# Backend for newly created corpora: 'vertex' or 'local'
+RETRIEVAL_BACKEND = os.environ.get('RETRIEVAL_BACKEND', 'vertex').lower()
+
+# Retrieval result cache (see retrieve_chunks)
+RETRIEVAL_CACHE_TTL = int(os.environ.get('RETRIEVAL_CACHE_TTL_SECONDS', '600'))
+RETRIEVAL_CACHE_SIZE = int(os.environ.get('RETRIEVAL_CACHE_SIZE', '1024'))
+# Optional directory shared by every worker on the host (e.g. all gunicorn workers); empty disables it
+RETRIEVAL_CACHE_DIR = os.environ.get('RETRIEVAL_CACHE_DIR', '')
+
+_retrieval_cache = TTLCache(maxsize=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL)
+_retrieval_cache_lock = threading.Lock()
+_retrieval_stats = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+
 
 def create_and_provision_corpus(files: List[Dict], corpus_name_suffix: str = "") -> str:
     """
@@ -56,6 +93,11 @@ def create_and_provision_corpus(files: List[Dict], corpus_name_suffix: str = "")
         # Step 3: Create RAG corpus from GCS files
         corpus_name = create_and_provision_corpus(files, f"Course {course_id}")
     """
+    if RETRIEVAL_BACKEND == 'local':
+        corpus_name = local_index_service.create_index(files, CHUNK_SIZE, CHUNK_OVERLAP)
+        logger.info(f"Created local index: {corpus_name}")
+        return corpus_name
+    
     if not project_id:
         raise ValueError("GOOGLE_CLOUD_PROJECT environment variable not set")
     
@@ -71,42 +113,7 @@ def create_and_provision_corpus(files: List[Dict], corpus_name_suffix: str = "")
         logger.info(f"Created corpus: {corpus_name}")
         
         # Upload each file to the corpus from GCS
-        upload_count = 0
-        for file in files:
-            try:
-                gcs_uri = file.get('gcs_uri')
-                file_id = file.get('id')
-                display_name = file.get('display_name', 'unknown')
-                
-                # Skip files that weren't uploaded to GCS
-                if not gcs_uri:
-                    logger.warning(f"No GCS URI for file: {display_name} (ID: {file_id}), skipping")
-                    continue
-                
-                # Validate GCS URI format
-                if not gcs_uri.startswith('gs://'):
-                    logger.warning(f"Invalid GCS URI for file {display_name}: {gcs_uri}, skipping")
-                    continue
-                
-                logger.info(f"Importing file from GCS: {display_name} (ID: {file_id})")
-                logger.info(f"  GCS URI: {gcs_uri}")
-                
-                # Import file to RAG corpus from GCS
-                # Note: Vertex AI RAG automatically indexes the content
-                rag.import_files(
-                    corpus_name=corpus_name,
-                    paths=[gcs_uri],  # Use GCS URI instead of local path
-                    chunk_size=512,  # Optimal chunk size for retrieval
-                    chunk_overlap=100  # Overlap for context continuity
-                )
-                
-                upload_count += 1
-                logger.info(f"✅ Successfully imported: {display_name}")
-                
-            except Exception as e:
-                logger.error(f"Failed to import file {file.get('display_name')}: {str(e)}")
-                # Continue with other files even if one fails
-                continue
+        upload_count = import_files_to_corpus(corpus_name, files)
         
         logger.info(f"Corpus provisioning complete: {corpus_name} ({upload_count}/{len(files)} files uploaded)")
         return corpus_name
@@ -116,7 +123,200 @@ def create_and_provision_corpus(files: List[Dict], corpus_name_suffix: str = "")
         raise
 
 
-def retrieve_context(corpus_id: str, query: str, top_k: int = 10, threshold: float = 0.5) -> Tuple[List[str], Dict]:
+def import_files_to_corpus(corpus_id: str, files: List[Dict]) -> int:
+    """
+    Imports files from Google Cloud Storage into an existing RAG corpus.
+    
+    URIs are submitted in batches of up to IMPORT_BATCH_SIZE per import
+    operation, with up to IMPORT_WORKERS operations in flight at once.
+    Afterwards the corpus listing is checked to find which files actually
+    landed; any that did not (partial or whole-batch failure) are retried
+    one by one so every failure is attributed to a single file.
+    Files without a valid 'gcs_uri' are skipped.
+    
+    Args:
+        corpus_id: The RAG corpus resource name
+        files: List of file objects (each with 'gcs_uri' key)
+        
+    Returns:
+        Number of files successfully imported
+        
+    Example:
+        count = import_files_to_corpus(corpus_id, changed_files)
+    """
+    if local_index_service.is_local_index(corpus_id):
+        upload_count = local_index_service.import_files(corpus_id, files, CHUNK_SIZE, CHUNK_OVERLAP)
+        invalidate_retrieval_cache(corpus_id)
+        return upload_count
+    
+    if not project_id:
+        raise ValueError("GOOGLE_CLOUD_PROJECT environment variable not set")
+    
+    uri_to_name = {}
+    for file in files:
+        gcs_uri = file.get('gcs_uri')
+        file_id = file.get('id')
+        display_name = file.get('display_name', 'unknown')
+        
+        # Skip files that weren't uploaded to GCS
+        if not gcs_uri:
+            logger.warning(f"No GCS URI for file: {display_name} (ID: {file_id}), skipping")
+            continue
+        
+        # Validate GCS URI format
+        if not gcs_uri.startswith('gs://'):
+            logger.warning(f"Invalid GCS URI for file {display_name}: {gcs_uri}, skipping")
+            continue
+        
+        uri_to_name[gcs_uri] = display_name
+    
+    if not uri_to_name:
+        return 0
+    
+    uris = list(uri_to_name)
+    batches = [uris[i:i + IMPORT_BATCH_SIZE] for i in range(0, len(uris), IMPORT_BATCH_SIZE)]
+    logger.info(f"Importing {len(uris)} files in {len(batches)} batch(es) into {corpus_id}")
+    
+    # Step 1: Submit every batch and wait on the operations concurrently
+    with ThreadPoolExecutor(max_workers=max(1, min(IMPORT_WORKERS, len(batches)))) as executor:
+        futures = {executor.submit(_import_batch, corpus_id, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                response = future.result()
+                logger.info(
+                    f"Import batch of {len(batch)} done: {response.imported_rag_files_count} imported, "
+                    f"{response.failed_rag_files_count} failed, {response.skipped_rag_files_count} skipped"
+                )
+            except Exception as e:
+                logger.error(f"Import batch of {len(batch)} files failed: {str(e)}")
+    
+    # Step 2: Map the outcome back to individual files
+    imported = _imported_uris(corpus_id, set(uris))
+    missing = [uri for uri in uris if uri not in imported]
+    
+    # Step 3: Retry the stragglers one at a time
+    for gcs_uri in missing:
+        display_name = uri_to_name[gcs_uri]
+        try:
+            response = _import_batch(corpus_id, [gcs_uri])
+            if response.failed_rag_files_count:
+                raise RuntimeError(f"{response.failed_rag_files_count} file(s) failed to import")
+            imported.add(gcs_uri)
+            logger.info(f"✅ Successfully imported on retry: {display_name}")
+        except Exception as e:
+            logger.error(f"Failed to import file {display_name}: {str(e)}")
+    
+    upload_count = len(imported)
+    logger.info(f"Imported {upload_count}/{len(uris)} files into {corpus_id}")
+    invalidate_retrieval_cache(corpus_id)
+    return upload_count
+
+
+def count_imported_files(corpus_id: str, files: List[Dict]) -> int:
+    """
+    Counts how many of the given files are present in a corpus.
+    
+    Args:
+        corpus_id: The RAG corpus resource name (or local index ID)
+        files: List of file objects (each with 'gcs_uri' key)
+        
+    Returns:
+        Number of the files' GCS URIs found in the corpus
+        
+    Example:
+        corpus_id = create_and_provision_corpus(files)
+        if count_imported_files(corpus_id, files) < len(files):
+            ...
+    """
+    gcs_uris = {file['gcs_uri'] for file in files if file.get('gcs_uri')}
+    if local_index_service.is_local_index(corpus_id):
+        return len(gcs_uris & local_index_service.indexed_uris(corpus_id))
+    return len(_imported_uris(corpus_id, gcs_uris))
+
+
+def _import_batch(corpus_id: str, gcs_uris: List[str]):
+    """Runs one ImportRagFiles operation and waits for it to finish."""
+    # Note: Vertex AI RAG automatically indexes the content
+    return rag.import_files(
+        corpus_name=corpus_id,
+        paths=gcs_uris,
+        chunk_size=CHUNK_SIZE,  # Optimal chunk size for retrieval
+        chunk_overlap=CHUNK_OVERLAP  # Overlap for context continuity
+    )
+
+
+def _imported_uris(corpus_id: str, gcs_uris: set) -> set:
+    """Returns the subset of gcs_uris that are present as RAG files in the corpus."""
+    found = set()
+    try:
+        for rag_file in rag.list_files(corpus_name=corpus_id):
+            gcs_source = getattr(rag_file, 'gcs_source', None)
+            source_uris = list(getattr(gcs_source, 'uris', None) or [])
+            if source_uris:
+                found.update(gcs_uris.intersection(source_uris))
+            else:
+                found.update(uri for uri in gcs_uris if uri.split('/')[-1] == rag_file.display_name)
+    except Exception as e:
+        logger.error(f"Failed to list RAG files for {corpus_id}: {str(e)}")
+    return found
+
+
+def delete_files_from_corpus(corpus_id: str, gcs_uris: List[str]) -> int:
+    """
+    Deletes the RAG files that were imported from the given GCS URIs.
+    
+    Args:
+        corpus_id: The RAG corpus resource name
+        gcs_uris: GCS URIs the files were originally imported from
+        
+    Returns:
+        Number of RAG files deleted
+    """
+    if local_index_service.is_local_index(corpus_id):
+        delete_count = local_index_service.delete_files(corpus_id, gcs_uris)
+        invalidate_retrieval_cache(corpus_id)
+        return delete_count
+    
+    if not project_id:
+        raise ValueError("GOOGLE_CLOUD_PROJECT environment variable not set")
+    
+    if not gcs_uris:
+        return 0
+    
+    targets = set(gcs_uris)
+    delete_count = 0
+    
+    for rag_file in rag.list_files(corpus_name=corpus_id):
+        if not _rag_file_matches(rag_file, targets):
+            continue
+        try:
+            rag.delete_file(name=rag_file.name)
+            delete_count += 1
+            logger.info(f"Deleted RAG file: {rag_file.display_name}")
+        except Exception as e:
+            logger.error(f"Failed to delete RAG file {rag_file.name}: {str(e)}")
+    
+    logger.info(f"Deleted {delete_count} RAG file(s) for {len(targets)} GCS URI(s)")
+    invalidate_retrieval_cache(corpus_id)
+    return delete_count
+
+
+def _rag_file_matches(rag_file, gcs_uris: set) -> bool:
+    """
+    True if a RAG file was imported from one of the given GCS URIs.
+    Falls back to matching the display name (the GCS object's base name)
+    when the file carries no source URIs.
+    """
+    gcs_source = getattr(rag_file, 'gcs_source', None)
+    source_uris = list(getattr(gcs_source, 'uris', None) or [])
+    if source_uris:
+        return bool(gcs_uris.intersection(source_uris))
+    return rag_file.display_name in {uri.split('/')[-1] for uri in gcs_uris}
+
+
+def retrieve_context(corpus_id: str, query: str, top_k: int = 10, threshold: float = 0.5,
+                     corpus_version: int = None) -> Tuple[List[str], Dict]:
     """
     Retrieves relevant context chunks from the RAG corpus using vector similarity search.
     Does NOT generate answers - only returns raw context for use by other services.
@@ -126,6 +326,7 @@ def retrieve_context(corpus_id: str, query: str, top_k: int = 10, threshold: flo
         query: The search query text
         top_k: Number of most relevant chunks to retrieve (default: 10)
         threshold: Similarity threshold for filtering results (default: 0.5)
+        corpus_version: The course's corpus_version, to allow cached results (see retrieve_chunks)
         
     Returns:
         Tuple of (context_texts, source_names):
@@ -140,6 +341,58 @@ def retrieve_context(corpus_id: str, query: str, top_k: int = 10, threshold: flo
         # contexts = ["Machine learning is...", "ML involves..."]
         # sources = ["Chapter1.pdf", "Lecture2.pdf"]
     """
+    chunks = retrieve_chunks(corpus_id, query, top_k, threshold, corpus_version=corpus_version)
+    context_texts = [chunk['text'] for chunk in chunks]
+    sources = sources_from_chunks(chunks)
+    logger.info(f"Retrieved {len(context_texts)} context chunks from {len(sources)} sources")
+    return (context_texts, sources)
+
+
+def retrieve_chunks(corpus_id: str, query: str, top_k: int = 10, threshold: float = 0.5,
+                    corpus_version: int = None) -> List[Dict]:
+    """
+    Retrieves the most relevant chunks with their source and distance,
+    closest first. This is what retrieve_context is built on; use it when
+    the caller needs to know which chunk came from where (e.g. context packing).
+    
+    Args:
+        corpus_id: The RAG corpus resource name (or local index ID)
+        query: The search query text
+        top_k: Number of most relevant chunks to retrieve (default: 10)
+        threshold: Similarity threshold for filtering results (default: 0.5)
+        corpus_version: The course document's corpus_version; results are only
+                        cached when it is given
+        
+    Returns:
+        List of {'text', 'source_uri', 'distance'} dicts
+        
+    Example:
+        chunks = retrieve_chunks(corpus_name, "What is recursion?", corpus_version=course.get('corpus_version', 0))
+        # [{'text': 'Recursion is...', 'source_uri': 'gs://.../Lecture3.pdf', 'distance': 0.21}, ...]
+    
+    Results are cached (LRU + TTL, plus the optional shared disk layer) by
+    corpus, corpus_version, normalized query, top_k and threshold. A sync
+    bumps corpus_version on the course document, so every worker moves to
+    new keys as soon as it reads the updated course; nothing process-local
+    has to be invalidated. Callers without a version (e.g. the job pipeline,
+    which retrieves while the corpus is changing) always hit the backend.
+    """
+    if corpus_version is None:
+        return _retrieve_chunks_uncached(corpus_id, query, top_k, threshold)
+
+    key = _retrieval_cache_key(corpus_id, corpus_version, query, top_k, threshold)
+    chunks = _cache_get(corpus_id, key)
+    if chunks is None:
+        chunks = _retrieve_chunks_uncached(corpus_id, query, top_k, threshold)
+        _cache_put(corpus_id, key, chunks)
+    return [dict(chunk) for chunk in chunks]
+
+
+def _retrieve_chunks_uncached(corpus_id: str, query: str, top_k: int, threshold: float) -> List[Dict]:
+    """Runs the retrieval against the corpus's backend."""
+    if local_index_service.is_local_index(corpus_id):
+        return local_index_service.retrieve_chunks(corpus_id, query, top_k, threshold)
+    
     if not project_id:
         raise ValueError("GOOGLE_CLOUD_PROJECT environment variable not set")
     
@@ -158,35 +411,154 @@ def retrieve_context(corpus_id: str, query: str, top_k: int = 10, threshold: flo
             vector_distance_threshold=threshold,
         )
         
-        # Extract context text chunks
-        contexts = response.contexts.contexts
-        context_texts = [context.text for context in contexts]
-        
-        # Extract unique source files from source URI
-        source_names = set()
-        sources = []
-        for context in contexts:
-            if hasattr(context, 'source_uri') and context.source_uri:
-                # Source is in format like "gs://bucket/corpus/file.pdf"
-                source_path = context.source_uri
-                filename = source_path.split('/')[-1] if '/' in source_path else source_path
-                if filename and filename not in source_names:
-                    source_names.add(filename)
-                    sources.append({
-                        'filename': filename,
-                        'source_uri': context.source_uri,
-                        'distance': context.distance
-                    })
-        
-        logger.info(f"Retrieved {len(context_texts)} context chunks from {len(sources)} sources")
-        
-        return (context_texts, sources)
+        return [
+            {
+                'text': context.text,
+                'source_uri': getattr(context, 'source_uri', None) or '',
+                'distance': context.distance
+            }
+            for context in response.contexts.contexts
+        ]
         
     except Exception as e:
         logger.error(f"Failed to retrieve context from RAG corpus: {str(e)}")
         raise
 
 
+def sources_from_chunks(chunks: List[Dict]) -> List[Dict]:
+    """
+    Collapses retrieved chunks into one source entry per file, keeping the
+    first (closest) chunk's distance.
+    
+    Returns:
+        List of {'filename', 'source_uri', 'distance'} dicts
+    """
+    source_names = set()
+    sources = []
+    for chunk in chunks:
+        # Source is in format like "gs://bucket/corpus/file.pdf"
+        source_path = chunk.get('source_uri')
+        if not source_path:
+            continue
+        filename = source_path.split('/')[-1] if '/' in source_path else source_path
+        if filename and filename not in source_names:
+            source_names.add(filename)
+            sources.append({
+                'filename': filename,
+                'source_uri': source_path,
+                'distance': chunk['distance']
+            })
+    return sources
+
+
+# ============================================================================
+# RETRIEVAL CACHE
+# ============================================================================
+
+def get_retrieval_cache_stats() -> dict:
+    """
+    Returns hit/miss counters for the retrieval cache.
+    
+    Returns:
+        Dict with 'hits' (in-memory), 'disk_hits', 'misses', 'size' and 'hit_rate'
+    """
+    with _retrieval_cache_lock:
+        stats = dict(_retrieval_stats)
+        stats['size'] = len(_retrieval_cache)
+    lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+    stats['hit_rate'] = (stats['hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+    return stats
+
+
+def invalidate_retrieval_cache(corpus_id: str = None) -> None:
+    """
+    Drops cached retrievals for a corpus (or for every corpus if corpus_id is None).
+    Called automatically when files are imported into or deleted from a corpus
+    to free space early; correctness comes from the corpus_version in the
+    cache key, not from this call.
+    
+    Args:
+        corpus_id: The RAG corpus resource name, or None to clear everything
+    """
+    with _retrieval_cache_lock:
+        if corpus_id is None:
+            _retrieval_cache.clear()
+        else:
+            for key in [k for k in _retrieval_cache if k[0] == corpus_id]:
+                _retrieval_cache.pop(key, None)
+    
+    if not RETRIEVAL_CACHE_DIR:
+        return
+    corpus_dirs = [_cache_dir(corpus_id)] if corpus_id else glob.glob(os.path.join(RETRIEVAL_CACHE_DIR, '*'))
+    for corpus_dir in corpus_dirs:
+        try:
+            for path in glob.glob(os.path.join(corpus_dir, '*.json')):
+                os.remove(path)
+        except OSError as e:
+            logger.warning(f"Failed to clear retrieval cache in {corpus_dir}: {e}")
+
+
+def _normalize_query(query: str) -> str:
+    return ' '.join(query.lower().split()).rstrip('?!. ')
+
+
+def _retrieval_cache_key(corpus_id: str, corpus_version: int, query: str, top_k: int, threshold: float) -> tuple:
+    return (corpus_id, corpus_version, _normalize_query(query), top_k, threshold)
+
+
+def _cache_dir(corpus_id: str) -> str:
+    return os.path.join(RETRIEVAL_CACHE_DIR, hashlib.sha256(corpus_id.encode('utf-8')).hexdigest()[:32])
+
+
+def _disk_path(corpus_id: str, key: tuple) -> str:
+    digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+    return os.path.join(_cache_dir(corpus_id), f"{digest}.json")
+
+
+def _cache_get(corpus_id: str, key: tuple):
+    with _retrieval_cache_lock:
+        chunks = _retrieval_cache.get(key)
+        if chunks is not None:
+            _retrieval_stats['hits'] += 1
+            return chunks
+    
+    if RETRIEVAL_CACHE_DIR:
+        try:
+            with open(_disk_path(corpus_id, key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            if time.time() - entry['created_at'] < RETRIEVAL_CACHE_TTL:
+                with _retrieval_cache_lock:
+                    _retrieval_cache[key] = entry['chunks']
+                    _retrieval_stats['disk_hits'] += 1
+                return entry['chunks']
+        except (OSError, ValueError, KeyError):
+            pass
+    
+    with _retrieval_cache_lock:
+        _retrieval_stats['misses'] += 1
+    return None
+
+
+def _cache_put(corpus_id: str, key: tuple, chunks: List[Dict]) -> None:
+    with _retrieval_cache_lock:
+        _retrieval_cache[key] = chunks
+    
+    if RETRIEVAL_CACHE_DIR:
+        try:
+            os.makedirs(_cache_dir(corpus_id), exist_ok=True)
+            _write_json(_disk_path(corpus_id, key), {'created_at': time.time(), 'chunks': chunks})
+        except (OSError, TypeError) as e:
+            logger.warning(f"Failed to write retrieval cache entry: {e}")
+
+
+def _write_json(path: str, data: dict) -> None:
+    """Writes a JSON file atomically (other workers may be reading it)."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
 if __name__ == "__main__":
     # Load environment variables from root .env file
     from dotenv import load_dotenv
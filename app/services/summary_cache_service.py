@@ -0,0 +1,144 @@
+"""
+Summary Cache Service
+Content-addressed cache of Gemini file summaries.
+
+This service is responsible for:
+- Keying summaries by (content hash, prompt version, model name)
+- A local disk layer (app/data/summary_cache/) for the running instance
+- A Firestore layer (summary_cache collection) shared across instances
+
+Because the key only depends on the file's bytes, an unchanged PDF is
+never re-sent to Gemini, whether the course is re-initialized or the
+same file is cross-listed in another course.
+
+Dependencies:
+- firestore_service: For the shared cache layer
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from . import firestore_service
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'summary_cache'
+)
+
+
+def content_hash(file_path: str) -> str:
+    """
+    Computes the md5 of a local file (the same digest Canvas reports as 'md5').
+
+    Args:
+        file_path: Local file path
+
+    Returns:
+        Hex md5 digest of the file contents
+    """
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def prompt_version(prompt: str) -> str:
+    """
+    Returns a short version tag for a prompt, so editing the prompt
+    naturally invalidates every summary produced with the old one.
+    """
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+
+
+def cache_key(file_hash: str, prompt: str, model_name: str) -> str:
+    """
+    Builds the cache key for a (content hash, prompt version, model name) triple.
+
+    Example:
+        key = cache_key("9e107d9d372bb6826bd81d3542a419d6", SUMMARIZE_PROMPT, "gemini-2.5-flash-lite")
+    """
+    raw = f"{file_hash}|{prompt_version(prompt)}|{model_name}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def get_summary(key: str) -> str:
+    """
+    Looks up a cached summary, checking disk first and then Firestore.
+    A Firestore hit is written back to disk.
+
+    Args:
+        key: Cache key from cache_key()
+
+    Returns:
+        The cached summary, or None on a miss (or if the cache is unavailable)
+    """
+    entry = _read_disk(key)
+    if entry:
+        return entry.get('summary')
+
+    try:
+        entry = firestore_service.get_cached_summary(key)
+    except Exception as e:
+        logger.warning(f"Summary cache lookup failed for {key[:12]}: {e}")
+        return None
+
+    if entry and entry.get('summary'):
+        _write_disk(key, entry)
+        return entry['summary']
+    return None
+
+
+def put_summary(key: str, summary: str, file_hash: str, model_name: str) -> None:
+    """
+    Stores a summary in both cache layers. Failures are logged, never raised.
+
+    Args:
+        key: Cache key from cache_key()
+        summary: The summary text
+        file_hash: Content hash of the summarized file (stored for debugging)
+        model_name: Model that produced the summary
+    """
+    entry = {
+        'summary': summary,
+        'content_hash': file_hash,
+        'model_name': model_name,
+        'created_at': time.time()
+    }
+    _write_disk(key, entry)
+    try:
+        firestore_service.save_cached_summary(key, entry)
+    except Exception as e:
+        logger.warning(f"Failed to store summary {key[:12]} in Firestore: {e}")
+
+
+# ============================================================================
+# DISK LAYER
+# ============================================================================
+
+def _disk_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def _read_disk(key: str) -> dict:
+    try:
+        with open(_disk_path(key), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_disk(key: str, entry: dict) -> None:
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f"{_disk_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, _disk_path(key))
+    except OSError as e:
+        logger.warning(f"Failed to write summary cache file for {key[:12]}: {e}")
@@ -149,6 +149,9 @@ async function startAutoGeneration() {
             throw new Error(result.error || 'Generation failed');
         }
         
+        // Initialization runs as a background job - poll until it finishes
+        await waitForJob(result.job_id, addLogLine);
+        
         // Course initialization successful - redirect to launch endpoint
         window.location.href = `/launch?course_id=${COURSE_ID}&user_id=${'12'}&role=${USER_ROLES || ''}`;
         
@@ -167,6 +170,34 @@ async function startAutoGeneration() {
     }
 }
 
+// Poll a background job until it completes, logging each stage as it starts
+async function waitForJob(jobId, onStage, intervalMs = 3000) {
+    let lastStage = null;
+    
+    while (true) {
+        const response = await fetch(`/api/jobs/${jobId}`);
+        const job = await response.json();
+        
+        if (!response.ok) {
+            throw new Error(job.error || 'Failed to check job status');
+        }
+        
+        if (job.current_stage && job.current_stage !== lastStage) {
+            lastStage = job.current_stage;
+            onStage(`Running: ${job.current_stage.replace('_', ' ')}`);
+        }
+        
+        if (job.status === 'COMPLETE') {
+            return job.result;
+        }
+        if (job.status === 'ERROR') {
+            throw new Error(job.error_message || 'Generation failed');
+        }
+        
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+}
+
 // Convert knowledge graph API response to topics editor format
 function convertGraphToTopics(apiResponse) {
     const nodes = apiResponse.kg_nodes || [];
@@ -0,0 +1,73 @@
+/**
+ * CHAT STREAMING
+ * Shared /api/chat/stream client for the student and teacher views.
+ * Expects the page to define COURSE_ID before this script loads.
+ */
+
+/**
+ * Asks a question through /api/chat/stream (Server-Sent Events over a POST).
+ * Calls onSources(sources) when retrieval finishes and onToken(answerSoFar)
+ * each time more answer text arrives.
+ * Resolves with { answer, sources, log_doc_id } once the stream is done.
+ */
+async function streamChat(query, { onSources, onToken } = {}) {
+    const response = await fetch('/api/chat/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({
+            course_id: COURSE_ID,
+            query: query
+        })
+    });
+
+    if (!response.ok || !response.body) {
+        throw new Error(`Chat request failed: ${response.statusText}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    const result = { answer: '', sources: [], log_doc_id: null };
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // SSE events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const { event, data } = parseSseEvent(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+
+            if (event === 'sources') {
+                result.sources = data || [];
+                if (onSources) onSources(result.sources);
+            } else if (event === 'token') {
+                result.answer += data.text;
+                if (onToken) onToken(result.answer);
+            } else if (event === 'done') {
+                result.log_doc_id = data.log_doc_id;
+            } else if (event === 'error') {
+                throw new Error(data.message || 'Chat stream failed');
+            }
+        }
+    }
+
+    return result;
+}
+
+function parseSseEvent(block) {
+    let event = 'message';
+    const dataLines = [];
+    block.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+            event = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            dataLines.push(line.slice(5).trim());
+        }
+    });
+    return { event, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : null };
+}
@@ -662,34 +662,37 @@ async function sendMessage() {
     // Show typing indicator
     typingIndicator.classList.remove('hidden');
 
+    // Bot bubble that fills in as the answer streams
+    let streamingText = null;
+
     try {
-        const response = await fetch('/api/chat', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                course_id: COURSE_ID,
-                query: query
-            })
+        const data = await streamChat(query, {
+            onToken: (answerSoFar) => {
+                if (!streamingText) {
+                    typingIndicator.classList.add('hidden');
+                    streamingText = addStreamingMessage();
+                }
+                streamingText.innerHTML = renderMarkdownWithMath(answerSoFar);
+                chatMessagesContainer.scrollTop = chatMessagesContainer.scrollHeight;
+            }
         });
 
-        if (!response.ok) {
-            throw new Error(`Chat request failed: ${response.statusText}`);
+        // Replace the streaming bubble with the final message (sources + rating)
+        if (streamingText) {
+            streamingText.closest('.message').remove();
         }
-
-        const data = await response.json();
-
-        // Add bot response
         addMessage({
             role: 'assistant',
-            content: data.answer || data.response || 'I received your question but had trouble generating an answer.',
+            content: data.answer || 'I received your question but had trouble generating an answer.',
             sources: data.sources || [],
             log_doc_id: data.log_doc_id  // Include log_doc_id for rating
         });
 
     } catch (error) {
         console.error('Error sending message:', error);
+        if (streamingText) {
+            streamingText.closest('.message').remove();
+        }
         addMessage({
             role: 'assistant',
             content: 'Sorry, I encountered an error processing your question. Please try again.',
@@ -733,33 +736,32 @@ async function sendModalMessage() {
     // Show typing indicator
     showModalTypingIndicator();
 
+    // Bot message that fills in as the answer streams
+    let streamingContent = null;
+
     try {
-        const response = await fetch('/api/chat', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                course_id: COURSE_ID,
-                query: contextualQuery
-            })
+        const data = await streamChat(contextualQuery, {
+            onToken: (answerSoFar) => {
+                if (!streamingContent) {
+                    hideModalTypingIndicator();
+                    streamingContent = addModalMessage({ role: 'assistant', content: '' });
+                }
+                streamingContent.innerHTML = renderMarkdownWithMath(answerSoFar);
+                modalChatMessages.scrollTop = modalChatMessages.scrollHeight;
+            }
         });
 
-        if (!response.ok) {
-            throw new Error(`Chat request failed: ${response.statusText}`);
-        }
-
-        const data = await response.json();
-
         // Hide typing indicator
         hideModalTypingIndicator();
 
-        // Add bot response
-        addModalMessage({
-            role: 'assistant',
-            content: data.answer || data.response || 'I received your question but had trouble generating an answer.',
-            sources: data.sources || []
-        });
+        if (!streamingContent) {
+            // Add bot response
+            addModalMessage({
+                role: 'assistant',
+                content: data.answer || 'I received your question but had trouble generating an answer.',
+                sources: data.sources || []
+            });
+        }
 
     } catch (error) {
         console.error('Error sending modal message:', error);
@@ -844,6 +846,27 @@ function addModalMessage(message) {
 
     // Scroll to bottom
     modalChatMessages.scrollTop = modalChatMessages.scrollHeight;
+
+    return content;
+}
+
+/**
+ * Creates an empty bot message bubble for a streaming answer.
+ * Returns the text element to fill in as tokens arrive.
+ */
+function addStreamingMessage() {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'message bot-message';
+
+    const content = document.createElement('div');
+    content.className = 'message-content';
+
+    const text = document.createElement('div');
+    content.appendChild(text);
+    messageDiv.appendChild(content);
+    chatMessagesContainer.appendChild(messageDiv);
+
+    return text;
 }
 
 function addMessage(message) {
@@ -696,33 +696,32 @@ async function sendModalMessage() {
     // Show typing indicator
     showModalTypingIndicator();
 
+    // Bot message that fills in as the answer streams
+    let streamingContent = null;
+
     try {
-        const response = await fetch('/api/chat', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                course_id: COURSE_ID,
-                query: contextualQuery
-            })
+        const data = await streamChat(contextualQuery, {
+            onToken: (answerSoFar) => {
+                if (!streamingContent) {
+                    hideModalTypingIndicator();
+                    streamingContent = addModalMessage({ role: 'assistant', content: '' });
+                }
+                streamingContent.innerHTML = renderMarkdownWithMath(answerSoFar);
+                modalChatMessages.scrollTop = modalChatMessages.scrollHeight;
+            }
         });
 
-        if (!response.ok) {
-            throw new Error(`Chat request failed: ${response.statusText}`);
-        }
-
-        const data = await response.json();
-
         // Hide typing indicator
         hideModalTypingIndicator();
 
-        // Add bot response
-        addModalMessage({
-            role: 'assistant',
-            content: data.answer || data.response || 'I received your question but had trouble generating an answer.',
-            sources: data.sources || []
-        });
+        if (!streamingContent) {
+            // Add bot response
+            addModalMessage({
+                role: 'assistant',
+                content: data.answer || 'I received your question but had trouble generating an answer.',
+                sources: data.sources || []
+            });
+        }
 
     } catch (error) {
         console.error('Error sending modal message:', error);
@@ -807,6 +806,8 @@ function addModalMessage(message) {
 
     // Scroll to bottom
     modalChatMessages.scrollTop = modalChatMessages.scrollHeight;
+
+    return content;
 }
 
 function addMessage(message) {
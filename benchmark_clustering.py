@@ -0,0 +1,79 @@
+"""
+Benchmark for cluster-count selection in analytics_reporting_service.
+Compares the original model selection (one full-dimension MiniBatchKMeans
+fit per k, then a final refit for the chosen k) against cluster_with_elbow
+(PCA-reduced, subsampled search that reuses the chosen model).
+
+Synthetic 768-dimension query embeddings are used, so no API calls or
+Firestore access are made.
+
+Usage:
+    python benchmark_clustering.py                          # default sizes
+    python benchmark_clustering.py --sizes 1000 5000 20000  # wall time vs. number of queries
+    python benchmark_clustering.py --jobs -1                # evaluate k values on all cores
+"""
+import argparse
+import time
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+from sklearn.cluster import MiniBatchKMeans
+from app.services import analytics_reporting_service
+
+DIMENSIONS = 768
+
+
+def make_queries(n_queries: int, n_topics: int = 8, seed: int = 0) -> np.ndarray:
+    """Unit-length vectors scattered around n_topics random topic directions."""
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(n_topics, DIMENSIONS))
+    vectors = topics[rng.integers(n_topics, size=n_queries)] + rng.normal(scale=0.6, size=(n_queries, DIMENSIONS))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def legacy_cluster(vectors: np.ndarray, max_clusters: int) -> int:
+    """The original approach: full-dimension fits for every k, then a refit."""
+    max_k = min(max_clusters, len(vectors) - 1)
+    inertias = [
+        MiniBatchKMeans(n_clusters=k, random_state=42, batch_size=100).fit(vectors).inertia_
+        for k in range(1, max_k + 1)
+    ]
+    normalized = (np.array(inertias) - min(inertias)) / (max(inertias) - min(inertias) + 1e-10)
+    optimal_k = min(int(np.argmax(np.diff(np.diff(normalized)))) + 2, max_k - 1) + 1
+    MiniBatchKMeans(n_clusters=optimal_k, random_state=42, batch_size=100).fit_predict(vectors)
+    return optimal_k
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 2000, 10000], help='Numbers of queries to test')
+    parser.add_argument('--max-clusters', type=int, default=15, help='Largest k evaluated')
+    parser.add_argument('--jobs', type=int, default=analytics_reporting_service.ELBOW_JOBS,
+                        help='joblib workers for the new search (-1 for all cores)')
+    args = parser.parse_args()
+
+    analytics_reporting_service.ELBOW_JOBS = args.jobs
+
+    print(f"Elbow search + clustering, k=1..{args.max_clusters}, {DIMENSIONS} dims "
+          f"(PCA {analytics_reporting_service.ELBOW_COMPONENTS}, sample {analytics_reporting_service.ELBOW_SAMPLE_SIZE}, "
+          f"jobs {args.jobs})")
+    print(f"  {'queries':>8}   {'original':>10}   {'new':>10}   {'speedup':>7}   k (original / new)")
+    for n_queries in args.sizes:
+        vectors = make_queries(n_queries)
+        legacy_k, legacy_time = timed(lambda: legacy_cluster(vectors, args.max_clusters))
+        (new_k, _, _), new_time = timed(lambda: analytics_reporting_service.cluster_with_elbow(vectors, args.max_clusters))
+        print(f"  {n_queries:>8}   {legacy_time:>9.2f}s   {new_time:>9.2f}s   {legacy_time / new_time:>6.1f}x   {legacy_k} / {new_k}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Microbenchmark for Gemini model reuse.
+Compares constructing a model per call (the old behaviour) against the
+shared instances returned by gemini_service's model registry.
+
+Usage:
+    python benchmark_models.py              # client construction only (no API calls)
+    python benchmark_models.py --live 20    # also time 20 real embedding requests each way
+
+TextEmbeddingModel.from_pretrained looks the model up on Vertex AI, so the
+embedding cases need Google Cloud credentials; without them they are
+reported as skipped rather than timed.
+"""
+import argparse
+import statistics
+import time
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+from google.auth.exceptions import GoogleAuthError
+from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
+from app.services import gemini_service
+from app.services.gemini_service import GenerativeModel
+
+EMBEDDING_MODEL = "text-embedding-004"
+
+
+def time_calls(fn, iterations: int) -> list:
+    """Runs fn `iterations` times and returns the per-call durations in milliseconds."""
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def report(label: str, durations: list) -> None:
+    print(f"  {label:<32} mean {statistics.mean(durations):9.3f} ms   "
+          f"p50 {statistics.median(durations):9.3f} ms   max {max(durations):9.3f} ms")
+
+
+def embed_fresh(text: str) -> None:
+    model = TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL)
+    model.get_embeddings([TextEmbeddingInput(text=text, task_type="RETRIEVAL_QUERY")])
+
+
+def embed_shared(text: str) -> None:
+    gemini_service.get_embeddings([text], model_name=EMBEDDING_MODEL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200, help='Construction iterations per case')
+    parser.add_argument('--live', type=int, default=0, metavar='N', help='Also time N real embedding requests per case')
+    args = parser.parse_args()
+
+    gemini_service.clear_model_registry()
+
+    print(f"Model construction ({args.iterations} iterations)")
+    report("GenerativeModel() per call", time_calls(lambda: GenerativeModel(gemini_service.DEFAULT_MODEL), args.iterations))
+    report("get_generative_model()", time_calls(lambda: gemini_service.get_generative_model(), args.iterations))
+    try:
+        report("from_pretrained() per call", time_calls(lambda: TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL), args.iterations))
+        report("get_embedding_model()", time_calls(lambda: gemini_service.get_embedding_model(EMBEDDING_MODEL), args.iterations))
+    except GoogleAuthError:
+        print("  embedding model cases skipped: no Google Cloud credentials (not measured)")
+        return
+
+    if args.live:
+        print(f"\nEmbedding requests ({args.live} iterations)")
+        embed_shared("warm-up")
+        report("fresh model per request", time_calls(lambda: embed_fresh("What is recursion?"), args.live))
+        report("shared model", time_calls(lambda: embed_shared("What is recursion?"), args.live))
+
+
+if __name__ == "__main__":
+    main()
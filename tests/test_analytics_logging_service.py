@@ -1,5 +1,6 @@
 import unittest
 from unittest.mock import patch, MagicMock
+import numpy as np
 import sys
 import os
 
@@ -8,15 +9,18 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 from app.services import analytics_logging_service
 
+decode = analytics_logging_service.decode_query_vector
+
 class TestAnalyticsLoggingService(unittest.TestCase):
     """Test suite for Analytics Logging service functions"""
 
+    @patch('app.services.analytics_logging_service.LOG_FLUSH_INTERVAL', 0.01)
     @patch('app.services.analytics_logging_service.firestore_service')
     @patch('app.services.analytics_logging_service.gemini_service')
     def test_log_chat_query(self, mock_gemini_service, mock_firestore_service):
-        """Test log_chat_query function"""
-        mock_gemini_service.get_embedding.return_value = [0.1, 0.2, 0.3]
-        mock_firestore_service.log_analytics_event.return_value = "doc_id_123"
+        """Test log_chat_query returns a pre-allocated ID and the flusher writes the event"""
+        mock_gemini_service.get_embeddings_batch.return_value = [[0.1, 0.2, 0.3]]
+        mock_firestore_service.new_analytics_doc_id.return_value = "doc_id_123"
 
         doc_id = analytics_logging_service.log_chat_query(
             course_id="course1",
@@ -26,21 +30,130 @@ class TestAnalyticsLoggingService(unittest.TestCase):
         )
 
         self.assertEqual(doc_id, "doc_id_123")
-        mock_gemini_service.get_embedding.assert_called_with(
-            text="What is a test?",
-            model_name="text-embedding-004",
-            task_type="RETRIEVAL_QUERY"
+        self.assertTrue(analytics_logging_service.flush_chat_logs(timeout=5))
+        mock_gemini_service.get_embeddings_batch.assert_called_with(
+            ["What is a test?"],
+            task_type="RETRIEVAL_QUERY",
+            model_name="text-embedding-004"
         )
         
-        # Get the call arguments from the mock
-        call_args = mock_firestore_service.log_analytics_event.call_args[0][0]
+        # Get the batched events from the mock
+        events = mock_firestore_service.log_analytics_events_batch.call_args[0][0]
+        self.assertEqual(len(events), 1)
+        logged_id, call_args = events[0]
         
         # Assertions on the logged data
+        self.assertEqual(logged_id, 'doc_id_123')
         self.assertEqual(call_args['type'], 'chat')
         self.assertEqual(call_args['course_id'], 'course1')
         self.assertEqual(call_args['query_text'], 'What is a test?')
-        self.assertEqual(call_args['query_vector'], [0.1, 0.2, 0.3])
+        self.assertIsInstance(call_args['query_vector'], bytes)
+        np.testing.assert_allclose(decode(call_args['query_vector']), [0.1, 0.2, 0.3], rtol=1e-6)
+        self.assertNotIn('rating', call_args)
+
+    @patch('app.services.analytics_logging_service.LOG_FLUSH_INTERVAL', 0.5)
+    @patch('app.services.analytics_logging_service.firestore_service')
+    @patch('app.services.analytics_logging_service.gemini_service')
+    def test_log_chat_query_batches_events(self, mock_gemini_service, mock_firestore_service):
+        """Test queued chat events are embedded and written together"""
+        mock_gemini_service.get_embeddings_batch.side_effect = lambda texts, **kwargs: [[float(i)] for i in range(len(texts))]
+        mock_firestore_service.new_analytics_doc_id.side_effect = ["doc_a", "doc_b", "doc_c"]
+
+        for query in ["Q1", "Q2", "Q3"]:
+            analytics_logging_service.log_chat_query(course_id="course1", query_text=query)
+
+        self.assertTrue(analytics_logging_service.flush_chat_logs(timeout=5))
+        mock_gemini_service.get_embeddings_batch.assert_called_once()
+        events = mock_firestore_service.log_analytics_events_batch.call_args[0][0]
+        self.assertEqual([doc_id for doc_id, _ in events], ["doc_a", "doc_b", "doc_c"])
+        self.assertEqual([decode(data['query_vector']).tolist() for _, data in events], [[0.0], [1.0], [2.0]])
+
+    @patch('app.services.analytics_logging_service.LOG_FLUSH_INTERVAL', 0.01)
+    @patch('app.services.analytics_logging_service.firestore_service')
+    @patch('app.services.analytics_logging_service.gemini_service')
+    def test_log_chat_query_embedding_failure(self, mock_gemini_service, mock_firestore_service):
+        """Test events are still written (without a vector) if embedding fails"""
+        mock_gemini_service.get_embeddings_batch.return_value = [None]
+        mock_firestore_service.new_analytics_doc_id.return_value = "doc_id_789"
+
+        analytics_logging_service.log_chat_query(course_id="course1", query_text="Q")
+
+        self.assertTrue(analytics_logging_service.flush_chat_logs(timeout=5))
+        events = mock_firestore_service.log_analytics_events_batch.call_args[0][0]
+        self.assertIsNone(events[0][1]['query_vector'])
+
+    @patch('app.services.analytics_logging_service.LOG_FLUSH_INTERVAL', 0.01)
+    @patch('app.services.analytics_logging_service.firestore_service')
+    @patch('app.services.analytics_logging_service.gemini_service')
+    def test_log_chat_query_reuses_query_vector(self, mock_gemini_service, mock_firestore_service):
+        """Test a vector computed by the caller is stored without re-embedding"""
+        mock_firestore_service.new_analytics_doc_id.return_value = "doc_id_321"
+
+        analytics_logging_service.log_chat_query(course_id="course1", query_text="Q", query_vector=[0.5, 0.5])
+
+        self.assertTrue(analytics_logging_service.flush_chat_logs(timeout=5))
+        mock_gemini_service.get_embeddings_batch.assert_not_called()
+        events = mock_firestore_service.log_analytics_events_batch.call_args[0][0]
+        self.assertEqual(decode(events[0][1]['query_vector']).tolist(), [0.5, 0.5])
+
+
+    @patch('app.services.analytics_logging_service.firestore_service')
+    @patch('app.services.analytics_logging_service.gemini_service')
+    def test_backfill_query_vectors(self, mock_gemini_service, mock_firestore_service):
+        """Test only events without a vector are embedded, in one batch call, and written back"""
+        events = [
+            {'doc_id': 'a', 'query_text': 'Q1', 'query_vector': [0.1]},
+            {'doc_id': 'b', 'query_text': 'Q2', 'query_vector': None},
+            {'doc_id': 'c', 'query_text': 'Q3'},
+            {'doc_id': 'd', 'query_text': 'Q4'},
+        ]
+        mock_firestore_service.get_analytics_events.return_value = events
+        mock_gemini_service.get_embeddings_batch.return_value = [[0.2], None, [0.4]]
+
+        count = analytics_logging_service.backfill_query_vectors("course1")
+
+        self.assertEqual(count, 2)
+        mock_gemini_service.get_embeddings_batch.assert_called_once_with(
+            ['Q2', 'Q3', 'Q4'], task_type="RETRIEVAL_QUERY", model_name="text-embedding-004"
+        )
+        updates = mock_firestore_service.log_analytics_events_batch.call_args[0][0]
+        self.assertEqual([doc_id for doc_id, _ in updates], ['b', 'd'])
+        np.testing.assert_allclose([decode(data['query_vector'])[0] for _, data in updates], [0.2, 0.4], rtol=1e-6)
+        self.assertEqual(events[1]['query_vector'], [0.2])
+
+    @patch('app.services.analytics_logging_service.firestore_service')
+    @patch('app.services.analytics_logging_service.gemini_service')
+    def test_backfill_query_vectors_fetches_missing_texts(self, mock_gemini_service, mock_firestore_service):
+        """Test events fetched with a vector-only projection get their text read by ID"""
+        events = [{'doc_id': 'a', 'query_vector': [0.1]}, {'doc_id': 'b'}]
+        mock_firestore_service.get_analytics_events_by_ids.return_value = [{'doc_id': 'b', 'query_text': 'Q2'}]
+        mock_gemini_service.get_embeddings_batch.return_value = [[0.2]]
+
+        count = analytics_logging_service.backfill_query_vectors("course1", events)
+
+        self.assertEqual(count, 1)
+        mock_firestore_service.get_analytics_events_by_ids.assert_called_once_with(['b'], fields=['query_text'])
+        mock_gemini_service.get_embeddings_batch.assert_called_once_with(
+            ['Q2'], task_type="RETRIEVAL_QUERY", model_name="text-embedding-004"
+        )
+        self.assertEqual(events[1]['query_vector'], [0.2])
+
+    def test_query_vector_codec_round_trip(self):
+        """Test each encoding decodes back to (approximately) the original vector"""
+        vector = np.random.default_rng(0).normal(size=768).astype(np.float32)
+        for encoding, atol in [('float32', 0), ('float16', 1e-2), ('int8', 3e-2)]:
+            blob = analytics_logging_service.encode_query_vector(vector, encoding=encoding)
+            decoded = decode(blob)
+            self.assertEqual(decoded.dtype, np.float32)
+            np.testing.assert_allclose(decoded, vector, atol=atol, err_msg=encoding)
+        self.assertEqual(len(analytics_logging_service.encode_query_vector(vector, encoding='int8')), 8 + 768)
 
+    def test_decode_query_vector_legacy_and_empty(self):
+        """Test legacy float arrays are still readable and missing vectors decode to None"""
+        self.assertEqual(decode([0.5, 0.25]).tolist(), [0.5, 0.25])
+        self.assertIsNone(decode(None))
+        self.assertIsNone(decode([]))
+        self.assertIsNone(analytics_logging_service.encode_query_vector(None))
 
     @patch('app.services.analytics_logging_service.firestore_service')
     def test_log_kg_node_click(self, mock_firestore_service):
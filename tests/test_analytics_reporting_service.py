@@ -27,12 +27,15 @@ class TestAnalyticsReportingService(unittest.TestCase):
         ]
         mock_firestore_service.get_analytics_events.return_value = mock_events
         mock_firestore_service.get_analytics_events_by_ids.return_value = mock_events
+        mock_firestore_service.get_cluster_state.return_value = None
 
         # Mock the clustering results
         mock_perform_clustering.return_value = (np.array([0, 1, 0, 0, 1]), np.array([[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]]))
 
-        # Mock the AI labeling
-        mock_gemini_service.generate_answer.side_effect = ["Test Questions", "General Questions"]
+        # Mock the AI labeling (clusters are labeled concurrently, so answer by prompt content)
+        mock_gemini_service.generate_answer.side_effect = (
+            lambda prompt: "Test Questions" if "What is a test?" in prompt else "General Questions"
+        )
 
         report = analytics_reporting_service.run_daily_analytics("course1", n_clusters=2, auto_detect_clusters=False)
 
@@ -45,7 +48,168 @@ class TestAnalyticsReportingService(unittest.TestCase):
         self.assertEqual(report['clusters']['Test Questions']['count'], 3)
         self.assertEqual(report['clusters']['General Questions']['count'], 2)
         mock_firestore_service.save_analytics_report.assert_called_once()
+        # Events are read once, with only the fields the report needs
+        mock_firestore_service.get_analytics_events.assert_called_once_with(
+            "course1", event_type='chat', fields=['query_vector', 'query_text', 'rating', 'timestamp']
+        )
+        mock_firestore_service.get_analytics_events_by_ids.assert_not_called()
+        # The fitted state is persisted for later incremental runs
+        state = mock_firestore_service.save_cluster_state.call_args[0][1]
+        self.assertEqual(state['n_clusters'], 2)
+        self.assertEqual(state['counts'], [3, 2])
+        self.assertEqual([c['label'] for c in state['clusters']], ["Test Questions", "General Questions"])
 
+    @patch('app.services.analytics_reporting_service.firestore_service')
+    @patch('app.services.analytics_reporting_service.gemini_service')
+    def test_run_incremental_analytics(self, mock_gemini_service, mock_firestore_service):
+        """Test only events after the watermark are clustered and only drifted clusters are re-labeled"""
+        centroids = np.array([[1.0, 0.0], [0.0, 1.0]])
+        clusters = [
+            {'label': 'Cluster A', 'sample_doc_ids': ['a1'], 'sample_queries': ['qa'], 'ratings': {'good': 1, 'bad': 0, 'none': 9}},
+            {'label': 'Cluster B', 'sample_doc_ids': ['b1'], 'sample_queries': ['qb'], 'ratings': {'good': 0, 'bad': 0, 'none': 1}},
+        ]
+        state = analytics_reporting_service._cluster_state(
+            2, True, centroids, centroids, [10, 1], clusters, watermark='t0', total_queries=11
+        )
+        mock_firestore_service.get_cluster_state.return_value = state
+        mock_firestore_service.get_analytics_events.return_value = [
+            # barely moves A
+            {'doc_id': 'n1', 'query_vector': [1.0, 0.05], 'query_text': 'new a', 'rating': 'helpful', 'timestamp': 't1'},
+            # drags B past the threshold
+            {'doc_id': 'n2', 'query_vector': [0.8, 1.0], 'query_text': 'new b', 'timestamp': 't2'},
+        ]
+        # Only the previous samples of the re-labeled cluster are read back
+        mock_firestore_service.get_analytics_events_by_ids.return_value = [
+            {'doc_id': 'b1', 'query_text': 'qb', 'query_vector': [0.0, 1.0]}
+        ]
+        mock_gemini_service.generate_answer.return_value = "Cluster B2"
+
+        report = analytics_reporting_service.run_daily_analytics("course1", incremental=True)
+
+        mock_firestore_service.get_analytics_events.assert_called_once_with(
+            "course1", event_type='chat', fields=['query_vector', 'query_text', 'rating', 'timestamp'], since='t0'
+        )
+        mock_firestore_service.get_analytics_events_by_ids.assert_called_once_with(['b1'], fields=['query_vector', 'query_text'])
+        mock_gemini_service.generate_answer.assert_called_once()
+        self.assertEqual(report['new_queries'], 2)
+        self.assertEqual(report['relabeled_clusters'], 1)
+        self.assertEqual(report['total_queries'], 13)
+        self.assertEqual(report['clusters']['Cluster A']['count'], 11)
+        self.assertEqual(report['clusters']['Cluster A']['ratings']['good'], 2)
+        self.assertEqual(report['clusters']['Cluster B2']['count'], 2)
+        self.assertEqual(report['clusters']['Cluster B2']['sample_queries'], ['qb', 'new b'])
+
+        saved = mock_firestore_service.save_cluster_state.call_args[0][1]
+        self.assertEqual(saved['watermark'], 't2')
+        self.assertEqual(saved['counts'], [11, 2])
+
+    @patch('app.services.analytics_reporting_service.gemini_service')
+    def test_label_clusters_reuses_known_labels(self, mock_gemini_service):
+        """Test clusters whose top samples are unchanged keep their label without an LLM call"""
+        mock_gemini_service.generate_answer.return_value = '"Loops"'
+        unchanged = [('d1', 'What is recursion?'), ('d2', 'Base case?')]
+        known = {analytics_reporting_service._label_fingerprint(['d2', 'd1']): 'Recursion'}
+
+        labels = analytics_reporting_service._label_clusters(
+            [unchanged, [('d3', 'How do loops work?')], [('d4', None)]], known=known
+        )
+
+        self.assertEqual([label for label, _ in labels], ['Recursion', 'Loops', 'Miscellaneous Questions'])
+        self.assertIn(labels[0][1], known)
+        self.assertEqual(labels[1][1], analytics_reporting_service._label_fingerprint(['d3']))
+        self.assertIsNone(labels[2][1])
+        mock_gemini_service.generate_answer.assert_called_once()
+        self.assertIn('How do loops work?', mock_gemini_service.generate_answer.call_args[0][0])
+
+    @patch('app.services.analytics_reporting_service.LABEL_BATCH', True)
+    @patch('app.services.analytics_reporting_service.gemini_service')
+    def test_label_clusters_batch_prompt(self, mock_gemini_service):
+        """Test one prompt labels every cluster, with per-cluster requests if the response can't be parsed"""
+        samples = [[('d1', 'What is recursion?')], [('d2', 'How do loops work?')]]
+        mock_gemini_service.generate_answer.return_value = '```json\n["Recursion", "Loops"]\n```'
+
+        labels = analytics_reporting_service._label_clusters(samples)
+
+        self.assertEqual([label for label, _ in labels], ['Recursion', 'Loops'])
+        mock_gemini_service.generate_answer.assert_called_once()
+
+        mock_gemini_service.generate_answer.reset_mock()
+        def answer(prompt):
+            if 'Group 1' in prompt:
+                return 'not json'
+            if 'loops' in prompt:
+                raise Exception('quota')
+            return 'Recursion'
+        mock_gemini_service.generate_answer.side_effect = answer
+
+        labels = analytics_reporting_service._label_clusters(samples)
+
+        self.assertEqual(mock_gemini_service.generate_answer.call_count, 3)
+        self.assertEqual(labels[0][0], 'Recursion')
+        # Fallback labels aren't cached
+        self.assertEqual(labels[1], ('Questions about How do loops work?...', None))
+
+    @patch('app.services.analytics_reporting_service._run_full_analytics')
+    @patch('app.services.analytics_reporting_service.firestore_service')
+    def test_incremental_without_state_runs_full(self, mock_firestore_service, mock_full):
+        """Test a course with no saved cluster state falls back to a full run"""
+        mock_firestore_service.get_cluster_state.return_value = None
+        mock_full.return_value = {'status': 'complete'}
+
+        report = analytics_reporting_service.run_daily_analytics("course1", incremental=True)
+
+        self.assertEqual(report, {'status': 'complete'})
+        mock_full.assert_called_once_with("course1", None, True)
+
+
+    def _blobs(self, per_cluster=40, dims=64):
+        """Three well-separated groups of vectors"""
+        rng = np.random.default_rng(1)
+        centers = np.eye(dims)[:3] * 10
+        return np.vstack([c + rng.normal(scale=0.1, size=(per_cluster, dims)) for c in centers]).astype(np.float32)
+
+    @patch('app.services.analytics_reporting_service.ELBOW_COMPONENTS', 8)
+    @patch('app.services.analytics_reporting_service.ELBOW_SAMPLE_SIZE', 60)
+    def test_cluster_with_elbow_reuses_search_model(self):
+        """Test the elbow search (PCA + subsample) picks k and its model labels every vector"""
+        vectors = self._blobs()
+
+        with patch('app.services.analytics_reporting_service._perform_clustering') as mock_perform_clustering:
+            n_clusters, labels, centers = analytics_reporting_service.cluster_with_elbow(vectors, max_clusters=6)
+
+        mock_perform_clustering.assert_not_called()
+        self.assertEqual(n_clusters, analytics_reporting_service.determine_optimal_clusters(vectors, max_clusters=6))
+        self.assertEqual(len(labels), len(vectors))
+        self.assertEqual(centers.shape, (n_clusters, vectors.shape[1]))
+        # Groups are never mixed, and each centroid is the mean of its members in the original space
+        for group in range(3):
+            group_labels = set(labels[group * 40:(group + 1) * 40].tolist())
+            for other in range(group + 1, 3):
+                self.assertFalse(group_labels & set(labels[other * 40:(other + 1) * 40].tolist()))
+        for cluster_id in set(labels.tolist()):
+            np.testing.assert_allclose(centers[cluster_id], vectors[labels == cluster_id].mean(axis=0), atol=1e-4)
+
+    def test_determine_optimal_clusters_too_few_samples(self):
+        """Test k=1 is returned when there are too few vectors for the elbow method"""
+        self.assertEqual(analytics_reporting_service.determine_optimal_clusters(np.zeros((2, 4)), max_clusters=5), 1)
+
+    def test_rating_counts_and_representatives(self):
+        """Test the vectorized group-bys over the event frame"""
+        events = [
+            {'doc_id': 'a', 'query_vector': [0.0, 0.0], 'rating': 'helpful'},
+            {'doc_id': 'b', 'query_vector': [2.0, 0.0], 'rating': 'not_helpful'},
+            {'doc_id': 'c', 'query_vector': [1.0, 0.0]},
+            {'doc_id': 'd', 'query_vector': [9.0, 9.0], 'rating': 'other'},
+        ]
+        frame = analytics_reporting_service._build_event_frame(events)
+        labels = np.array([0, 0, 0, 1])
+        centers = np.array([[0.9, 0.0], [9.0, 9.0]])
+
+        counts = analytics_reporting_service._rating_counts(labels, frame['ratings'], 2)
+        samples = analytics_reporting_service._representatives(frame['vectors'], labels, centers, 2, size=2)
+
+        self.assertEqual(counts.tolist(), [[1, 1, 1], [0, 0, 0]])
+        self.assertEqual([frame['doc_ids'][idx].tolist() for idx in samples], [['c', 'a'], ['d']])
 
     def test_extract_vectors(self):
         """Test the _extract_vectors helper function"""
@@ -61,5 +225,18 @@ class TestAnalyticsReportingService(unittest.TestCase):
         self.assertEqual(doc_ids[0], '1')
         self.assertEqual(doc_ids[1], '3')
 
+    def test_extract_vectors_encoded(self):
+        """Test binary-encoded and legacy list vectors are decoded into one matrix"""
+        from app.services import analytics_logging_service
+        events = [
+            {'doc_id': '1', 'query_vector': analytics_logging_service.encode_query_vector([0.5, 0.25])},
+            {'doc_id': '2', 'query_vector': [0.75, 1.0]},
+        ]
+        vectors, doc_ids = analytics_reporting_service._extract_vectors(events)
+
+        self.assertEqual(vectors.dtype, np.float32)
+        self.assertEqual(vectors.tolist(), [[0.5, 0.25], [0.75, 1.0]])
+        self.assertEqual(doc_ids, ['1', '2'])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import answer_cache_service
+
+SOURCES = [{'filename': 'a.pdf', 'source_uri': 'gs://bucket/a.pdf', 'distance': 0.1}]
+
+class TestAnswerCacheService(unittest.TestCase):
+    """Test suite for Answer Cache service functions"""
+
+    def setUp(self):
+        answer_cache_service.invalidate()
+
+    def test_near_duplicate_question_hits(self):
+        """Test a question whose embedding is close enough returns the cached answer"""
+        answer_cache_service.store('course1', 'What is X?', [1.0, 0.0, 0.0], 'v1', 'X is...', SOURCES)
+
+        hit = answer_cache_service.lookup('course1', [0.99, 0.05, 0.0], 'v1')
+
+        self.assertEqual(hit['answer'], 'X is...')
+        self.assertEqual(hit['sources'], SOURCES)
+        self.assertGreater(hit['similarity'], 0.95)
+
+    def test_dissimilar_question_misses(self):
+        """Test a question below the similarity threshold is not served from the cache"""
+        answer_cache_service.store('course1', 'What is X?', [1.0, 0.0, 0.0], 'v1', 'X is...', SOURCES)
+
+        self.assertIsNone(answer_cache_service.lookup('course1', [0.0, 1.0, 0.0], 'v1'))
+
+    def test_cache_is_per_course(self):
+        """Test answers are never shared between courses"""
+        answer_cache_service.store('course1', 'What is X?', [1.0, 0.0], 'v1', 'X is...', SOURCES)
+
+        self.assertIsNone(answer_cache_service.lookup('course2', [1.0, 0.0], 'v1'))
+
+    def test_new_corpus_version_invalidates(self):
+        """Test entries generated against an older corpus version are dropped"""
+        answer_cache_service.store('course1', 'What is X?', [1.0, 0.0], 'corpus:0', 'X is...', SOURCES)
+
+        self.assertIsNone(answer_cache_service.lookup('course1', [1.0, 0.0], 'corpus:1'))
+        self.assertIsNone(answer_cache_service.lookup('course1', [1.0, 0.0], 'corpus:0'))
+
+    @patch('app.services.answer_cache_service.ANSWER_CACHE_TTL', 0)
+    def test_expired_entries_miss(self):
+        """Test entries past their TTL are not returned"""
+        answer_cache_service.store('course1', 'What is X?', [1.0, 0.0], 'v1', 'X is...', SOURCES)
+
+        self.assertIsNone(answer_cache_service.lookup('course1', [1.0, 0.0], 'v1'))
+
+    def test_answers_without_sources_are_not_cached(self):
+        """Test 'no information' answers are not cached"""
+        answer_cache_service.store('course1', 'What is X?', [1.0, 0.0], 'v1', "I don't have enough information", [])
+
+        self.assertIsNone(answer_cache_service.lookup('course1', [1.0, 0.0], 'v1'))
+
+    def test_corpus_version(self):
+        """Test the version combines the corpus ID and its sync counter"""
+        self.assertEqual(answer_cache_service.corpus_version({'corpus_id': 'c1'}), 'c1:0')
+        self.assertEqual(answer_cache_service.corpus_version({'corpus_id': 'c1', 'corpus_version': 3}), 'c1:3')
+
+if __name__ == '__main__':
+    unittest.main()
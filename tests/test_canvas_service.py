@@ -2,6 +2,7 @@ import unittest
 from unittest.mock import patch, MagicMock
 import sys
 import os
+import tempfile
 
 # Add parent directory to path to import app modules
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -56,24 +57,60 @@ class TestCanvasService(unittest.TestCase):
         self.assertEqual(files[0]['display_name'], 'file1.pdf')
         self.assertEqual(files[1]['display_name'], 'file2.docx')
 
-    @patch('app.services.canvas_service.requests.get')
-    @patch('app.services.canvas_service.os.makedirs')
-    @patch('builtins.open')
-    def test_download_files(self, mock_open, mock_makedirs, mock_get):
-        """Test the _download_files helper function"""
-        # Mock the requests.get call for downloading a file
+    @patch('app.services.canvas_service._get_session')
+    def test_download_files(self, mock_get_session):
+        """Test download_files streams each file to disk and reports progress"""
         mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.content = b'file content'
-        mock_get.return_value = mock_response
+        mock_response.iter_content.return_value = [b'file ', b'content']
+        mock_get_session.return_value.get.return_value.__enter__.return_value = mock_response
+
+        files_to_download = [
+            {'id': '1', 'display_name': 'file1.pdf', 'url': 'http://download-url/1'},
+            {'id': '2', 'display_name': 'file2.pdf', 'url': 'http://download-url/2'},
+        ]
+        progress = []
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            canvas_service.download_files(
+                files_to_download, 'fake_token', '123', output_dir,
+                progress_callback=lambda f, done, total: progress.append((done, total))
+            )
+
+            for file in files_to_download:
+                self.assertEqual(file['local_path'], os.path.join(output_dir, file['display_name']))
+                with open(file['local_path'], 'rb') as f:
+                    self.assertEqual(f.read(), b'file content')
+            self.assertEqual(sorted(os.listdir(output_dir)), ['file1.pdf', 'file2.pdf'])
+
+        self.assertEqual(progress, [(1, 2), (2, 2)])
+        mock_get_session.return_value.get.assert_any_call(
+            'http://download-url/1', headers={'Authorization': 'Bearer fake_token'}, timeout=60, stream=True
+        )
+
+    @patch('app.services.canvas_service._get_session')
+    def test_download_files_failure(self, mock_get_session):
+        """Test a failed download sets local_path to None without leaving partial files"""
+        mock_response = MagicMock()
+        mock_response.raise_for_status.side_effect = Exception("404 Not Found")
+        mock_get_session.return_value.get.return_value.__enter__.return_value = mock_response
+
+        files_to_download = [{'id': '1', 'display_name': 'file1.pdf', 'url': 'http://download-url/1'}]
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            canvas_service.download_files(files_to_download, 'fake_token', '123', output_dir)
+            self.assertEqual(os.listdir(output_dir), [])
+
+        self.assertIsNone(files_to_download[0]['local_path'])
+
 
-        files_to_download = [{'id': '1', 'display_name': 'file1.pdf', 'url': 'http://download-url'}]
-        canvas_service._download_files(files_to_download, 'fake_token', '123')
+    def test_diff_indexed_files(self):
+        """Test diff_indexed_files classifies added, changed and removed files"""
+        stored = {'1': {'hash': 'a'}, '2': {'hash': 'b'}, '3': {'hash': 'c'}}
+        current = {'1': {'hash': 'a'}, '2': {'hash': 'b2'}, '4': {'hash': 'd'}}
 
-        mock_makedirs.assert_called_once()
-        mock_open.assert_called_once()
-        mock_get.assert_called_once_with('http://download-url', headers={'Authorization': 'Bearer fake_token'}, timeout=60)
+        diff = canvas_service.diff_indexed_files(stored, current)
 
+        self.assertEqual(diff, {'added': ['4'], 'changed': ['2'], 'removed': ['3']})
 
     @patch('app.services.canvas_service.requests.get')
     def test_get_syllabus(self, mock_get):
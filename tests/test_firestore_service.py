@@ -31,6 +31,7 @@ class TestFirestoreService(unittest.TestCase):
         
         # Replace the service's db with our mock
         firestore_service.db = self.mock_db
+        firestore_service.invalidate_course_cache()
         self.service = firestore_service
     
     
@@ -145,12 +146,76 @@ class TestFirestoreService(unittest.TestCase):
         self.assertFalse(result.exists)
     
     
+    # ==================== TEST course cache ====================
+    
+    def test_get_course_data_caches_active_course(self):
+        """Test an ACTIVE course is served from the cache on repeat reads"""
+        mock_doc = Mock()
+        mock_doc.exists = True
+        mock_doc.get.return_value = 'ACTIVE'
+        mock_get = self.mock_db.collection.return_value.document.return_value.get
+        mock_get.return_value = mock_doc
+        
+        first = self.service.get_course_data('course_hot')
+        second = self.service.get_course_data('course_hot')
+        state = self.service.get_course_state('course_hot')
+        
+        self.assertIs(first, second)
+        self.assertEqual(state, 'ACTIVE')
+        mock_get.assert_called_once()
+    
+    def test_get_course_data_does_not_cache_generating_course(self):
+        """Test a GENERATING course is always read from Firestore"""
+        mock_doc = Mock()
+        mock_doc.exists = True
+        mock_doc.get.return_value = 'GENERATING'
+        mock_get = self.mock_db.collection.return_value.document.return_value.get
+        mock_get.return_value = mock_doc
+        
+        self.service.get_course_data('course_gen')
+        self.service.get_course_data('course_gen')
+        
+        self.assertEqual(mock_get.call_count, 2)
+    
+    def test_update_knowledge_graph_invalidates_cache(self):
+        """Test writing the graph drops the cached course document"""
+        mock_doc = Mock()
+        mock_doc.exists = True
+        mock_doc.get.return_value = 'ACTIVE'
+        mock_get = self.mock_db.collection.return_value.document.return_value.get
+        mock_get.return_value = mock_doc
+        
+        self.service.get_course_data('course_edit')
+        self.service.update_knowledge_graph('course_edit', '[]', '[]', '{}')
+        self.service.get_course_data('course_edit')
+        
+        self.assertEqual(mock_get.call_count, 2)
+    
+    def test_get_course_data_bypass_cache(self):
+        """Test use_cache=False always reads from Firestore"""
+        mock_doc = Mock()
+        mock_doc.exists = True
+        mock_doc.get.return_value = 'ACTIVE'
+        mock_get = self.mock_db.collection.return_value.document.return_value.get
+        mock_get.return_value = mock_doc
+        
+        self.service.get_course_data('course_rw')
+        self.service.get_course_data('course_rw', use_cache=False)
+        
+        self.assertEqual(mock_get.call_count, 2)
+    
+    
     # ==================== TEST finalize_course_doc ====================
     
+    def _header_update(self):
+        """Returns the course document fields written by the last graph batch"""
+        batch = self.mock_db.batch.return_value
+        batch.commit.assert_called_once()
+        return batch.update.call_args[0][1]
+    
     def test_finalize_course_doc_complete_data(self):
-        """Test finalize_course_doc with all data fields"""
-        mock_update = Mock()
-        self.mock_db.collection.return_value.document.return_value.update = mock_update
+        """Test finalize_course_doc writes the graph to a version doc and a small header"""
+        batch = self.mock_db.batch.return_value
         
         test_data = {
             'corpus_id': 'corpus_abc123',
@@ -166,22 +231,23 @@ class TestFirestoreService(unittest.TestCase):
         self.mock_db.collection.assert_called_with('courses')
         self.mock_db.collection.return_value.document.assert_called_with('course_final')
         
-        # Verify update was called with correct data
-        expected_update = {
-            'status': 'ACTIVE',
-            'corpus_id': 'corpus_abc123',
-            'indexed_files': ['file1.pdf', 'file2.pdf'],
-            'kg_nodes': '[{"id": "node1"}]',
-            'kg_edges': '[{"from": "node1", "to": "node2"}]',
-            'kg_data': '{"topic_1": {"summary": "..."}}'
-        }
-        mock_update.assert_called_once_with(expected_update)
+        # The graph goes to the versioned subcollection...
+        graph_doc = batch.set.call_args[0][1]
+        self.assertEqual(graph_doc['kg_nodes'], '[{"id": "node1"}]')
+        self.assertEqual(graph_doc['kg_edges'], '[{"from": "node1", "to": "node2"}]')
+        self.assertEqual(graph_doc['kg_data'], '{"topic_1": {"summary": "..."}}')
+        
+        # ...and the header only points at it, dropping legacy inline fields
+        header = self._header_update()
+        self.assertEqual(header['status'], 'ACTIVE')
+        self.assertEqual(header['corpus_id'], 'corpus_abc123')
+        self.assertEqual(header['indexed_files'], ['file1.pdf', 'file2.pdf'])
+        self.assertTrue(header['graph_version'])
+        for field in ('kg_nodes', 'kg_edges', 'kg_data'):
+            self.assertIs(header[field], self.service.firestore.DELETE_FIELD)
     
     def test_finalize_course_doc_partial_data(self):
         """Test finalize_course_doc with missing optional fields"""
-        mock_update = Mock()
-        self.mock_db.collection.return_value.document.return_value.update = mock_update
-        
         test_data = {
             'corpus_id': 'corpus_xyz',
             # Missing other fields
@@ -189,34 +255,156 @@ class TestFirestoreService(unittest.TestCase):
         
         self.service.finalize_course_doc('course_partial', test_data)
         
-        # Verify update includes None for missing fields
-        expected_update = {
-            'status': 'ACTIVE',
-            'corpus_id': 'corpus_xyz',
-            'indexed_files': None,
-            'kg_nodes': None,
-            'kg_edges': None,
-            'kg_data': None
-        }
-        mock_update.assert_called_once_with(expected_update)
+        header = self._header_update()
+        self.assertEqual(header['status'], 'ACTIVE')
+        self.assertEqual(header['corpus_id'], 'corpus_xyz')
+        self.assertIsNone(header['indexed_files'])
+        self.assertIsNone(self.mock_db.batch.return_value.set.call_args[0][1]['kg_nodes'])
     
     def test_finalize_course_doc_empty_data(self):
         """Test finalize_course_doc with empty data dictionary"""
-        mock_update = Mock()
-        self.mock_db.collection.return_value.document.return_value.update = mock_update
-        
         self.service.finalize_course_doc('course_empty', {})
         
-        # Verify update sets status to ACTIVE with None for all fields
-        expected_update = {
-            'status': 'ACTIVE',
-            'corpus_id': None,
-            'indexed_files': None,
-            'kg_nodes': None,
-            'kg_edges': None,
-            'kg_data': None
-        }
-        mock_update.assert_called_once_with(expected_update)
+        header = self._header_update()
+        self.assertEqual(header['status'], 'ACTIVE')
+        self.assertIsNone(header['corpus_id'])
+        self.assertIsNone(header['indexed_files'])
+    
+    def test_update_knowledge_graph_keeps_header_fields(self):
+        """Test a graph edit only moves the graph_version pointer"""
+        self.service.update_knowledge_graph('course_edit', '[]', '[]', '{}')
+        
+        header = self._header_update()
+        self.assertNotIn('status', header)
+        self.assertNotIn('corpus_id', header)
+        self.assertNotIn('indexed_files', header)
+        self.assertTrue(header['graph_version'])
+    
+    # ==================== TEST get_course_graph ====================
+    
+    def test_get_course_graph_reads_version_doc(self):
+        """Test the graph is read from the version the header points at, and cached"""
+        header = Mock()
+        header.exists = True
+        header.to_dict.return_value = {'status': 'ACTIVE', 'graph_version': 'v1'}
+        version_doc = Mock()
+        version_doc.exists = True
+        version_doc.to_dict.return_value = {'kg_nodes': '[1]', 'kg_edges': '[2]', 'kg_data': '{}'}
+        version_ref = self.mock_db.collection.return_value.document.return_value.collection.return_value.document
+        version_ref.return_value.get.return_value = version_doc
+        
+        first = self.service.get_course_graph('course_graph', header)
+        second = self.service.get_course_graph('course_graph', header)
+        
+        self.assertEqual(first, {'kg_nodes': '[1]', 'kg_edges': '[2]', 'kg_data': '{}', 'graph_version': 'v1'})
+        self.assertEqual(second, first)
+        version_ref.assert_called_with('v1')
+        self.assertEqual(version_ref.return_value.get.call_count, 1)
+    
+    def test_get_course_graph_legacy_inline_fields(self):
+        """Test courses written before the split still return their inline graph"""
+        header = Mock()
+        header.exists = True
+        header.to_dict.return_value = {'status': 'ACTIVE', 'kg_nodes': '[]', 'kg_edges': '[]', 'kg_data': '{"t": 1}'}
+        
+        graph = self.service.get_course_graph('course_legacy', header)
+        
+        self.assertEqual(graph['kg_data'], '{"t": 1}')
+        self.assertIsNone(graph['graph_version'])
+        self.mock_db.collection.return_value.document.return_value.collection.assert_not_called()
+    
+    def test_get_course_graph_missing_course(self):
+        """Test a missing course returns None"""
+        header = Mock()
+        header.exists = False
+        
+        self.assertIsNone(self.service.get_course_graph('course_missing', header))
+    
+    
+    # ==================== TEST analytics reads ====================
+    
+    def _event_doc(self, doc_id, data):
+        doc = Mock()
+        doc.id = doc_id
+        doc.to_dict.return_value = data
+        return doc
+    
+    def test_get_analytics_events_pages_with_cursor(self):
+        """Test events are read page by page, resuming after the last document"""
+        filtered = self.mock_db.collection.return_value.where.return_value.where.return_value
+        page_query = filtered.select.return_value.order_by.return_value.limit.return_value
+        first = [self._event_doc('a', {'query_vector': [1]}), self._event_doc('b', {'query_vector': [2]})]
+        page_query.stream.return_value = first
+        page_query.start_after.return_value.stream.return_value = [self._event_doc('c', {'query_vector': [3]})]
+        
+        events = self.service.get_analytics_events('course1', event_type='chat', fields=['query_vector'], page_size=2)
+        
+        self.assertEqual([e['doc_id'] for e in events], ['a', 'b', 'c'])
+        filtered.select.assert_called_once_with(['query_vector'])
+        filtered.select.return_value.order_by.return_value.limit.assert_called_once_with(2)
+        page_query.start_after.assert_called_once_with(first[-1])
+    
+    def test_get_analytics_events_ids_only(self):
+        """Test an empty projection only fetches document IDs"""
+        filtered = self.mock_db.collection.return_value.where.return_value
+        page_query = filtered.select.return_value.order_by.return_value.limit.return_value
+        page_query.stream.return_value = [self._event_doc('a', {})]
+        
+        events = self.service.get_analytics_events('course1', fields=[])
+        
+        self.assertEqual(events, [{'doc_id': 'a'}])
+        filtered.select.assert_called_once_with(['__name__'])
+    
+    def test_save_job_checkpoint_uses_own_document(self):
+        """Test a checkpoint is written to the job's checkpoints subcollection, not the job document"""
+        job_ref = self.mock_db.collection.return_value.document.return_value
+        batch = self.mock_db.batch.return_value
+        
+        self.service.save_job_checkpoint('job1', 'summarize', gcs_uri='gs://b/jobs/job1/summarize.json')
+        
+        job_ref.collection.assert_called_with('checkpoints')
+        job_ref.collection.return_value.document.assert_called_with('summarize')
+        checkpoint = batch.set.call_args[0][1]
+        self.assertEqual(checkpoint['gcs_uri'], 'gs://b/jobs/job1/summarize.json')
+        self.assertIsNone(checkpoint['output'])
+        job_update = batch.update.call_args[0][1]
+        self.assertNotIn('checkpoints.summarize', job_update)
+        self.assertIn('completed_stages', job_update)
+        batch.commit.assert_called_once()
+    
+    def test_has_analytics_events_since_reads_one_id(self):
+        """Test the new-events check fetches a single document ID after the watermark"""
+        filtered = self.mock_db.collection.return_value.where.return_value.where.return_value
+        since_query = filtered.select.return_value.where.return_value.order_by.return_value
+        since_query.order_by.return_value.limit.return_value.stream.return_value = [self._event_doc('a', {})]
+        
+        self.assertTrue(self.service.has_analytics_events_since('course1', 't0'))
+        filtered.select.assert_called_once_with(['__name__'])
+        since_query.order_by.return_value.limit.assert_called_once_with(1)
+        
+        since_query.order_by.return_value.limit.return_value.stream.return_value = []
+        self.assertFalse(self.service.has_analytics_events_since('course1', 't0'))
+    
+    def test_list_course_ids(self):
+        """Test courses are listed by status with an ID-only projection"""
+        query = self.mock_db.collection.return_value.where.return_value
+        query.select.return_value.stream.return_value = [self._event_doc('c1', {}), self._event_doc('c2', {})]
+        
+        self.assertEqual(self.service.list_course_ids(), ['c1', 'c2'])
+        self.mock_db.collection.assert_called_with('courses')
+        query.select.assert_called_once_with(['__name__'])
+    
+    def test_get_analytics_events_by_ids_keeps_order(self):
+        """Test events come back in the order the IDs were requested"""
+        query = self.mock_db.collection.return_value.where.return_value
+        query.select.return_value.stream.return_value = [
+            self._event_doc('a', {'rating': 'helpful'}), self._event_doc('b', {})
+        ]
+        
+        events = self.service.get_analytics_events_by_ids(['b', 'a'], fields=['rating'])
+        
+        self.assertEqual([e['doc_id'] for e in events], ['b', 'a'])
+        query.select.assert_called_once_with(['rating'])
     
     
     # ==================== INTEGRATION TESTS ====================
@@ -239,9 +427,6 @@ class TestFirestoreService(unittest.TestCase):
         self.assertEqual(state, 'GENERATING')
         
         # Step 3: Finalize course
-        mock_update = Mock()
-        self.mock_db.collection.return_value.document.return_value.update = mock_update
-        
         final_data = {
             'corpus_id': 'corpus_final',
             'indexed_files': ['file.pdf'],
@@ -250,7 +435,7 @@ class TestFirestoreService(unittest.TestCase):
             'kg_data': '{}'
         }
         self.service.finalize_course_doc('course_lifecycle', final_data)
-        mock_update.assert_called_once()
+        self.mock_db.batch.return_value.commit.assert_called_once()
         
         # Step 4: Check state (should be ACTIVE)
         mock_doc_active = Mock()
@@ -11,6 +11,32 @@ from app.services import gemini_service
 class TestGeminiService(unittest.TestCase):
     """Test suite for Gemini service functions"""
 
+    def setUp(self):
+        # Model instances are cached per process; start each test with a fresh registry
+        gemini_service.clear_model_registry()
+
+    @patch('app.services.gemini_service.GenerativeModel')
+    def test_generative_model_is_reused(self, mock_model):
+        """Test the same model name and config share one instance across calls"""
+        mock_model.side_effect = lambda *args, **kwargs: MagicMock()
+
+        first = gemini_service.get_generative_model('gemini-test')
+
+        self.assertIs(gemini_service.get_generative_model('gemini-test'), first)
+        self.assertIsNot(gemini_service.get_generative_model('gemini-other'), first)
+        self.assertIsNot(gemini_service.get_generative_model('gemini-test', generation_config={'temperature': 0}), first)
+        self.assertEqual(mock_model.call_count, 3)
+
+    @patch('vertexai.language_models.TextEmbeddingModel.from_pretrained')
+    def test_embedding_model_loaded_once(self, mock_from_pretrained):
+        """Test get_embeddings loads the embedding model only once"""
+        mock_from_pretrained.return_value.get_embeddings.return_value = [MagicMock(values=[0.1])]
+
+        gemini_service.get_embeddings(["a"])
+        gemini_service.get_embeddings(["b"])
+
+        mock_from_pretrained.assert_called_once_with("text-embedding-004")
+
     @patch('app.services.gemini_service.GenerativeModel')
     def test_generate_answer(self, mock_model):
         """Test generate_answer function"""
@@ -23,11 +49,13 @@ class TestGeminiService(unittest.TestCase):
         self.assertEqual(answer, "This is a test answer.")
         mock_instance.generate_content.assert_called_with("What is a test?")
 
-    @patch('app.services.gemini_service.retrieve_context')
+    @patch('app.services.gemini_service.retrieve_chunks')
     @patch('app.services.gemini_service.GenerativeModel')
-    def test_generate_answer_with_context(self, mock_model, mock_retrieve_context):
+    def test_generate_answer_with_context(self, mock_model, mock_retrieve_chunks):
         """Test generate_answer_with_context function"""
-        mock_retrieve_context.return_value = (["This is context."], ["source1.pdf"])
+        mock_retrieve_chunks.return_value = [
+            {'text': "This is context.", 'source_uri': 'gs://bucket/source1.pdf', 'distance': 0.2}
+        ]
         
         mock_instance = MagicMock()
         mock_instance.generate_content.return_value.text = "This is a context-aware answer."
@@ -36,8 +64,75 @@ class TestGeminiService(unittest.TestCase):
         answer, sources = gemini_service.generate_answer_with_context("What is a test?", "corpus_id")
 
         self.assertEqual(answer, "This is a context-aware answer.")
-        self.assertEqual(sources, ["source1.pdf"])
-        mock_retrieve_context.assert_called_with("corpus_id", "What is a test?", 10, 0.4)
+        self.assertEqual(sources, [{'filename': 'source1.pdf', 'source_uri': 'gs://bucket/source1.pdf', 'distance': 0.2}])
+        self.assertIn("This is context.", mock_instance.generate_content.call_args[0][0])
+        mock_retrieve_chunks.assert_called_with("corpus_id", "What is a test?", 10, 0.4, corpus_version=None)
+
+    def test_pack_context_merges_overlapping_chunks(self):
+        """Test overlapping and duplicate chunks of one file become a single passage"""
+        words = [f'w{i}' for i in range(30)]
+        chunks = [
+            {'text': ' '.join(words[10:30]), 'source_uri': 'gs://b/a.pdf', 'distance': 0.1},
+            {'text': ' '.join(words[0:20]), 'source_uri': 'gs://b/a.pdf', 'distance': 0.2},
+            {'text': ' '.join(words[0:20]), 'source_uri': 'gs://b/a.pdf', 'distance': 0.3},
+            {'text': ' '.join(words[0:20]), 'source_uri': 'gs://b/other.pdf', 'distance': 0.4},
+        ]
+
+        texts, sources, stats = gemini_service.pack_context(chunks, token_budget=1000)
+
+        self.assertEqual(texts, [' '.join(words), ' '.join(words[0:20])])
+        self.assertEqual([s['filename'] for s in sources], ['a.pdf', 'other.pdf'])
+        self.assertEqual(stats['merged'], 2)
+        self.assertEqual(stats['passages'], 2)
+
+    def test_pack_context_respects_token_budget(self):
+        """Test passages are added closest-first until the budget is used up"""
+        chunks = [
+            {'text': 'a' * 400, 'source_uri': 'gs://b/far.pdf', 'distance': 0.5},
+            {'text': 'b' * 400, 'source_uri': 'gs://b/near.pdf', 'distance': 0.1},
+            {'text': 'c' * 40, 'source_uri': 'gs://b/small.pdf', 'distance': 0.6},
+        ]
+
+        texts, sources, stats = gemini_service.pack_context(chunks, token_budget=120)
+
+        self.assertEqual(texts, ['b' * 400, 'c' * 40])
+        self.assertEqual(stats['dropped'], 1)
+        self.assertEqual(stats['context_tokens'], 110)
+
+        texts, _, _ = gemini_service.pack_context(chunks, token_budget=10)
+        self.assertEqual(texts, ['b' * 40])
+
+    @patch('app.services.gemini_service.time.sleep')
+    @patch('app.services.gemini_service.get_embeddings')
+    def test_get_embeddings_batch_chunks_and_keeps_order(self, mock_get_embeddings, mock_sleep):
+        """Test texts are embedded in chunks, in order, with a retry for a failed chunk"""
+        calls = []
+
+        def fake_get_embeddings(texts, model_name, task_type):
+            calls.append(list(texts))
+            if texts == ['t2', 't3'] and calls.count(['t2', 't3']) == 1:
+                raise Exception("429 Resource exhausted")
+            return [[float(t[1:])] for t in texts]
+
+        mock_get_embeddings.side_effect = fake_get_embeddings
+
+        vectors = gemini_service.get_embeddings_batch(['t0', 't1', 't2', 't3', 't4'], batch_size=2, max_workers=3)
+
+        self.assertEqual(vectors, [[0.0], [1.0], [2.0], [3.0], [4.0]])
+        self.assertEqual(len(calls), 4)  # 3 chunks + 1 retry
+        mock_sleep.assert_called_once_with(1)
+
+    @patch('app.services.gemini_service.time.sleep')
+    @patch('app.services.gemini_service.get_embeddings')
+    def test_get_embeddings_batch_gives_up_on_chunk(self, mock_get_embeddings, mock_sleep):
+        """Test a chunk that keeps failing yields None without failing the other chunks"""
+        mock_get_embeddings.side_effect = lambda texts, **kwargs: (
+            [[1.0] for _ in texts] if texts[0] == 'a' else (_ for _ in ()).throw(Exception("down"))
+        )
+
+        vectors = gemini_service.get_embeddings_batch(['a', 'b'], batch_size=1)
+
+        self.assertEqual(vectors, [[1.0], None])
 
     @patch('builtins.open')
     @patch('app.services.gemini_service.mimetypes.guess_type')
@@ -55,6 +150,61 @@ class TestGeminiService(unittest.TestCase):
         self.assertEqual(summary, "This is a file summary.")
         mock_open.assert_called_with('/fake/path/file.pdf', 'rb')
 
+    @patch('app.services.gemini_service.time.sleep')
+    @patch('app.services.gemini_service.summarize_file')
+    def test_summarize_files_keeps_order_and_retries(self, mock_summarize_file, mock_sleep):
+        """Test summarize_files returns input order and retries a failing file"""
+        calls = {}
+
+        def fake_summarize(file_path, prompt=None, model_name=None):
+            calls[file_path] = calls.get(file_path, 0) + 1
+            if file_path == 'b.pdf' and calls[file_path] == 1:
+                raise Exception("429 Resource exhausted")
+            return f"summary of {file_path}"
+
+        mock_summarize_file.side_effect = fake_summarize
+
+        with patch.object(gemini_service, '_rate_limiter', MagicMock()):
+            summaries = gemini_service.summarize_files(['a.pdf', 'b.pdf', 'c.pdf'], max_workers=3)
+
+        self.assertEqual(summaries, ['summary of a.pdf', 'summary of b.pdf', 'summary of c.pdf'])
+        self.assertEqual(calls['b.pdf'], 2)
+
+    @patch('app.services.gemini_service.time.sleep')
+    @patch('app.services.gemini_service.summarize_file')
+    def test_summarize_files_partial_failure(self, mock_summarize_file, mock_sleep):
+        """Test a file that keeps failing gets None without aborting the batch"""
+        def fake_summarize(file_path, prompt=None, model_name=None):
+            if file_path == 'bad.pdf':
+                raise Exception("boom")
+            return "ok"
+
+        mock_summarize_file.side_effect = fake_summarize
+
+        with patch.object(gemini_service, '_rate_limiter', MagicMock()):
+            summaries = gemini_service.summarize_files(['bad.pdf', 'good.pdf'])
+
+        self.assertEqual(summaries, [None, 'ok'])
+        self.assertEqual(mock_sleep.call_count, gemini_service.SUMMARIZE_MAX_RETRIES)
+
+    @patch('app.services.gemini_service.summary_cache_service')
+    @patch('app.services.gemini_service.summarize_file')
+    def test_summarize_files_uses_cache(self, mock_summarize_file, mock_cache):
+        """Test cached summaries skip Gemini and new summaries are stored"""
+        mock_cache.content_hash.side_effect = lambda path: f"hash-{path}"
+        mock_cache.cache_key.side_effect = lambda file_hash, prompt, model_name: f"key-{file_hash}"
+        mock_cache.get_summary.side_effect = lambda key: "cached" if key == 'key-hash-a.pdf' else None
+        mock_summarize_file.return_value = "fresh"
+
+        with patch.object(gemini_service, '_rate_limiter', MagicMock()):
+            summaries = gemini_service.summarize_files(['a.pdf', 'b.pdf'])
+
+        self.assertEqual(summaries, ['cached', 'fresh'])
+        mock_summarize_file.assert_called_once()
+        mock_cache.put_summary.assert_called_once_with(
+            'key-hash-b.pdf', 'fresh', 'hash-b.pdf', gemini_service.DEFAULT_MODEL
+        )
+
     @patch('app.services.gemini_service.GenerativeModel')
     def test_generate_suggested_questions(self, mock_model):
         """Test generate_suggested_questions function"""
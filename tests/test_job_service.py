@@ -0,0 +1,383 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+import shutil
+import tempfile
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import job_service
+
+class TestJobService(unittest.TestCase):
+    """Test suite for Job service functions"""
+
+    def _stage_mocks(self, job_type=job_service.INITIALIZE_JOB):
+        """Replace every stage function with a mock returning a small checkpoint"""
+        pipeline = job_service._PIPELINES[job_type]
+        mocks = {stage: MagicMock(return_value={f'{stage}_done': True}) for stage in pipeline['stages']}
+        return patch.dict(pipeline['functions'], mocks), mocks
+
+    @patch('app.services.job_service.firestore_service')
+    def test_run_job_runs_all_stages(self, mock_firestore_service):
+        """Test run_job runs every stage in order and checkpoints each one"""
+        mock_firestore_service.get_job.return_value = {
+            'job_id': 'job1', 'course_id': 'course1', 'params': {}, 'completed_stages': [], 'checkpoints': {}
+        }
+        stage_patch, mocks = self._stage_mocks()
+
+        with stage_patch:
+            job_service.run_job('job1')
+
+        for stage in job_service.STAGES:
+            mocks[stage].assert_called_once()
+        saved_stages = [c[0][1] for c in mock_firestore_service.save_job_checkpoint.call_args_list]
+        self.assertEqual(saved_stages, job_service.STAGES)
+        # Each checkpoint holds only its own stage's output
+        self.assertEqual(mock_firestore_service.save_job_checkpoint.call_args_list[0][0][2], {'download_done': True})
+        mock_firestore_service.update_job.assert_called_with(
+            'job1', {'status': 'COMPLETE', 'current_stage': None, 'result': {'finalize_done': True}}
+        )
+
+    @patch('app.services.job_service.firestore_service')
+    def test_run_job_resumes_from_checkpoint(self, mock_firestore_service):
+        """Test run_job skips completed stages and restores their output"""
+        mock_firestore_service.get_job.return_value = {
+            'job_id': 'job1', 'course_id': 'course1', 'params': {},
+            'completed_stages': ['download', 'upload', 'import']
+        }
+        mock_firestore_service.get_job_checkpoints.return_value = {
+            'download': {'output': {'files': [{'id': 1}], 'indexed_files': {'1': {'hash': 'h'}}}},
+            'upload': {'output': {'uploaded': {'1': {'gcs_uri': 'gs://b/c/1.pdf', 'display_name': 'one.pdf'}}}},
+            'import': {'output': {'corpus_id': 'corpus_abc'}}
+        }
+        stage_patch, mocks = self._stage_mocks()
+
+        with stage_patch:
+            job_service.run_job('job1')
+
+        mocks['download'].assert_not_called()
+        mocks['upload'].assert_not_called()
+        mocks['import'].assert_not_called()
+        mocks['summarize'].assert_called_once()
+        ctx = mocks['summarize'].call_args[0][0]
+        self.assertEqual(ctx['corpus_id'], 'corpus_abc')
+        # Upload checkpoints are applied to the restored file list
+        self.assertEqual(ctx['files'][0]['gcs_uri'], 'gs://b/c/1.pdf')
+        self.assertEqual(ctx['indexed_files']['1'], {'hash': 'h', 'gcs_uri': 'gs://b/c/1.pdf', 'display_name': 'one.pdf'})
+        mock_firestore_service.get_job_checkpoints.assert_called_once_with('job1', ['download', 'upload', 'import'])
+
+    @patch('app.services.job_service.firestore_service')
+    def test_run_job_resumes_legacy_inline_checkpoints(self, mock_firestore_service):
+        """Test jobs whose checkpoints are still on the job document can resume"""
+        mock_firestore_service.get_job.return_value = {
+            'job_id': 'job1', 'course_id': 'course1', 'params': {},
+            'completed_stages': ['download', 'upload', 'import'],
+            'checkpoints': {'import': {'corpus_id': 'corpus_abc'}}
+        }
+        mock_firestore_service.get_job_checkpoints.return_value = {}
+        stage_patch, mocks = self._stage_mocks()
+
+        with stage_patch:
+            job_service.run_job('job1')
+
+        self.assertEqual(mocks['summarize'].call_args[0][0]['corpus_id'], 'corpus_abc')
+
+    @patch('app.services.job_service.CHECKPOINT_INLINE_BYTES', 100)
+    @patch('app.services.job_service.gcs_service')
+    @patch('app.services.job_service.firestore_service')
+    def test_large_checkpoints_go_to_gcs(self, mock_firestore_service, mock_gcs_service):
+        """Test outputs too big for a Firestore document are stored in GCS and cleaned up on completion"""
+        mock_firestore_service.get_job.return_value = {
+            'job_id': 'job1', 'course_id': 'course1', 'params': {}, 'completed_stages': []
+        }
+        mock_gcs_service.upload_json.return_value = 'gs://b/jobs/job1/checkpoints/summarize.json'
+        stage_patch, mocks = self._stage_mocks()
+        mocks['summarize'].return_value = {'summaries': {'big.pdf': 'x' * 500}}
+
+        with stage_patch:
+            job_service.run_job('job1')
+
+        mock_gcs_service.upload_json.assert_called_once_with(
+            {'summaries': {'big.pdf': 'x' * 500}}, 'jobs/job1/checkpoints/summarize.json'
+        )
+        mock_firestore_service.save_job_checkpoint.assert_any_call(
+            'job1', 'summarize', gcs_uri='gs://b/jobs/job1/checkpoints/summarize.json'
+        )
+        mock_gcs_service.delete_file.assert_called_once_with('gs://b/jobs/job1/checkpoints/summarize.json')
+
+    @patch('app.services.job_service._start_heartbeat')
+    @patch('app.services.job_service.firestore_service')
+    def test_run_job_stops_when_lease_lost(self, mock_firestore_service, mock_start_heartbeat):
+        """Test a worker whose job was taken over stops without marking it ERROR"""
+        mock_firestore_service.get_job.return_value = {
+            'job_id': 'job1', 'course_id': 'course1', 'params': {}, 'completed_stages': []
+        }
+        stop, lost = job_service.threading.Event(), job_service.threading.Event()
+        mock_start_heartbeat.return_value = (stop, lost)
+        stage_patch, mocks = self._stage_mocks()
+        mocks['download'].side_effect = lambda ctx: lost.set() or {}
+
+        with stage_patch:
+            job_service.run_job('job1')
+
+        mocks['upload'].assert_not_called()
+        self.assertTrue(stop.is_set())
+        for call in mock_firestore_service.update_job.call_args_list:
+            self.assertNotEqual(call[0][1].get('status'), 'ERROR')
+        mock_firestore_service.set_course_error.assert_not_called()
+
+    @patch('app.services.job_service.firestore_service')
+    def test_run_job_records_error(self, mock_firestore_service):
+        """Test a failing stage marks the job and course as ERROR"""
+        mock_firestore_service.get_job.return_value = {
+            'job_id': 'job1', 'course_id': 'course1', 'params': {}, 'completed_stages': [], 'checkpoints': {}
+        }
+        stage_patch, mocks = self._stage_mocks()
+        mocks['upload'].side_effect = Exception("GCS down")
+
+        with stage_patch:
+            job_service.run_job('job1')
+
+        mocks['import'].assert_not_called()
+        mock_firestore_service.update_job.assert_called_with('job1', {'status': 'ERROR', 'error_message': 'GCS down'})
+        mock_firestore_service.set_course_error.assert_called_with('course1', 'GCS down')
+
+    @patch('app.services.job_service.canvas_service')
+    @patch('app.services.job_service.rag_service')
+    @patch('app.services.job_service.firestore_service')
+    def test_resumed_import_restores_local_files(self, mock_firestore_service, mock_rag_service, mock_canvas_service):
+        """Test a job resumed at import on a new host re-downloads files before indexing them locally"""
+        mock_firestore_service.get_job.return_value = {
+            'job_id': 'job1', 'course_id': 'course1', 'params': {}, 'completed_stages': ['download', 'upload']
+        }
+        mock_firestore_service.get_job_checkpoints.return_value = {
+            'download': {'output': {'files': [{'id': 1, 'local_path': '/gone/one.pdf'}], 'indexed_files': {'1': {}}}},
+            'upload': {'output': {'uploaded': {'1': {'gcs_uri': 'gs://b/c/1.pdf', 'display_name': 'one.pdf'}}}}
+        }
+        mock_rag_service.RETRIEVAL_BACKEND = 'local'
+        events = []
+        local_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, local_dir)
+
+        def download(files, *args):
+            events.append('download')
+            for file in files:
+                file['local_path'] = os.path.join(local_dir, f"{file['id']}.pdf")
+                open(file['local_path'], 'w').close()
+
+        mock_canvas_service.download_files.side_effect = download
+        mock_rag_service.create_and_provision_corpus.side_effect = lambda **kwargs: events.append('index') or 'local:abc'
+        mock_rag_service.count_imported_files.return_value = 1
+        stage_patch, mocks = self._stage_mocks()
+        real_import = patch.dict(job_service._PIPELINES[job_service.INITIALIZE_JOB]['functions'],
+                                 {'import': job_service._stage_import})
+
+        with stage_patch, real_import:
+            job_service.run_job('job1')
+
+        self.assertEqual(events, ['download', 'index'])
+        self.assertEqual(mock_canvas_service.download_files.call_args[0][0][0]['id'], 1)
+        self.assertEqual(mocks['summarize'].call_args[0][0]['corpus_id'], 'local:abc')
+
+    @patch('app.services.job_service.canvas_service')
+    @patch('app.services.job_service.rag_service')
+    @patch('app.services.job_service.firestore_service')
+    def test_import_fails_when_files_are_missing_from_corpus(self, mock_firestore_service, mock_rag_service,
+                                                             mock_canvas_service):
+        """Test an import that indexes fewer files than it was given fails instead of completing"""
+        mock_firestore_service.get_job.return_value = {
+            'job_id': 'job1', 'course_id': 'course1', 'params': {}, 'completed_stages': ['download', 'upload']
+        }
+        mock_firestore_service.get_job_checkpoints.return_value = {
+            'download': {'output': {'files': [{'id': 1}, {'id': 2}], 'indexed_files': {}}},
+            'upload': {'output': {'uploaded': {
+                '1': {'gcs_uri': 'gs://b/c/1.pdf', 'display_name': 'one.pdf'},
+                '2': {'gcs_uri': 'gs://b/c/2.pdf', 'display_name': 'two.pdf'}
+            }}}
+        }
+        mock_rag_service.RETRIEVAL_BACKEND = 'local'
+        mock_rag_service.create_and_provision_corpus.return_value = 'local:abc'
+        mock_rag_service.count_imported_files.return_value = 0
+        stage_patch, mocks = self._stage_mocks()
+        real_import = patch.dict(job_service._PIPELINES[job_service.INITIALIZE_JOB]['functions'],
+                                 {'import': job_service._stage_import})
+
+        with stage_patch, real_import:
+            job_service.run_job('job1')
+
+        mocks['summarize'].assert_not_called()
+        saved_stages = [c[0][1] for c in mock_firestore_service.save_job_checkpoint.call_args_list]
+        self.assertNotIn('import', saved_stages)
+        mock_firestore_service.update_job.assert_called_with(
+            'job1', {'status': 'ERROR', 'error_message': 'Only 0/2 files were imported into the corpus'}
+        )
+
+    @patch('app.services.job_service.gcs_service')
+    @patch('app.services.job_service.canvas_service')
+    @patch('app.services.job_service.firestore_service')
+    def test_resumed_stage_fails_when_files_cannot_be_restored(self, mock_firestore_service, mock_canvas_service,
+                                                               mock_gcs_service):
+        """Test a stage whose downloaded inputs are gone on this host fails rather than running on nothing"""
+        mock_firestore_service.get_job.return_value = {
+            'job_id': 'job1', 'course_id': 'course1', 'params': {}, 'completed_stages': ['download']
+        }
+        mock_firestore_service.get_job_checkpoints.return_value = {
+            'download': {'output': {'files': [{'id': 1, 'local_path': '/gone/one.pdf'}], 'indexed_files': {}}}
+        }
+
+        def download(files, *args):
+            for file in files:
+                file['local_path'] = None
+
+        mock_canvas_service.download_files.side_effect = download
+        stage_patch, mocks = self._stage_mocks()
+        real_upload = patch.dict(job_service._PIPELINES[job_service.INITIALIZE_JOB]['functions'],
+                                 {'upload': job_service._stage_upload})
+
+        with stage_patch, real_upload:
+            job_service.run_job('job1')
+
+        mock_gcs_service.upload_course_files.assert_not_called()
+        mock_firestore_service.save_job_checkpoint.assert_not_called()
+        mock_firestore_service.update_job.assert_called_with(
+            'job1', {'status': 'ERROR', 'error_message': '1 downloaded file(s) could not be restored on this host'}
+        )
+
+    @patch('app.services.job_service.gemini_service')
+    @patch('app.services.job_service.canvas_service')
+    def test_stage_without_output_raises(self, mock_canvas_service, mock_gemini_service):
+        """Test a stage that turns non-empty input into nothing raises instead of checkpointing an empty result"""
+        local_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, local_dir)
+        local_path = os.path.join(local_dir, 'one.pdf')
+        open(local_path, 'w').close()
+        ctx = {'course_id': 'course1', 'files': [{'id': 1, 'display_name': 'one.pdf', 'local_path': local_path}]}
+        mock_gemini_service.summarize_files.return_value = [None]
+
+        with self.assertRaises(job_service.JobError):
+            job_service._stage_summarize(ctx)
+        mock_canvas_service.download_files.assert_not_called()
+
+    @patch('app.services.job_service._submit')
+    @patch('app.services.job_service.firestore_service')
+    def test_submit_reuses_active_job(self, mock_firestore_service, mock_submit):
+        """Test submitting while another worker holds the job returns the existing job"""
+        mock_firestore_service.get_latest_job.return_value = {
+            'job_id': 'job1', 'status': 'RUNNING', 'heartbeat_at': job_service.time.time()
+        }
+        mock_firestore_service.claim_job.return_value = False
+
+        job_id = job_service.submit_initialize_job('course1')
+
+        self.assertEqual(job_id, 'job1')
+        mock_firestore_service.claim_job.assert_called_once_with('job1', job_service._owner_id(), job_service.JOB_LEASE_SECONDS)
+        mock_submit.assert_not_called()
+        mock_firestore_service.create_job.assert_not_called()
+
+    @patch('app.services.job_service._submit')
+    @patch('app.services.job_service.firestore_service')
+    def test_submit_resumes_failed_job(self, mock_firestore_service, mock_submit):
+        """Test submitting after a failure resumes the failed job"""
+        mock_firestore_service.get_latest_job.return_value = {'job_id': 'job1', 'status': 'ERROR'}
+        mock_firestore_service.claim_job.return_value = True
+
+        job_id = job_service.submit_initialize_job('course1')
+
+        self.assertEqual(job_id, 'job1')
+        mock_submit.assert_called_once_with('job1')
+        mock_firestore_service.create_job.assert_not_called()
+
+    @patch('app.services.job_service._submit')
+    @patch('app.services.job_service.firestore_service')
+    def test_submit_creates_new_job(self, mock_firestore_service, mock_submit):
+        """Test submitting for a course with no active job creates one"""
+        mock_firestore_service.get_latest_job.return_value = {}
+        mock_firestore_service.create_job.return_value = 'job2'
+
+        job_id = job_service.submit_initialize_job('course1', topics='A, B')
+
+        self.assertEqual(job_id, 'job2')
+        mock_firestore_service.create_job.assert_called_with(
+            'course1', 'initialize_course', {'topics': 'A, B'}, owner=job_service._owner_id()
+        )
+        mock_firestore_service.create_course_doc.assert_called_with('course1')
+        mock_submit.assert_called_once_with('job2')
+
+    @patch('app.services.job_service.firestore_service')
+    def test_run_sync_job_error_keeps_course_active(self, mock_firestore_service):
+        """Test a failing sync marks only the job as ERROR"""
+        mock_firestore_service.get_job.return_value = {
+            'job_id': 'job1', 'course_id': 'course1', 'type': 'sync_course',
+            'params': {}, 'completed_stages': [], 'checkpoints': {}
+        }
+        stage_patch, mocks = self._stage_mocks(job_service.SYNC_JOB)
+        mocks['remove'].side_effect = Exception("RAG down")
+
+        with stage_patch:
+            job_service.run_job('job1')
+
+        mocks['diff'].assert_called_once()
+        mocks['import'].assert_not_called()
+        mock_firestore_service.update_job.assert_called_with('job1', {'status': 'ERROR', 'error_message': 'RAG down'})
+        mock_firestore_service.set_course_error.assert_not_called()
+
+    @patch('app.services.job_service._submit')
+    @patch('app.services.job_service.firestore_service')
+    def test_submit_sync_job(self, mock_firestore_service, mock_submit):
+        """Test submitting a sync creates a sync job without resetting the course doc"""
+        mock_firestore_service.get_latest_job.return_value = {}
+        mock_firestore_service.create_job.return_value = 'job3'
+
+        job_id = job_service.submit_sync_job('course1')
+
+        self.assertEqual(job_id, 'job3')
+        mock_firestore_service.get_latest_job.assert_called_with('course1', 'sync_course')
+        mock_firestore_service.create_job.assert_called_with('course1', 'sync_course', {}, owner=job_service._owner_id())
+        mock_firestore_service.create_course_doc.assert_not_called()
+        mock_submit.assert_called_once_with('job3')
+
+    @patch('app.services.job_service.canvas_service')
+    @patch('app.services.job_service.firestore_service')
+    def test_sync_diff_stage(self, mock_firestore_service, mock_canvas_service):
+        """Test the diff stage selects only added/changed files and keeps unchanged GCS URIs"""
+        stored = {
+            '1': {'hash': 'a', 'gcs_uri': 'gs://b/c/1.pdf', 'display_name': 'one.pdf'},
+            '2': {'hash': 'b', 'gcs_uri': 'gs://b/c/2.pdf', 'display_name': 'two.pdf'},
+            '3': {'hash': 'c', 'gcs_uri': 'gs://b/c/3.pdf', 'display_name': 'three.pdf'},
+        }
+        mock_firestore_service.get_course_data.return_value.to_dict.return_value = {
+            'corpus_id': 'corpus_abc', 'indexed_files': stored
+        }
+        current_files = [{'id': '1'}, {'id': '2'}, {'id': '4'}]
+        current_indexed = {'1': {'hash': 'a'}, '2': {'hash': 'b2'}, '4': {'hash': 'd'}}
+        mock_canvas_service.get_course_files.return_value = (current_files, current_indexed)
+        mock_canvas_service.diff_indexed_files.return_value = {'added': ['4'], 'changed': ['2'], 'removed': ['3']}
+
+        output = job_service._stage_sync_diff({'course_id': 'course1', 'params': {}})
+
+        self.assertEqual(output['corpus_id'], 'corpus_abc')
+        self.assertEqual([f['id'] for f in output['files']], ['2', '4'])
+        self.assertEqual(output['indexed_files']['1']['gcs_uri'], 'gs://b/c/1.pdf')
+        self.assertNotIn('gcs_uri', output['indexed_files']['2'])
+        self.assertEqual(output['stale_uris'], ['gs://b/c/2.pdf', 'gs://b/c/3.pdf'])
+        self.assertEqual(output['removed_uris'], ['gs://b/c/3.pdf'])
+
+    @patch('app.services.job_service.kg_service')
+    @patch('app.services.job_service.firestore_service')
+    def test_sync_without_changes_only_records_sync_time(self, mock_firestore_service, mock_kg_service):
+        """Test an empty diff keeps the graph and corpus_version untouched"""
+        ctx = {'course_id': 'course1', 'corpus_id': 'corpus_abc', 'files': [], 'changed_ids': [], 'removed_ids': [],
+               'indexed_files': {'1': {'hash': 'a'}}}
+
+        ctx.update(job_service._stage_sync_update_kg(ctx))
+        output = job_service._stage_sync_finalize(ctx)
+
+        mock_kg_service.sync_files_in_graph.assert_not_called()
+        mock_firestore_service.update_course_files.assert_not_called()
+        mock_firestore_service.mark_course_synced.assert_called_once_with('course1')
+        self.assertEqual(output['added_count'] + output['changed_count'] + output['removed_count'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
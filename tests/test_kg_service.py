@@ -3,6 +3,7 @@ from unittest.mock import patch, MagicMock
 import sys
 import os
 import json
+import time
 
 # Add parent directory to path to import app modules
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -40,6 +41,36 @@ class TestKgService(unittest.TestCase):
         self.assertIn('topic_2', data)
         self.assertEqual(data['topic_1']['summary'], "This is a summary")
 
+    @patch('app.services.kg_service.gemini_service.generate_answer_with_context')
+    def test_build_knowledge_graph_parallel_topic_ids(self, mock_generate_answer):
+        """Test topic IDs follow input order even when topics finish out of order"""
+        def fake_answer(query, corpus_id):
+            if 'Cell Mitosis' in query:
+                time.sleep(0.05)  # first topic finishes last
+                return ("Mitosis summary", [{'filename': 'Chapter 3.pdf'}])
+            if 'Broken Topic' in query:
+                raise Exception("RAG down")
+            return ("DNA summary", [{'filename': 'Lecture 5.pdf'}])
+
+        mock_generate_answer.side_effect = fake_answer
+
+        nodes_json, edges_json, data_json = kg_service.build_knowledge_graph(
+            ['Cell Mitosis', 'DNA Replication', 'Broken Topic'], self.corpus_id, self.sample_files
+        )
+
+        nodes = json.loads(nodes_json)
+        edges = json.loads(edges_json)
+        data = json.loads(data_json)
+
+        topic_nodes = [n for n in nodes if n['group'] == 'topic']
+        self.assertEqual(
+            [(n['id'], n['label']) for n in topic_nodes],
+            [('topic_1', 'Cell Mitosis'), ('topic_2', 'DNA Replication'), ('topic_3', 'Broken Topic')]
+        )
+        self.assertEqual(edges, [{'from': 'topic_1', 'to': '101'}, {'from': 'topic_2', 'to': '102'}])
+        self.assertEqual(data['topic_1']['summary'], "Mitosis summary")
+        self.assertEqual(data['topic_3']['sources'], [])
+
     @patch('app.services.kg_service.gemini_service.generate_answer')
     def test_extract_topics_from_summaries(self, mock_generate_answer):
         """Test extract_topics_from_summaries function"""
@@ -104,6 +135,39 @@ class TestKgService(unittest.TestCase):
         self.assertNotIn('topic_1', data)
         self.assertIn('topic_2', data)
 
+    @patch('app.services.kg_service.rag_service.retrieve_context')
+    def test_sync_files_in_graph(self, mock_retrieve_context):
+        """Test sync_files_in_graph drops removed files and links new ones"""
+        mock_retrieve_context.return_value = ("context", [{'filename': 'Lecture 6.pdf'}])
+        existing_nodes = [
+            {'id': 'topic_1', 'label': 'Cell Mitosis', 'group': 'topic'},
+            {'id': '101', 'label': 'Chapter 3.pdf', 'group': 'file_pdf'},
+            {'id': '102', 'label': 'Lecture 5.pdf', 'group': 'file_pdf'}
+        ]
+        existing_edges = [
+            {'from': 'topic_1', 'to': '101'},
+            {'from': 'topic_1', 'to': '102'}
+        ]
+        existing_data = {
+            'topic_1': {'summary': 'summary 1', 'sources': [{'filename': 'Chapter 3.pdf'}, {'filename': 'Lecture 5.pdf'}]}
+        }
+        upserted_files = [{'id': '103', 'display_name': 'Lecture 6.pdf'}]
+
+        nodes_json, edges_json, data_json = kg_service.sync_files_in_graph(
+            self.corpus_id, existing_nodes, existing_edges, existing_data, upserted_files, ['102']
+        )
+
+        nodes = json.loads(nodes_json)
+        edges = json.loads(edges_json)
+        data = json.loads(data_json)
+
+        self.assertEqual({n['id'] for n in nodes}, {'topic_1', '101', '103'})
+        self.assertEqual(edges, [{'from': 'topic_1', 'to': '101'}, {'from': 'topic_1', 'to': '103'}])
+        self.assertEqual(
+            [s['filename'] for s in data['topic_1']['sources']], ['Chapter 3.pdf', 'Lecture 6.pdf']
+        )
+        self.assertEqual(data['topic_1']['summary'], 'summary 1')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,198 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import json
+import shutil
+import tempfile
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import local_index_service
+
+VOCABULARY = ['recursion', 'sorting', 'graphs']
+
+
+def fake_embed(texts, **kwargs):
+    """Embeds text as counts of a few vocabulary words, so similarity is predictable"""
+    return [[float(text.lower().count(word)) + 0.01 for word in VOCABULARY] for text in texts]
+
+
+class TestLocalIndexService(unittest.TestCase):
+    """Test suite for Local Index service functions"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir_patch = patch.object(local_index_service, 'INDEX_DIR', os.path.join(self.tmp_dir.name, 'index'))
+        self.dir_patch.start()
+        # The GCS copy is exercised by the tests that use _fake_gcs()
+        self.sync_patch = patch.object(local_index_service, 'INDEX_GCS_SYNC', False)
+        self.sync_patch.start()
+
+    def tearDown(self):
+        self.sync_patch.stop()
+        self.dir_patch.stop()
+        self.tmp_dir.cleanup()
+
+    def _fake_gcs(self, objects):
+        """Patches gcs_service with an in-memory bucket ({blob_path: bytes})"""
+        def path(gcs_uri):
+            return gcs_uri.split('/', 3)[3]
+
+        def download(gcs_uri):
+            if path(gcs_uri) not in objects:
+                raise Exception(f"404 {gcs_uri}")
+            return objects[path(gcs_uri)]
+
+        def download_file(gcs_uri, local_path):
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with open(local_path, 'wb') as f:
+                f.write(download(gcs_uri))
+
+        def upload_file(local_path, blob_path):
+            with open(local_path, 'rb') as f:
+                objects[blob_path] = f.read()
+
+        return patch.multiple(
+            'app.services.gcs_service',
+            BUCKET_NAME='bucket',
+            upload_file=upload_file,
+            upload_json=lambda data, blob_path: objects.__setitem__(blob_path, json.dumps(data).encode()),
+            download_json=lambda gcs_uri: json.loads(download(gcs_uri)),
+            download_file=download_file,
+            delete_file=lambda gcs_uri: objects.pop(path(gcs_uri), None) is not None
+        )
+
+    def _new_host(self, index_id):
+        """Simulates another replica or a restarted pod: no local files, nothing cached"""
+        shutil.rmtree(local_index_service._index_path(index_id))
+        local_index_service._loaded.pop(index_id, None)
+        local_index_service._synced_at.pop(index_id, None)
+
+    def _file(self, name, text):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return {'id': name, 'display_name': name, 'local_path': path, 'gcs_uri': f'gs://bucket/{name}'}
+
+    def test_chunk_text_uses_size_and_overlap(self):
+        """Test chunks are chunk_size words long and overlap by chunk_overlap words"""
+        words = [f'w{i}' for i in range(10)]
+
+        chunks = local_index_service.chunk_text(' '.join(words), chunk_size=4, chunk_overlap=1)
+
+        self.assertEqual(chunks, ['w0 w1 w2 w3', 'w3 w4 w5 w6', 'w6 w7 w8 w9'])
+
+    @patch('app.services.gemini_service.get_embedding')
+    @patch('app.services.gemini_service.get_embeddings_batch')
+    def test_create_and_retrieve(self, mock_embed_batch, mock_embed_query):
+        """Test files are indexed and the closest chunks come back in Vertex's result shape"""
+        mock_embed_batch.side_effect = fake_embed
+        mock_embed_query.side_effect = lambda text, **kwargs: fake_embed([text])[0]
+        files = [
+            self._file('recursion.txt', 'recursion recursion base case'),
+            self._file('sorting.md', 'sorting algorithms and sorting'),
+        ]
+
+        index_id = local_index_service.create_index(files, chunk_size=512, chunk_overlap=100)
+        chunks = local_index_service.retrieve_chunks(index_id, 'explain recursion', top_k=5, threshold=0.5)
+
+        self.assertTrue(local_index_service.is_local_index(index_id))
+        self.assertEqual([c['text'] for c in chunks], ['recursion recursion base case'])
+        self.assertEqual(chunks[0]['source_uri'], 'gs://bucket/recursion.txt')
+        self.assertLess(chunks[0]['distance'], 0.01)
+        mock_embed_batch.assert_called_once()
+        self.assertEqual(mock_embed_batch.call_args.kwargs['task_type'], 'RETRIEVAL_DOCUMENT')
+
+    @patch('app.services.gemini_service.get_embeddings_batch')
+    def test_reimport_replaces_and_delete_removes(self, mock_embed_batch):
+        """Test re-importing a file replaces its chunks and deleting drops them"""
+        mock_embed_batch.side_effect = fake_embed
+        graphs = self._file('notes.txt', 'graphs')
+        index_id = local_index_service.create_index([graphs, self._file('other.txt', 'sorting')], 512, 100)
+
+        graphs = self._file('notes.txt', 'recursion')
+        local_index_service.import_files(index_id, [graphs], 512, 100)
+
+        self.assertEqual(local_index_service.search_chunks(index_id, [0.0, 0.0, 1.0], top_k=5, threshold=0.5), [])
+        chunks = local_index_service.search_chunks(index_id, [1.0, 0.0, 0.0], top_k=5, threshold=0.5)
+        self.assertEqual([c['text'] for c in chunks], ['recursion'])
+
+        self.assertEqual(local_index_service.delete_files(index_id, ['gs://bucket/notes.txt']), 1)
+        self.assertEqual(local_index_service.search_chunks(index_id, [1.0, 0.0, 0.0], top_k=5, threshold=0.5), [])
+
+    @patch('app.services.gemini_service.get_embeddings_batch')
+    def test_search_returns_top_k_by_distance(self, mock_embed_batch):
+        """Test search keeps only the top_k closest chunks, closest first"""
+        mock_embed_batch.side_effect = fake_embed
+        files = [self._file(f'f{i}.txt', 'recursion ' * i + 'sorting') for i in range(1, 6)]
+        index_id = local_index_service.create_index(files, 512, 100)
+
+        chunks = local_index_service.search_chunks(index_id, [1.0, 0.0, 0.0], top_k=2, threshold=1.0)
+
+        self.assertEqual([c['source_uri'] for c in chunks], ['gs://bucket/f5.txt', 'gs://bucket/f4.txt'])
+        self.assertLessEqual(chunks[0]['distance'], chunks[1]['distance'])
+
+    @patch('app.services.gemini_service.get_embeddings_batch')
+    def test_index_restored_from_gcs_on_another_host(self, mock_embed_batch):
+        """Test an index written on one host is downloaded on first use by another"""
+        mock_embed_batch.side_effect = fake_embed
+        objects = {}
+        with patch.object(local_index_service, 'INDEX_GCS_SYNC', True), self._fake_gcs(objects):
+            index_id = local_index_service.create_index([self._file('notes.txt', 'recursion')], 512, 100)
+            local_index_service.import_files(index_id, [self._file('more.txt', 'sorting')], 512, 100)
+            # Only the current generation is kept in GCS
+            self.assertEqual(len(objects), 3)
+
+            self._new_host(index_id)
+            chunks = local_index_service.search_chunks(index_id, [1.0, 0.0, 0.0], top_k=5, threshold=0.5)
+
+        self.assertEqual([c['text'] for c in chunks], ['recursion'])
+
+    def test_missing_index_raises_clear_error(self):
+        """Test an index found neither locally nor in GCS raises IndexUnavailableError"""
+        with patch.object(local_index_service, 'INDEX_GCS_SYNC', True), self._fake_gcs({}):
+            with self.assertRaises(local_index_service.IndexUnavailableError):
+                local_index_service.search_chunks('local:missing', [1.0, 0.0, 0.0])
+
+        with self.assertRaises(local_index_service.IndexUnavailableError):
+            local_index_service.search_chunks('local:missing', [1.0, 0.0, 0.0])
+
+    def test_tokenize_keeps_identifiers_whole(self):
+        """Test dotted, hyphenated and underscored terms survive tokenization"""
+        self.assertEqual(
+            local_index_service.tokenize("Theorem 4.2 and HW-3 use merge_sort()"),
+            ['theorem', '4.2', 'and', 'hw-3', 'use', 'merge_sort']
+        )
+
+    def test_reciprocal_rank_fusion(self):
+        """Test items ranked well by several retrievers come first"""
+        self.assertEqual(local_index_service.reciprocal_rank_fusion([[3, 1, 2], [2, 3]]), [3, 2, 1])
+
+    @patch('app.services.gemini_service.get_embeddings_batch')
+    def test_hybrid_search_finds_exact_terms(self, mock_embed_batch):
+        """Test a chunk matching a rare exact term is returned even when its vector is far"""
+        mock_embed_batch.side_effect = fake_embed
+        files = [
+            self._file('lecture.txt', 'recursion recursion'),
+            self._file('hw.txt', 'sorting homework hw-7 due friday'),
+        ]
+        index_id = local_index_service.create_index(files, 512, 100)
+
+        # The query vector points at 'recursion'; only BM25 knows about hw-7
+        chunks = local_index_service.search_chunks(
+            index_id, [1.0, 0.0, 0.0], top_k=2, threshold=0.3, query_text='when is hw-7 due'
+        )
+        self.assertEqual(
+            {c['text'] for c in chunks}, {'recursion recursion', 'sorting homework hw-7 due friday'}
+        )
+
+        with patch.object(local_index_service, 'HYBRID_SEARCH', False):
+            chunks = local_index_service.search_chunks(
+                index_id, [1.0, 0.0, 0.0], top_k=2, threshold=0.3, query_text='when is hw-7 due'
+            )
+        self.assertEqual([c['text'] for c in chunks], ['recursion recursion'])
+
+if __name__ == '__main__':
+    unittest.main()
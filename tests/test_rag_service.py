@@ -2,6 +2,7 @@ import unittest
 from unittest.mock import patch, MagicMock
 import sys
 import os
+import tempfile
 
 # Add parent directory to path to import app modules
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -11,9 +12,19 @@ from app.services import rag_service
 class TestRagService(unittest.TestCase):
     """Test suite for RAG service functions"""
 
+    def setUp(self):
+        rag_service.invalidate_retrieval_cache()
+
+    def _rag_file(self, gcs_uri):
+        """Build a listed RAG file imported from a GCS URI"""
+        rag_file = MagicMock()
+        rag_file.gcs_source.uris = [gcs_uri]
+        return rag_file
+
+    @patch('app.services.rag_service.rag.list_files')
     @patch('app.services.rag_service.rag.create_corpus')
     @patch('app.services.rag_service.rag.import_files')
-    def test_create_and_provision_corpus(self, mock_import_files, mock_create_corpus):
+    def test_create_and_provision_corpus(self, mock_import_files, mock_create_corpus, mock_list_files):
         """Test create_and_provision_corpus function"""
         # Mock the rag.create_corpus call
         mock_corpus = MagicMock()
@@ -25,10 +36,49 @@ class TestRagService(unittest.TestCase):
             {'id': '2', 'display_name': 'file2.pdf', 'gcs_uri': 'gs://bucket/file2.pdf'},
         ]
 
+        mock_list_files.return_value = [self._rag_file(f['gcs_uri']) for f in files_to_upload]
+
         corpus_name = rag_service.create_and_provision_corpus(files_to_upload)
 
         self.assertEqual(corpus_name, "corpora/test_corpus")
         mock_create_corpus.assert_called_once()
+        # Both files go into a single import operation
+        self.assertEqual(mock_import_files.call_count, 1)
+        self.assertEqual(mock_import_files.call_args[1]['paths'], ['gs://bucket/file1.pdf', 'gs://bucket/file2.pdf'])
+
+    @patch('app.services.rag_service.rag.list_files')
+    @patch('app.services.rag_service.rag.import_files')
+    def test_import_files_to_corpus_batches_and_retries(self, mock_import_files, mock_list_files):
+        """Test URIs are batched and files missing after the batch are retried individually"""
+        files = [
+            {'id': str(i), 'display_name': f'file{i}.pdf', 'gcs_uri': f'gs://bucket/file{i}.pdf'}
+            for i in range(30)
+        ]
+        # file7 did not land in the corpus after the batched imports
+        mock_list_files.return_value = [self._rag_file(f['gcs_uri']) for f in files if f['id'] != '7']
+        mock_import_files.return_value.failed_rag_files_count = 0
+
+        count = rag_service.import_files_to_corpus("corpora/test_corpus", files)
+
+        self.assertEqual(count, 30)
+        batch_sizes = sorted(len(c[1]['paths']) for c in mock_import_files.call_args_list)
+        self.assertEqual(batch_sizes, [1, 5, 25])
+        self.assertEqual(mock_import_files.call_args_list[-1][1]['paths'], ['gs://bucket/file7.pdf'])
+
+    @patch('app.services.rag_service.rag.list_files')
+    @patch('app.services.rag_service.rag.import_files')
+    def test_import_files_to_corpus_reports_failures(self, mock_import_files, mock_list_files):
+        """Test a file that fails in its batch and on retry is not counted"""
+        files = [
+            {'id': '1', 'display_name': 'good.pdf', 'gcs_uri': 'gs://bucket/good.pdf'},
+            {'id': '2', 'display_name': 'bad.pdf', 'gcs_uri': 'gs://bucket/bad.pdf'},
+        ]
+        mock_list_files.return_value = [self._rag_file('gs://bucket/good.pdf')]
+        mock_import_files.return_value.failed_rag_files_count = 1
+
+        count = rag_service.import_files_to_corpus("corpora/test_corpus", files)
+
+        self.assertEqual(count, 1)
         self.assertEqual(mock_import_files.call_count, 2)
 
 
@@ -58,5 +108,106 @@ class TestRagService(unittest.TestCase):
         self.assertEqual(contexts[0], "This is context 1.")
         self.assertEqual(sources[0]['filename'], "file1.pdf")
 
+    @patch('app.services.rag_service.rag.retrieval_query')
+    @patch('app.services.rag_service.local_index_service')
+    def test_retrieve_context_local_backend(self, mock_local_index, mock_retrieval_query):
+        """Test local corpus IDs are served by the local index, not Vertex"""
+        mock_local_index.is_local_index.return_value = True
+        mock_local_index.retrieve_chunks.return_value = [
+            {'text': "chunk", 'source_uri': 'gs://bucket/a.pdf', 'distance': 0.1}
+        ]
+
+        contexts, sources = rag_service.retrieve_context("local:abc", "What is a test?", top_k=3, threshold=0.4)
+
+        self.assertEqual(contexts, ["chunk"])
+        self.assertEqual(sources, [{'filename': 'a.pdf', 'source_uri': 'gs://bucket/a.pdf', 'distance': 0.1}])
+        mock_local_index.retrieve_chunks.assert_called_once_with("local:abc", "What is a test?", 3, 0.4)
+        mock_retrieval_query.assert_not_called()
+
+    @patch('app.services.rag_service.RETRIEVAL_BACKEND', 'local')
+    @patch('app.services.rag_service.rag.create_corpus')
+    @patch('app.services.rag_service.local_index_service')
+    def test_create_corpus_local_backend(self, mock_local_index, mock_create_corpus):
+        """Test RETRIEVAL_BACKEND=local builds a local index with the corpus chunk settings"""
+        mock_local_index.create_index.return_value = "local:abc"
+        files = [{'id': '1', 'local_path': '/tmp/a.pdf', 'gcs_uri': 'gs://bucket/a.pdf'}]
+
+        corpus_name = rag_service.create_and_provision_corpus(files)
+
+        self.assertEqual(corpus_name, "local:abc")
+        mock_local_index.create_index.assert_called_once_with(files, rag_service.CHUNK_SIZE, rag_service.CHUNK_OVERLAP)
+        mock_create_corpus.assert_not_called()
+
+    @patch('app.services.rag_service.rag.list_files')
+    @patch('app.services.rag_service.local_index_service')
+    def test_count_imported_files(self, mock_local_index, mock_list_files):
+        """Test imported files are counted from the local index or the corpus listing"""
+        files = [{'id': '1', 'gcs_uri': 'gs://bucket/a.pdf'}, {'id': '2', 'gcs_uri': 'gs://bucket/b.pdf'}, {'id': '3'}]
+        mock_local_index.is_local_index.side_effect = lambda corpus_id: corpus_id.startswith('local:')
+        mock_local_index.indexed_uris.return_value = {'gs://bucket/a.pdf', 'gs://bucket/other.pdf'}
+        rag_file = MagicMock()
+        rag_file.gcs_source.uris = ['gs://bucket/a.pdf']
+        mock_list_files.return_value = [rag_file, MagicMock(gcs_source=MagicMock(uris=['gs://bucket/b.pdf']))]
+
+        self.assertEqual(rag_service.count_imported_files('local:abc', files), 1)
+        self.assertEqual(rag_service.count_imported_files('projects/p/ragCorpora/1', files), 2)
+
+    def _retrieval_response(self, text="Cached context.", uri="gs://bucket/file1.pdf"):
+        context = MagicMock()
+        context.text = text
+        context.source_uri = uri
+        context.distance = 0.1
+        response = MagicMock()
+        response.contexts.contexts = [context]
+        return response
+
+    @patch('app.services.rag_service.rag.retrieval_query')
+    def test_retrieval_cache_hits_normalized_query(self, mock_retrieval_query):
+        """Test repeated (normalized) queries are served from the cache and counted"""
+        mock_retrieval_query.return_value = self._retrieval_response()
+        before = rag_service.get_retrieval_cache_stats()
+
+        first = rag_service.retrieve_chunks("corpus_id", "What is a test?", corpus_version=1)
+        second = rag_service.retrieve_chunks("corpus_id", "  what is a TEST ", corpus_version=1)
+        rag_service.retrieve_chunks("corpus_id", "What is a test?", top_k=5, corpus_version=1)
+
+        self.assertEqual(first, second)
+        self.assertEqual(mock_retrieval_query.call_count, 2)
+        stats = rag_service.get_retrieval_cache_stats()
+        self.assertEqual(stats['hits'] - before['hits'], 1)
+        self.assertEqual(stats['misses'] - before['misses'], 2)
+
+    @patch('app.services.rag_service.rag.retrieval_query')
+    def test_retrieval_cache_keyed_by_corpus_version(self, mock_retrieval_query):
+        """Test a new corpus_version misses the cache, and retrievals without a version are never cached"""
+        mock_retrieval_query.return_value = self._retrieval_response()
+
+        rag_service.retrieve_chunks("corpus_id", "What is a test?", corpus_version=1)
+        rag_service.retrieve_chunks("corpus_id", "What is a test?", corpus_version=1)
+        self.assertEqual(mock_retrieval_query.call_count, 1)
+
+        # A sync bumped corpus_version on the course document; no local invalidation happened
+        rag_service.retrieve_chunks("corpus_id", "What is a test?", corpus_version=2)
+        self.assertEqual(mock_retrieval_query.call_count, 2)
+
+        rag_service.retrieve_chunks("corpus_id", "What is a test?")
+        rag_service.retrieve_chunks("corpus_id", "What is a test?")
+        self.assertEqual(mock_retrieval_query.call_count, 4)
+
+    @patch('app.services.rag_service.rag.retrieval_query')
+    def test_retrieval_cache_shared_disk_layer(self, mock_retrieval_query):
+        """Test another worker (empty memory cache) is served from the shared directory for the same corpus_version"""
+        mock_retrieval_query.return_value = self._retrieval_response()
+        with tempfile.TemporaryDirectory() as cache_dir, patch.object(rag_service, 'RETRIEVAL_CACHE_DIR', cache_dir):
+            rag_service.retrieve_chunks("corpus_id", "What is a test?", corpus_version=1)
+            rag_service._retrieval_cache.clear()  # Simulate a different worker process
+
+            chunks = rag_service.retrieve_chunks("corpus_id", "What is a test?", corpus_version=1)
+            self.assertEqual(chunks[0]['text'], "Cached context.")
+            self.assertEqual(mock_retrieval_query.call_count, 1)
+
+            rag_service.retrieve_chunks("corpus_id", "What is a test?", corpus_version=2)
+            self.assertEqual(mock_retrieval_query.call_count, 2)
+
 if __name__ == '__main__':
     unittest.main()
@@ -33,43 +33,168 @@ def test_launch_active_instructor(mock_firestore_service, client):
     assert response.status_code == 200
     assert b'teacher_view' in response.data
 
+@patch('app.routes.answer_cache_service')
+@patch('app.routes.analytics_logging_service')
 @patch('app.routes.firestore_service')
 @patch('app.routes.gemini_service')
-def test_chat(mock_gemini_service, mock_firestore_service, client):
+def test_chat(mock_gemini_service, mock_firestore_service, mock_analytics, mock_answer_cache, client):
     """Test the chat endpoint"""
-    mock_firestore_service.get_course_data.return_value.to_dict.return_value = {'corpus_id': 'test_corpus'}
+    mock_firestore_service.get_course_data.return_value.to_dict.return_value = {'corpus_id': 'test_corpus', 'corpus_version': 3}
     mock_gemini_service.generate_answer_with_context.return_value = ("Test answer", [])
+    mock_answer_cache.lookup.return_value = None
+    mock_analytics.log_chat_query.return_value = 'log_1'
     
     response = client.post('/api/chat', json={'course_id': '123', 'query': 'What is a test?'})
     
     assert response.status_code == 200
     data = json.loads(response.data)
     assert data['answer'] == 'Test answer'
+    mock_answer_cache.store.assert_called_once()
+    # Retrieval results are cached per corpus_version, so workers pick up a sync when they re-read the course
+    assert mock_gemini_service.generate_answer_with_context.call_args.kwargs['corpus_version'] == 3
 
+@patch('app.routes.answer_cache_service')
+@patch('app.routes.analytics_logging_service')
 @patch('app.routes.firestore_service')
-@patch('app.routes.canvas_service')
-@patch('app.routes.gcs_service')
-@patch('app.routes.rag_service')
-@patch('app.routes.kg_service')
 @patch('app.routes.gemini_service')
-def test_initialize_course(mock_gemini, mock_kg, mock_rag, mock_gcs, mock_canvas, mock_firestore, client):
-    """Test the initialize course endpoint"""
-    mock_canvas.get_course_files.return_value = ([{'id': '1', 'display_name': 'file1.pdf', 'local_path': '/fake/path'}], {'1': {}})
-    mock_gcs.upload_course_files.return_value = [{'id': '1', 'display_name': 'file1.pdf', 'gcs_uri': 'gs://bucket/file1.pdf'}]
-    mock_rag.create_and_provision_corpus.return_value = "corpus_id_123"
-    mock_kg.build_knowledge_graph.return_value = ("nodes", "edges", "data")
+def test_chat_answer_cache_hit(mock_gemini_service, mock_firestore_service, mock_analytics, mock_answer_cache, client):
+    """Test a near-duplicate question is answered from the cache without calling Gemini"""
+    mock_firestore_service.get_course_data.return_value.to_dict.return_value = {'corpus_id': 'test_corpus'}
+    mock_analytics.get_query_vector.return_value = [0.1, 0.2]
+    mock_answer_cache.lookup.return_value = {'answer': 'Cached answer', 'sources': [], 'similarity': 0.99}
+    mock_analytics.log_chat_query.return_value = 'log_1'
+    
+    response = client.post('/api/chat', json={'course_id': '123', 'query': 'What is a test?'})
+    
+    assert response.status_code == 200
+    assert response.json['answer'] == 'Cached answer'
+    mock_gemini_service.generate_answer_with_context.assert_not_called()
+    mock_analytics.log_chat_query.assert_called_with(
+        course_id='123', query_text='What is a test?', answer_text='Cached answer', sources=[], query_vector=[0.1, 0.2]
+    )
+
+@patch('app.routes.answer_cache_service')
+@patch('app.routes.analytics_logging_service')
+@patch('app.routes.firestore_service')
+@patch('app.routes.gemini_service')
+def test_chat_stream(mock_gemini_service, mock_firestore_service, mock_analytics, mock_answer_cache, client):
+    """Test the streaming chat endpoint sends sources, tokens, then done"""
+    mock_firestore_service.get_course_data.return_value.to_dict.return_value = {'corpus_id': 'test_corpus'}
+    sources = [
+        {'filename': 'b.pdf', 'source_uri': 'gs://bucket/b.pdf', 'distance': 0.2},
+        {'filename': 'far.pdf', 'source_uri': 'gs://bucket/far.pdf', 'distance': 0.9},
+        {'filename': 'a.pdf', 'source_uri': 'gs://bucket/a.pdf', 'distance': 0.1},
+    ]
+    mock_gemini_service.stream_answer_with_context.return_value = (sources, iter(["Test ", "answer"]))
+    mock_analytics.log_chat_query.return_value = 'log_1'
+    mock_analytics.get_query_vector.return_value = [0.1, 0.2]
+    mock_answer_cache.lookup.return_value = None
+
+    response = client.post('/api/chat/stream', json={'course_id': '123', 'query': 'What is a test?'})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = [
+        (frame.split('\n')[0][len('event: '):], json.loads(frame.split('\n')[1][len('data: '):]))
+        for frame in response.get_data(as_text=True).strip().split('\n\n')
+    ]
+    assert [name for name, _ in events] == ['sources', 'token', 'token', 'done']
+    assert [source['filename'] for source in events[0][1]] == ['a.pdf', 'b.pdf']
+    assert ''.join(payload['text'] for name, payload in events if name == 'token') == 'Test answer'
+    assert events[-1][1] == {'log_doc_id': 'log_1'}
+    mock_analytics.log_chat_query.assert_called_with(
+        course_id='123', query_text='What is a test?', answer_text='Test answer', sources=sources, query_vector=[0.1, 0.2]
+    )
+    mock_answer_cache.store.assert_called_once_with(
+        '123', 'What is a test?', [0.1, 0.2], mock_answer_cache.corpus_version.return_value, 'Test answer', sources
+    )
+
+@patch('app.routes.answer_cache_service')
+@patch('app.routes.analytics_logging_service')
+@patch('app.routes.firestore_service')
+@patch('app.routes.gemini_service')
+def test_chat_answer_cache_disabled(mock_gemini_service, mock_firestore_service, mock_analytics, mock_answer_cache, client):
+    """Test no embedding is requested on the chat path when the answer cache is off"""
+    mock_firestore_service.get_course_data.return_value.to_dict.return_value = {'corpus_id': 'test_corpus'}
+    mock_gemini_service.generate_answer_with_context.return_value = ("Test answer", [])
+    mock_gemini_service.stream_answer_with_context.return_value = ([], iter(["Test answer"]))
+    mock_answer_cache.ANSWER_CACHE_ENABLED = False
+    mock_answer_cache.lookup.return_value = None
+    mock_analytics.log_chat_query.return_value = 'log_1'
+    
+    response = client.post('/api/chat', json={'course_id': '123', 'query': 'What is a test?'})
+    assert response.status_code == 200
+    response = client.post('/api/chat/stream', json={'course_id': '123', 'query': 'What is a test?'})
+    assert response.status_code == 200
+    response.get_data()
+    
+    mock_analytics.get_query_vector.assert_not_called()
+    for call in mock_analytics.log_chat_query.call_args_list:
+        assert call.kwargs['query_vector'] is None
+    assert mock_analytics.log_chat_query.call_count == 2
+
+@patch('app.routes.job_service')
+def test_initialize_course(mock_job_service, client):
+    """Test the initialize course endpoint queues a background job"""
+    mock_job_service.submit_initialize_job.return_value = "job_123"
 
     response = client.post('/api/initialize-course', json={'course_id': '123'})
 
+    assert response.status_code == 202
+    data = json.loads(response.data)
+    assert data['status'] == 'queued'
+    assert data['job_id'] == 'job_123'
+    mock_job_service.submit_initialize_job.assert_called_with('123', topics=None)
+
+@patch('app.routes.job_service')
+def test_get_job(mock_job_service, client):
+    """Test the job status endpoint"""
+    mock_job_service.get_job_status.return_value = {'job_id': 'job_123', 'status': 'RUNNING', 'current_stage': 'summarize'}
+
+    response = client.get('/api/jobs/job_123')
+
     assert response.status_code == 200
     data = json.loads(response.data)
-    assert data['status'] == 'complete'
-    assert data['corpus_id'] == 'corpus_id_123'
+    assert data['current_stage'] == 'summarize'
+
+@patch('app.routes.job_service')
+def test_get_job_not_found(mock_job_service, client):
+    """Test the job status endpoint for an unknown job"""
+    mock_job_service.get_job_status.return_value = {}
+
+    response = client.get('/api/jobs/missing')
+
+    assert response.status_code == 404
+
+@patch('app.routes.job_service')
+@patch('app.routes.firestore_service')
+def test_sync_course(mock_firestore, mock_job_service, client):
+    """Test the sync course endpoint queues a sync job"""
+    mock_firestore.get_course_state.return_value = 'ACTIVE'
+    mock_job_service.submit_sync_job.return_value = 'job2'
+
+    response = client.post('/api/sync-course', json={'course_id': '123'})
+
+    assert response.status_code == 202
+    assert response.json['job_id'] == 'job2'
+    mock_job_service.submit_sync_job.assert_called_with('123')
+
+@patch('app.routes.job_service')
+@patch('app.routes.firestore_service')
+def test_sync_course_not_active(mock_firestore, mock_job_service, client):
+    """Test the sync course endpoint rejects courses that are not ACTIVE"""
+    mock_firestore.get_course_state.return_value = 'GENERATING'
+
+    response = client.post('/api/sync-course', json={'course_id': '123'})
+
+    assert response.status_code == 400
+    mock_job_service.submit_sync_job.assert_not_called()
 
 @patch('app.routes.firestore_service')
 def test_get_graph(mock_firestore, client):
     """Test the get graph endpoint"""
-    mock_firestore.get_course_data.return_value.get.side_effect = ['nodes', 'edges', 'data', 'indexed_files']
+    mock_firestore.get_course_data.return_value.to_dict.return_value = {'indexed_files': 'indexed_files'}
+    mock_firestore.get_course_graph.return_value = {'kg_nodes': 'nodes', 'kg_edges': 'edges', 'kg_data': 'data'}
 
     response = client.get('/api/get-graph?course_id=123')
 
@@ -78,6 +203,7 @@ def test_get_graph(mock_firestore, client):
     assert data['nodes'] == 'nodes'
     assert data['edges'] == 'edges'
     assert data['data'] == 'data'
+    assert data['indexed_files'] == 'indexed_files'
 
 @patch('app.routes.gcs_service')
 def test_download_source(mock_gcs, client):
@@ -102,7 +228,8 @@ def test_rate_answer(mock_analytics, client):
 def test_remove_topic(mock_firestore, mock_kg, client):
     """Test the remove topic endpoint"""
     mock_firestore.get_course_data.return_value.exists = True
-    mock_firestore.get_course_data.return_value.to_dict.return_value = {'status': 'ACTIVE', 'kg_nodes': '[]', 'kg_edges': '[]', 'kg_data': '{}'}
+    mock_firestore.get_course_data.return_value.to_dict.return_value = {'status': 'ACTIVE'}
+    mock_firestore.get_course_graph.return_value = {'kg_nodes': '[]', 'kg_edges': '[]', 'kg_data': '{}'}
     mock_kg.remove_topic_from_graph.return_value = ("new_nodes", "new_edges", "new_data")
 
     response = client.post('/api/remove-topic', json={'course_id': '123', 'topic_id': 'topic_1'})
@@ -142,8 +269,9 @@ def test_add_topic(mock_firestore, mock_kg, client):
     """Test the add topic endpoint"""
     mock_firestore.get_course_data.return_value.exists = True
     mock_firestore.get_course_data.return_value.to_dict.return_value = {
-        'status': 'ACTIVE', 'corpus_id': 'corpus1', 'kg_nodes': '[]', 'kg_edges': '[]', 'kg_data': '{}'
+        'status': 'ACTIVE', 'corpus_id': 'corpus1'
     }
+    mock_firestore.get_course_graph.return_value = {'kg_nodes': '[]', 'kg_edges': '[]', 'kg_data': '{}'}
     mock_kg.add_topic_to_graph.return_value = ("new_nodes", "new_edges", "new_data")
 
     response = client.post('/api/add-topic', json={'course_id': '123', 'topic_name': 'New Topic'})
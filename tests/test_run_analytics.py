@@ -0,0 +1,80 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import time
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.commands import run_analytics
+
+
+def fake_analyze(course_id, incremental, conn):
+    """Stands in for _analyze_course in the worker processes"""
+    if course_id == 'crash':
+        os._exit(3)
+    if course_id == 'hang':
+        time.sleep(60)
+    conn.send({'status': 'complete', 'total_queries': 10, 'num_clusters': 2})
+    conn.close()
+
+
+# Forked workers inherit the patched _analyze_course (spawned ones would re-import the real one)
+@patch('app.commands.run_analytics.START_METHOD', 'fork')
+@patch('app.commands.run_analytics._analyze_course', fake_analyze)
+class TestRunAnalytics(unittest.TestCase):
+    """Test suite for the run_analytics command"""
+
+    def test_timeout_crash_and_success(self):
+        """Test a hung course is killed, a crashed one reported, and the others complete"""
+        results = run_analytics._run_in_processes(['ok', 'crash', 'hang', 'ok2'], workers=2, timeout=2, incremental=None)
+
+        self.assertEqual(results['ok']['status'], 'complete')
+        self.assertEqual(results['ok2']['num_clusters'], 2)
+        self.assertEqual(results['crash'], {'status': 'error', 'error': 'worker exited with code 3',
+                                            'seconds': results['crash']['seconds']})
+        self.assertEqual(results['hang']['status'], 'timeout')
+        self.assertGreaterEqual(results['hang']['seconds'], 2)
+        self.assertLess(results['hang']['seconds'], 30)
+
+    @patch('app.commands.run_analytics.has_analytics_events_since')
+    @patch('app.commands.run_analytics.get_cluster_state')
+    @patch('app.commands.run_analytics.list_course_ids')
+    def test_skips_courses_without_new_events(self, mock_list_course_ids, mock_get_cluster_state, mock_has_new):
+        """Test only courses never clustered, or with events after their watermark, are run"""
+        mock_list_course_ids.return_value = ['quiet', 'new', 'busy']
+        mock_get_cluster_state.side_effect = lambda course_id: None if course_id == 'new' else {'watermark': 't0'}
+        mock_has_new.side_effect = lambda course_id, since: course_id == 'busy'
+
+        summary = run_analytics.run_all_analytics(workers=2, timeout=30)
+
+        statuses = {course['course_id']: course['status'] for course in summary['courses']}
+        self.assertEqual(statuses, {'quiet': 'skipped', 'new': 'complete', 'busy': 'complete'})
+        self.assertEqual(summary['statuses'], {'skipped': 1, 'complete': 2})
+        mock_has_new.assert_any_call('quiet', 't0')
+
+    @patch('app.commands.run_analytics._run_in_processes')
+    def test_repeated_course_ids_run_once(self, mock_run_in_processes):
+        """Test a course given twice is only analyzed (and reported) once"""
+        mock_run_in_processes.return_value = {'c1': {'status': 'complete', 'seconds': 1.0}}
+
+        summary = run_analytics.run_all_analytics(course_ids=['c1', 'c1'], force=True)
+
+        mock_run_in_processes.assert_called_once_with(['c1'], run_analytics.RUN_WORKERS, run_analytics.RUN_TIMEOUT, None)
+        self.assertEqual(summary['total_courses'], 1)
+
+    @patch('app.commands.run_analytics.run_all_analytics')
+    def test_exit_code(self, mock_run_all_analytics):
+        """Test the command fails when any course errored or timed out"""
+        def summary(statuses):
+            return {'total_courses': 1, 'statuses': statuses, 'duration_seconds': 1.0, 'workers': 1, 'courses': []}
+
+        with patch.object(sys, 'argv', ['run_analytics']):
+            mock_run_all_analytics.return_value = summary({'complete': 1, 'skipped': 2})
+            self.assertEqual(run_analytics.main(), 0)
+            mock_run_all_analytics.return_value = summary({'complete': 1, 'timeout': 1})
+            self.assertEqual(run_analytics.main(), 1)
+
+if __name__ == '__main__':
+    unittest.main()
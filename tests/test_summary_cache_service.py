@@ -0,0 +1,69 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+import tempfile
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import summary_cache_service
+
+class TestSummaryCacheService(unittest.TestCase):
+    """Test suite for Summary Cache service functions"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir_patch = patch.object(summary_cache_service, 'CACHE_DIR', self.tmp_dir.name)
+        self.dir_patch.start()
+
+    def tearDown(self):
+        self.dir_patch.stop()
+        self.tmp_dir.cleanup()
+
+    def test_cache_key_depends_on_hash_prompt_and_model(self):
+        """Test the cache key changes with any of its three inputs"""
+        key = summary_cache_service.cache_key('abc', 'prompt', 'model')
+
+        self.assertEqual(key, summary_cache_service.cache_key('abc', 'prompt', 'model'))
+        self.assertNotEqual(key, summary_cache_service.cache_key('abd', 'prompt', 'model'))
+        self.assertNotEqual(key, summary_cache_service.cache_key('abc', 'prompt v2', 'model'))
+        self.assertNotEqual(key, summary_cache_service.cache_key('abc', 'prompt', 'other-model'))
+
+    def test_content_hash_matches_md5(self):
+        """Test content_hash returns the md5 of the file bytes"""
+        path = os.path.join(self.tmp_dir.name, 'file.pdf')
+        with open(path, 'wb') as f:
+            f.write(b'hello')
+
+        self.assertEqual(summary_cache_service.content_hash(path), '5d41402abc4b2a76b9719d911017c592')
+
+    @patch('app.services.summary_cache_service.firestore_service')
+    def test_put_then_get_from_disk(self, mock_firestore_service):
+        """Test a stored summary is served from disk without Firestore"""
+        summary_cache_service.put_summary('key1', 'This file discusses...', 'abc', 'model')
+
+        summary = summary_cache_service.get_summary('key1')
+
+        self.assertEqual(summary, 'This file discusses...')
+        mock_firestore_service.save_cached_summary.assert_called_once()
+        mock_firestore_service.get_cached_summary.assert_not_called()
+
+    @patch('app.services.summary_cache_service.firestore_service')
+    def test_get_falls_back_to_firestore(self, mock_firestore_service):
+        """Test a disk miss is served from Firestore and written back to disk"""
+        mock_firestore_service.get_cached_summary.return_value = {'summary': 'Shared summary'}
+
+        self.assertEqual(summary_cache_service.get_summary('key2'), 'Shared summary')
+        self.assertEqual(summary_cache_service.get_summary('key2'), 'Shared summary')
+        mock_firestore_service.get_cached_summary.assert_called_once_with('key2')
+
+    @patch('app.services.summary_cache_service.firestore_service')
+    def test_get_miss(self, mock_firestore_service):
+        """Test a miss in both layers returns None"""
+        mock_firestore_service.get_cached_summary.return_value = {}
+
+        self.assertIsNone(summary_cache_service.get_summary('key3'))
+
+if __name__ == '__main__':
+    unittest.main()